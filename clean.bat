@@ -1,12 +1,26 @@
 @echo off
-del /F log/*.xml
+rem clean.bat <workspace>: a run workspace (see libs/workspace.py) is removed as a whole
+if not "%~1"=="" (
+    if "%~1"=="." goto refuse
+    if "%~1"=="/" goto refuse
+    if "%~1"=="\" goto refuse
+    if /I "%~f1"=="%~dp0" goto refuse
+    if /I "%~f1\"=="%~dp0" goto refuse
+    if /I "%~f1"=="%~d1\" goto refuse
+    if not exist "%~1\.masi_workspace" goto refuse
+    rmdir /Q /S "%~1"
+    exit /b 0
+)
 rmdir /Q /S log
-del /F peeks/*.xml
 rmdir /Q /S peeks
-del /F xml/*.xml
-del /F xml/*.txt
+rmdir /Q /S columnar
 rmdir /Q /S xml
 del /F kp.csv
 del /F *.db
 rmdir /Q /S __pycache__
 del /F clean.xml
+exit /b 0
+
+:refuse
+echo Refusing to remove "%~1": not a run workspace (no .masi_workspace marker).
+exit /b 1
@@ -1,11 +1,24 @@
 #!/bin/sh
 
-rm -f log/*.xml
+# clean.sh <workspace>: a run workspace (see libs/workspace.py) is removed as a whole
+if [ -n "$1" ]; then
+    target=$(cd -- "$1" 2>/dev/null && pwd -P)
+    repo=$(cd -- "$(dirname -- "$0")" && pwd -P)
+    if [ -z "$target" ] || [ "$target" = "/" ] || [ "$target" = "$repo" ] || \
+       [ "$1" = "." ] || [ "$1" = "/" ] || [ ! -f "$1/.masi_workspace" ]; then
+        echo "Refusing to remove '$1': not a run workspace (no .masi_workspace marker)."
+        exit 1
+    fi
+    rm -rf -- "$target"
+    exit 0
+fi
+
+# Whole trees: globbing xml/*.xml is slow with huge flat directories and
+# does not reach the sharded layout (libs/xmllayout.py)
 rm -fr log
-rm -f xml/*.xml
-rm -f xml/*.txt
 rm -fr xml
 rm -fr peeks
+rm -fr columnar
 rm -f kp.csv
 rm -f *.db
 rm -rf __pycache__
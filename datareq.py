@@ -13,7 +13,8 @@ except ImportError:
 
 # Import shared utilities from req_utils
 try:
-    from libs.req_utils import send_generic, Printer, DEBUG as RU_DEBUG, dprint as ru_dprint, xml_path
+    from libs.req_utils import send_generic, Printer, DEBUG as RU_DEBUG, dprint as ru_dprint, workspace_xml_path
+    from libs import workspace, xmllayout
 except ImportError:
     print('Error: req_utils.py missing from libs directory. datareq.py cannot function.')
     exit()
@@ -24,20 +25,13 @@ def dprint(*s): # Local dprint for this file's specific debug messages
     if DEBUG:
         print(("[datareq_local] ",) + s if isinstance(s, tuple) else ("[datareq_local] ", s))
 
-# xml_dir still uses xml_path, which is now imported from req_utils
+# xml_dir lists the xml directory of the run workspace, as given by req_utils,
+# in the flat or the sharded layout (libs/xmllayout.py)
 def xml_dir(xml_type=None):
     dprint(f'xml_dir({xml_type})')
-    xml_files = []
-    for _,_ , files in os.walk(xml_path): # Using imported xml_path
-        if xml_type == 'kulutus':
-            for file in files:
-                if file.startswith('kulutus_'):
-                    xml_files.append(file)
-        elif xml_type == 'rajapiste':
-            for file in files:
-                if file.startswith('rajapiste_'):
-                    xml_files.append(file)
-    return sorted(xml_files)
+    if xml_type not in ('kulutus', 'rajapiste'):
+        return []
+    return xmllayout.names(workspace_xml_path(), xml_type + '_')
 
 # Printer is imported from req_utils
 # send_generic is imported from req_utils
@@ -116,6 +110,7 @@ def thread_loop(block_size):
         exit()
 
 def main():
+    workspace.from_argv(sys.argv[1:])
     if thread:
         thread_loop(10)
     else:
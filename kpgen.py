@@ -6,14 +6,44 @@ import csv
 import sys
 import os
 import getopt
+import copy
+import multiprocessing
+import shutil
 import xml.etree.ElementTree as ET
 
 try:
-    from libs.kirjasto import gen_id, gen_timestamp, add_check_digit
+    from libs.kirjasto import gen_id, gen_ids, gen_timestamp, add_check_digit_block
 except ImportError:
     print('Error: libs.kirjasto.py missing. Please ensure it is in the libs directory.')
     sys.exit(1)
 
+try:
+    from libs.apallocator import APIdAllocator, MAX_ID_NUM
+except ImportError:
+    print('Error: libs.apallocator.py missing. Please ensure it is in the libs directory.')
+    sys.exit(1)
+
+try:
+    from libs import population
+except ImportError:
+    print('Error: libs.population.py missing. Please ensure it is in the libs directory.')
+    sys.exit(1)
+
+try:
+    from libs import workspace, xmllayout
+except ImportError:
+    print('Error: libs.workspace.py or libs.xmllayout.py missing. Please ensure they are in the libs directory.')
+    sys.exit(1)
+
+try:
+    from libs.refpack import load_pack, AddressSampler
+except ImportError:
+    load_pack = None # Fall back to reading libs/osoitteet.txt directly
+
+CHUNK_SIZE = 10000 # APs rendered and written to kp.csv at a time
+USAGE = ('Usage: kpgen.py [--workspace <dir>] [-j <DSO>] [-m <MGA>] [-l <num_aps>] [-t <type AG01|AG02>] [-r <remote 0|1>] [-M <method E13|E14|E16>]\n'
+         '       kpgen.py [--workspace <dir>] -p <population spec.json> [-w <workers>]')
+
 # Config import will be attempted in _load_config
 # from libs.fconfig import jakeluverkkoyhtio, MGA, dealers, id_range, limit
 
@@ -28,8 +58,10 @@ class AccountingPointGenerator:
         self.metering_method_code = None # e.g., E13
         self.num_aps_to_generate = 0
 
-        self.generated_ap_ids = []
+        self.ap_id_block = None # (prefix, first numeric part, amount), IDs are rendered chunk by chunk
+        self._xml_template = None # Parsed once, copied for each AP
         self.osoitteet_list = []
+        self.address_sampler = None # MGA aware sampling from the reference pack
         self.current_address_details = {} # To store details from _get_random_address for CSV
 
         self._load_config()
@@ -48,6 +80,14 @@ class AccountingPointGenerator:
             print('Error: libs.fconfig.py missing or incomplete. Please ensure it is in the libs directory and properly configured.')
             raise # Re-raise to be caught by main exception handler
 
+        try: # Optional, older fconfig.py files do not have it
+            from libs.fconfig import mga_postal_regions
+            self.config['mga_postal_regions'] = mga_postal_regions
+        except ImportError:
+            self.config['mga_postal_regions'] = None
+
+        self.config['xml_layout'] = xmllayout.configured() # flat or sharded xml/, see libs/xmllayout.py
+
         if not self.config.get('dealers'):
             print("Configuration Error: No dealers configured in libs/fconfig.py. Please check the 'dealers' list.")
             raise ValueError("Missing 'dealers' configuration in fconfig.py")
@@ -62,6 +102,16 @@ class AccountingPointGenerator:
 
     def _load_dependencies(self):
         """Loads external dependencies like osoitteet.txt."""
+        if load_pack is not None:
+            try:
+                # Memory-mapped, items are decoded only when sampled
+                pack = load_pack()
+                self.osoitteet_list = pack.section('osoitteet')
+                self.address_sampler = AddressSampler(pack, self.config.get('mga_postal_regions'))
+                if len(self.osoitteet_list):
+                    return
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Warning: Reference pack unavailable ({e}), reading 'libs/osoitteet.txt' instead.")
         try:
             # Assuming osoitteet.txt is in libs directory, relative to where script is run or add specific path logic
             with open('libs/osoitteet.txt', 'r', encoding='latin-1') as f:
@@ -217,7 +267,10 @@ class AccountingPointGenerator:
 
 
     def generate_ap_ids(self):
-        """Generates a list of unique Accounting Point IDs."""
+        """
+        Reserves a block of unique Accounting Point IDs. The IDs themselves
+        are produced CHUNK_SIZE at a time by ap_id_chunks().
+        """
         if not self.selected_dso or self.num_aps_to_generate == 0:
             raise ValueError("DSO and number of APs must be set before generating IDs.")
 
@@ -227,31 +280,37 @@ class AccountingPointGenerator:
         if id_range_start is not None:
             if not isinstance(id_range_start, int) or id_range_start <= 0:
                  raise ValueError("Configuration error: id_range in fconfig.py must be a positive integer.")
-            if id_range_start > 90000000: # Max value for the numeric part
-                raise ValueError("Configuration error: id_range in fconfig.py exceeds the maximum value of 90000000.")
-            current_id_num = id_range_start
-        else:
-            current_id_num = ra.randint(1, 90000000 - self.num_aps_to_generate) # Ensure range doesn't exceed max
-
-        self.generated_ap_ids = []
-        for _ in range(self.num_aps_to_generate):
-            # Ensure the numeric part does not exceed 9 digits total (90,000,000 implies 8 digits, zfill(9) handles up to 9)
-            # If current_id_num + i could exceed 99,999,999, this needs more careful handling
-            # For now, assume id_range_start + num_aps_to_generate won't exceed this.
-            ap_numeric_part = str(current_id_num).zfill(9)
-            full_ap_base = prefix + ap_numeric_part
-            self.generated_ap_ids.append(add_check_digit(int(full_ap_base)))
-            current_id_num += 1
-        print(f"Generated {len(self.generated_ap_ids)} AP IDs.")
+            if id_range_start > MAX_ID_NUM: # Max value for the numeric part
+                raise ValueError(f"Configuration error: id_range in fconfig.py exceeds the maximum value of {MAX_ID_NUM}.")
+
+        # The allocator remembers ranges used by earlier runs (ap_ranges.json, seeded from kp.csv)
+        # so the block never overlaps IDs already generated for this DSO prefix.
+        allocator = APIdAllocator(csv_path=workspace.path('kp.csv'))
+        first_id_num = allocator.reserve(prefix, self.num_aps_to_generate, start=id_range_start)
+
+        self.ap_id_block = (prefix, first_id_num, self.num_aps_to_generate)
+        print(f"Reserved {self.num_aps_to_generate} AP IDs.")
+
+    def ap_id_chunks(self, size=CHUNK_SIZE):
+        """Yields the reserved AP IDs as lists of at most size IDs."""
+        if self.ap_id_block is None:
+            return
+        prefix, first_id_num, count = self.ap_id_block
+        for offset in range(0, count, size):
+            yield add_check_digit_block(prefix, first_id_num + offset, min(size, count - offset))
 
     def _get_random_address(self):
         """Selects a random address and stores its parts."""
-        if not self.osoitteet_list:
+        if not len(self.osoitteet_list):
             # This should ideally be caught by _load_dependencies, but as a safeguard:
             print("Critical Error: Address list (osoitteet.txt) is empty or not loaded.")
             raise FileNotFoundError("Address list is empty.")
 
-        address_line = ra.choice(self.osoitteet_list)
+        if self.address_sampler is not None:
+            # Geographically consistent with the MGA if it has postal regions configured
+            address_line = self.address_sampler.sample(self.selected_mga)
+        else:
+            address_line = ra.choice(self.osoitteet_list)
         try:
             parts = address_line.split(',')
             if len(parts) < 3: # Basic check for enough parts
@@ -273,16 +332,21 @@ class AccountingPointGenerator:
         # The check for empty dealers is in _load_config
         return ra.choice(self.config['dealers'])
 
-    def produce_xml_for_ap(self, ap_id: str):
-        """Produces an XML file for a single Accounting Point ID."""
+    def produce_xml_for_ap(self, ap_id: str, message_id=None):
+        """
+        Produces an XML file for a single Accounting Point ID.
+        message_id is the header Identification, drawn per chunk by the caller.
+        """
         xml_template_path = 'libs/xml_template.xml'
-        output_xml_dir = 'xml'
+        output_xml_dir = workspace.path('xml')
 
         try:
             if not os.path.exists(output_xml_dir):
                 os.makedirs(output_xml_dir)
 
-            tree = ET.parse(xml_template_path)
+            if self._xml_template is None:
+                self._xml_template = ET.parse(xml_template_path)
+            tree = copy.deepcopy(self._xml_template)
 
             # XML Namespace dictionary (consider making this a class attribute if used often)
             ns = {
@@ -307,7 +371,7 @@ class AccountingPointGenerator:
             NS_E58 = "urn:fi:Datahub:mif:masterdata:E58_MasterDataMPEvent:elements:v1"
 
             # Header elements
-            tree.find(f".//{{{NS_HDR}}}Identification").text = gen_id(True)
+            tree.find(f".//{{{NS_HDR}}}Identification").text = message_id or gen_id(True)
             # Assuming PhysicalSenderEnergyParty and JuridicalSenderEnergyParty are complex elements
             # and their Identification child needs to be set.
             tree.find(f".//{{{NS_HDR}}}PhysicalSenderEnergyParty/{{{NS_HDR}}}Identification").text = self.selected_dso
@@ -408,8 +472,10 @@ class AccountingPointGenerator:
                  print(f"Warning: No MPDetailMeteringPointCharacteristic elements found for AP {ap_id}")
 
 
-            output_file_path = os.path.join(output_xml_dir, f"apoint_{ap_id}.xml")
-            tree.write(output_file_path, encoding='utf-8', xml_declaration=True)
+            # A file or a segment record, see libs/xmllayout.py
+            with xmllayout.create(output_xml_dir, f"apoint_{ap_id}.xml", self.config['xml_layout']) as f:
+                f.write("<?xml version='1.0' encoding='utf-8'?>\n")
+                tree.write(f, encoding='unicode')
             # print(f"Successfully wrote XML for {ap_id} to {output_file_path}")
             return True
 
@@ -420,81 +486,149 @@ class AccountingPointGenerator:
             print(f"Error: Failed to parse XML template '{xml_template_path}': {e}")
             return False
         except IOError as e:
-            print(f"Error: Failed to write XML to '{output_file_path}': {e}")
+            print(f"Error: Failed to write XML to '{output_xml_dir}/apoint_{ap_id}.xml': {e}")
             return False
         except Exception as e: # Catch-all for other issues during XML production
             print(f"An unexpected error occurred during XML production for {ap_id}: {e}")
             return False
 
+    def run_population(self, spec_path, workers=None):
+        """
+        Generates a whole population from a spec (see libs/population.py):
+        every DSO/MGA/AP type/method combination in one run. The ID blocks
+        are reserved here, the tasks run in worker processes forked from this
+        one, so the addresses are loaded only once, and each task writes its
+        own part of kp.csv. The parts are appended to kp.csv in spec order.
+        """
+        try:
+            segments = population.load_spec(spec_path, self.config['jakeluverkkoyhtio'], self.config['MGA'],
+                                            self.config.get('limit'))
+            id_range_start = self.config.get('id_range')
+            allocator = APIdAllocator(csv_path=workspace.path('kp.csv'))
+            first_ids = [allocator.reserve(segment['dso'][:8], segment['count'], start=id_range_start)
+                         for segment in segments]
+        except FileNotFoundError:
+            print(f"Error: Population spec '{spec_path}' not found.")
+            return
+        except ValueError as e:
+            print(f"A configuration or parameter error occurred: {e}")
+            print("Accounting Point Generation aborted.")
+            return
+
+        csv_file_path = workspace.path('kp.csv')
+        jobs = [(task, f"{csv_file_path}.part{index}") for index, task in enumerate(population.tasks(segments, first_ids))]
+        workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+        print(f"Generating {sum(segment['count'] for segment in segments)} AP(s) in {len(segments)} segment(s), "
+              f"{len(jobs)} task(s), {workers} worker(s)...")
+
+        global _population_generator
+        _population_generator = self
+        file_exists = os.path.isfile(csv_file_path) and os.path.getsize(csv_file_path) > 0
+        with open(csv_file_path, 'a', newline='', encoding='utf-8') as f:
+            if not file_exists:
+                csv.writer(f).writerow(self.CSV_HEADER)
+                f.flush()
+            if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+                with multiprocessing.get_context('fork').Pool(workers) as pool:
+                    written = self._append_parts(f, pool.imap(_population_task, jobs))
+            else: # No fork (Windows): the tasks run one after another in this process
+                written = self._append_parts(f, map(_population_task, jobs))
+        print(f"Population complete: {written} AP(s) written to '{csv_file_path}'.")
+
+    @staticmethod
+    def _append_parts(f, results):
+        """Appends the kp.csv parts of finished tasks in task order. Output: rows appended"""
+        written = 0
+        for part_path, count in results:
+            with open(part_path, 'r', newline='', encoding='utf-8') as part:
+                shutil.copyfileobj(part, f)
+            f.flush()
+            os.remove(part_path)
+            written += count
+        return written
+
+    CSV_HEADER = ['Accounting point', 'Metering Area', 'Supplier', 'DSO', 'MGA',
+                  'ZIP', 'Street', 'City', 'AP type', 'Remote readable', 'Metering method']
+
+    def _write_csv_rows(self, f, writer, label=''):
+        """
+        Produces the XML of the reserved APs and writes their kp.csv rows,
+        one chunk at a time. Output: amount of rows written
+        """
+        metering_area_prefix = self.selected_dso[:8] if self.selected_dso else "ERR_DSO"
+        metering_area = metering_area_prefix + '00000000'
+
+        written = 0
+        for ap_ids in self.ap_id_chunks():
+            # Message IDs of the chunk in one block, see kirjasto.gen_ids
+            for ap_id, message_id in zip(ap_ids, gen_ids(len(ap_ids), True)):
+                # XML production for each AP is now separated.
+                # We rely on self.current_address_details being set by _get_random_address,
+                # which should be called if XML was produced.
+                # For CSV, we need an address even if XML failed, or skip.
+                # Let's call _get_random_address here to ensure it's fresh for each CSV row,
+                # matching the original intent where address was per-AP.
+                # However, produce_xml_for_ap already calls it.
+                # If XML fails, we might not have an address.
+                # Decision: If XML fails, we skip CSV row as we can't guarantee address consistency
+                # with what *would* have been in XML.
+
+                xml_success = self.produce_xml_for_ap(ap_id, message_id) # This also sets self.current_address_details
+
+                if xml_success:
+                    supplier = self._get_random_supplier()
+                    writer.writerow([
+                        ap_id,
+                        metering_area,
+                        supplier,
+                        self.selected_dso,
+                        self.selected_mga,
+                        self.current_address_details.get('zip', 'N/A'),
+                        self.current_address_details.get('street', 'N/A'),
+                        self.current_address_details.get('city', 'N/A'),
+                        self.ap_type_code,
+                        self.remote_readable_code,
+                        self.metering_method_code
+                    ])
+                    # Ensure that current_address_details are populated for the CSV,
+                    # even if XML production might have had issues unrelated to address fetching.
+                    # However, produce_xml_for_ap already calls _get_random_address.
+                    # If XML succeeded, current_address_details should be from that successful XML generation.
+                    # If XML failed, self.current_address_details might be from a previous successful call
+                    # or empty if no AP has succeeded yet.
+                    # For consistency, if XML fails, we might want to call _get_random_address
+                    # again for the CSV, or explicitly state that address details in CSV might be
+                    # inconsistent if its corresponding XML failed.
+                    # The current logic in skeleton is if xml_success, then write. This is safer.
+                    written += 1
+                else:
+                    print(f"Skipping CSV entry for AP {ap_id} due to XML generation failure.")
+            f.flush() # The chunk's rows are on disk before the next chunk is rendered
+            print(f"{label}Wrote {written}/{self.num_aps_to_generate} AP(s) to CSV.")
+        return written
+
     def write_csv_summary(self):
         """Writes a summary of generated APs to kp.csv."""
-        if not self.generated_ap_ids:
+        if self.ap_id_block is None:
             print("No Accounting Point IDs were generated. Skipping CSV summary.")
             return
 
-        csv_file_path = 'kp.csv'
+        csv_file_path = workspace.path('kp.csv')
         file_exists = os.path.isfile(csv_file_path)
 
         try:
             with open(csv_file_path, 'a', newline='', encoding='utf-8') as f:
                 writer = csv.writer(f)
                 if not file_exists or os.path.getsize(csv_file_path) == 0:
-                    writer.writerow([
-                        'Accounting point', 'Metering Area', 'Supplier', 'DSO', 'MGA',
-                        'ZIP', 'Street', 'City', 'AP type', 'Remote readable', 'Metering method'
-                    ])
+                    writer.writerow(self.CSV_HEADER)
 
                 if not self.selected_dso or not self.selected_mga: # Should be set by _determine_generation_parameters
                      print("Error: DSO or MGA not selected. Cannot write CSV summary accurately.")
                      return
 
-                metering_area_prefix = self.selected_dso[:8] if self.selected_dso else "ERR_DSO"
-                metering_area = metering_area_prefix + '00000000'
-
-                for ap_id in self.generated_ap_ids:
-                    # XML production for each AP is now separated.
-                    # We rely on self.current_address_details being set by _get_random_address,
-                    # which should be called if XML was produced.
-                    # For CSV, we need an address even if XML failed, or skip.
-                    # Let's call _get_random_address here to ensure it's fresh for each CSV row,
-                    # matching the original intent where address was per-AP.
-                    # However, produce_xml_for_ap already calls it.
-                    # If XML fails, we might not have an address.
-                    # Decision: If XML fails, we skip CSV row as we can't guarantee address consistency
-                    # with what *would* have been in XML.
-
-                    xml_success = self.produce_xml_for_ap(ap_id) # This also sets self.current_address_details
-
-                    if xml_success:
-                        supplier = self._get_random_supplier()
-                        writer.writerow([
-                            ap_id,
-                            metering_area,
-                            supplier,
-                            self.selected_dso,
-                            self.selected_mga,
-                            self.current_address_details.get('zip', 'N/A'),
-                            self.current_address_details.get('street', 'N/A'),
-                            self.current_address_details.get('city', 'N/A'),
-                            self.ap_type_code,
-                            self.remote_readable_code,
-                            self.metering_method_code
-                        ])
-                        # Ensure that current_address_details are populated for the CSV,
-                        # even if XML production might have had issues unrelated to address fetching.
-                        # However, produce_xml_for_ap already calls _get_random_address.
-                        # If XML succeeded, current_address_details should be from that successful XML generation.
-                        # If XML failed, self.current_address_details might be from a previous successful call
-                        # or empty if no AP has succeeded yet.
-                        # For consistency, if XML fails, we might want to call _get_random_address
-                        # again for the CSV, or explicitly state that address details in CSV might be
-                        # inconsistent if its corresponding XML failed.
-                        # The current logic in skeleton is if xml_success, then write. This is safer.
-                        print(f"Wrote entry for AP {ap_id} to CSV.")
-                    else:
-                        print(f"Skipping CSV entry for AP {ap_id} due to XML generation failure.")
-
-            if self.generated_ap_ids: # Only print if there was an attempt to write data.
+                self._write_csv_rows(f, writer)
+
+            if self.ap_id_block is not None: # Only print if there was an attempt to write data.
                 print(f"CSV summary processing complete. Check '{csv_file_path}' for details.")
 
         except IOError as e:
@@ -511,7 +645,7 @@ class AccountingPointGenerator:
             self._determine_generation_parameters() # Handles its own ValueErrors for bad params
             self.generate_ap_ids() # Handles its own ValueErrors for bad id_range
 
-            if not self.generated_ap_ids:
+            if self.ap_id_block is None:
                 print("No Accounting Point IDs were generated, likely due to configuration or input errors.")
                 print("Accounting Point Generation aborted.")
                 return
@@ -530,23 +664,48 @@ class AccountingPointGenerator:
         # to be caught by the top-level handler in __main__
 
 
+_population_generator = None # Set by run_population, inherited by the forked workers
+
+def _population_task(job):
+    """
+    Worker of run_population: produces the XML and the kp.csv part of one task.
+    Output: (part path, rows written)
+    """
+    (dso, mga, ap_type, remote, method, first_id_num, count), part_path = job
+    generator = _population_generator
+    generator.selected_dso, generator.selected_mga = dso, mga
+    generator.ap_type_code, generator.remote_readable_code, generator.metering_method_code = ap_type, remote, method
+    generator.num_aps_to_generate = count
+    generator.ap_id_block = (dso[:8], first_id_num, count)
+    with open(part_path, 'w', newline='', encoding='utf-8') as f:
+        written = generator._write_csv_rows(f, csv.writer(f), label=f"{dso} {mga} {ap_type}/{remote}/{method}: ")
+    xmllayout.close() # Pool workers exit without atexit, the segments are indexed here
+    return part_path, written
+
+
 if __name__ == "__main__":
     cmd_opts_dict = {}
+    population_spec = None
+    population_workers = None
     # Define short and long options based on original script's getopt
-    short_opts = "hl:j:m:t:r:M:"
-    long_opts = ["kp_lkm=", "jvy=", "mga=", "aptype=", "remote=", "method="]
+    short_opts = "hl:j:m:t:r:M:p:w:"
+    long_opts = ["kp_lkm=", "jvy=", "mga=", "aptype=", "remote=", "method=", "population=", "workers="]
 
     try:
+        # --workspace selects where kp.csv and xml/ go, the other options are parsed as before
+        argv = workspace.from_argv(sys.argv[1:])
         # Parse command line arguments if any
-        if len(sys.argv) > 1:
+        if argv:
             # Check for help option first, as it doesn't require other args
-            if '-h' in sys.argv[1:] or '--help' in sys.argv[1:]: # getopt doesn't handle -h well alone
-                 print('Usage: kpgen.py [-j <DSO>] [-m <MGA>] [-l <num_aps>] [-t <type AG01|AG02>] [-r <remote 0|1>] [-M <method E13|E14|E16>]')
+            if '-h' in argv or '--help' in argv: # getopt doesn't handle -h well alone
+                 print(USAGE)
                  print('If any cmd args are used, all must be provided for non-interactive mode.')
+                 print('-p: Generate the DSO/MGA population of a JSON spec (see libs/population.py), -w: worker processes.')
+                 print('--workspace: Write kp.csv and xml/ under <dir> (see libs/workspace.py).')
                  print('-h: This help message.')
                  sys.exit(0)
 
-            opts, args = getopt.getopt(sys.argv[1:], short_opts, long_opts)
+            opts, args = getopt.getopt(argv, short_opts, long_opts)
             for opt, arg_val in opts:
                 if opt in ('-l', '--kp_lkm'):
                     cmd_opts_dict['kp_lkm'] = arg_val
@@ -560,13 +719,22 @@ if __name__ == "__main__":
                     cmd_opts_dict['remote'] = arg_val
                 elif opt in ('-M', '--method'):
                     cmd_opts_dict['method'] = arg_val
-
-        generator = AccountingPointGenerator(cmd_args=cmd_opts_dict)
-        generator.run()
+                elif opt in ('-p', '--population'):
+                    population_spec = arg_val
+                elif opt in ('-w', '--workers'):
+                    population_workers = int(arg_val)
+
+        if population_spec:
+            if cmd_opts_dict:
+                raise ValueError("A population spec (-p) replaces -j, -m, -l, -t, -r and -M.")
+            AccountingPointGenerator().run_population(population_spec, population_workers)
+        else:
+            generator = AccountingPointGenerator(cmd_args=cmd_opts_dict)
+            generator.run()
 
     except getopt.GetoptError as e:
         print(f"Argument parsing error: {e}")
-        print('Usage: kpgen.py [-j <DSO>] [-m <MGA>] [-l <num_aps>] [-t <type AG01|AG02>] [-r <remote 0|1>] [-M <method E13|E14|E16>]')
+        print(USAGE)
         sys.exit(2)
     except ImportError as e: # Catches fconfig import errors from _load_config
         print(f"Import error: {e}. Please ensure all dependencies are correctly installed and paths are correct.")
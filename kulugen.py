@@ -1,12 +1,17 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import bisect
 import datetime
+import json
 import random as ra
 import sys
 import os # Changed from os.path to os for makedirs
+import re
 import sqlite3
 import csv
+import itertools
+import zlib
 from os import name as os_name # aliased to avoid conflict with local 'name'
 from getopt import getopt, GetoptError
 from cmd import Cmd
@@ -25,14 +30,122 @@ else:
 
 # Standard library imports first, then project-specific
 try:
-    from libs.kirjasto import gen_timestamp # add_check_digit is not used in this file
-    # Removed: gen_id from kirjasto, will use a local _generate_session_id or similar for now
+    from libs.kirjasto import gen_timestamp, id_source # add_check_digit is not used in this file
 except ImportError:
     print(red + bold + 'Error: kirjasto.py missing or incomplete. Please consult Fingrid Datahub test team.' + reset)
     sys.exit(1)
 
+try:
+    from libs.timeaxis import TimeAxis
+except ImportError:
+    print(red + bold + 'Error: timeaxis.py missing from libs directory (requires pytz).' + reset)
+    sys.exit(1)
+
+try:
+    from libs.loadprofile import LoadProfiles
+except ImportError:
+    print(red + bold + 'Error: loadprofile.py missing from libs directory.' + reset)
+    sys.exit(1)
+
+try:
+    from libs.replay import open_replay
+except ImportError:
+    print(red + bold + 'Error: replay.py missing from libs directory.' + reset)
+    sys.exit(1)
+
+try:
+    from libs.colstore import ColumnStore
+except ImportError:
+    print(red + bold + 'Error: colstore.py missing from libs directory.' + reset)
+    sys.exit(1)
+
+try:
+    from libs.seriesstore import SeriesStore
+except ImportError:
+    print(red + bold + 'Error: seriesstore.py missing from libs directory.' + reset)
+    sys.exit(1)
+
+try:
+    from libs.partitions import PartitionSet
+except ImportError:
+    print(red + bold + 'Error: partitions.py missing from libs directory.' + reset)
+    sys.exit(1)
+
+try:
+    from libs import aggregates
+except ImportError:
+    print(red + bold + 'Error: aggregates.py missing from libs directory.' + reset)
+    sys.exit(1)
+
+try:
+    from libs.apregistry import APRegistry
+except ImportError:
+    print(red + bold + 'Error: apregistry.py missing from libs directory.' + reset)
+    sys.exit(1)
+
+try:
+    from libs import workspace
+except ImportError:
+    print(red + bold + 'Error: workspace.py missing from libs directory.' + reset)
+    sys.exit(1)
+
+try:
+    from libs import xmllayout
+except ImportError:
+    print(red + bold + 'Error: xmllayout.py missing from libs directory.' + reset)
+    sys.exit(1)
+
 # fconfig imports will be handled by ConsumptionGenerator._load_config
 
+# Observation resolutions (E66 ResolutionDuration)
+QUARTER_HOURLY = 'PT15M'
+HOURLY = 'PT1H'
+DAILY = 'P1D'
+MONTHLY = 'P1M'
+# Read periods of E14 reading-metered APs (fconfig.py e14_read_period)
+READ_PERIODS = (DAILY, MONTHLY)
+# E14 register readings start from a per AP value below this (kWh)
+REGISTER_START_RANGE = 100000
+# Time axis step of the series resolutions
+INTERVAL_MINUTES = {QUARTER_HOURLY: 15, HOURLY: 60}
+# Observations are written in place of this line of the kulutus/rajapiste templates
+OBSERVATIONS_PLACEHOLDER = '<!--Kulutus-->'
+# Element standing in for the placeholder while the header is filled, split off when writing
+OBSERVATIONS_SLOT = '<masi_observations />'
+# Points read from kp.csv/rp.csv, looked up and committed (with the checkpoint) at a time
+CHUNK_SIZE = 500
+
+def ap_resolution(method, series=HOURLY, read_period=MONTHLY):
+    """
+    Input: kp.csv 'Metering method', run's series resolution, E14 read period
+    Output: resolution of the AP's metered data, None if it reports none
+    E13 continuously metered APs report series (PT1H or PT15M) whether or
+    not they are remote readable, E14 reading-metered APs one cumulative
+    register read per read period (P1D or P1M), E16 unmetered APs nothing
+    (they are settled from load profiles).
+    """
+    method = (method or '').strip()
+    if method == 'E16':
+        return None
+    if method == 'E14':
+        return read_period
+    return series # E13, or an unknown method: the original behaviour
+
+# rp.csv columns: the shipped header (id,dso,in,out,min,max) or the older upper case names
+RP_COLUMNS = {'ID': ('id', 'ID', 'RPOINT_ID'), 'DSO': ('dso', 'DSO'), 'IN_AREA': ('in', 'IN_AREA'),
+              'OUT_AREA': ('out', 'OUT_AREA'), 'MIN_KWH': ('min', 'MIN_KWH'), 'MAX_KWH': ('max', 'MAX_KWH')}
+
+def rp_fields(row):
+    """
+    Input: rp.csv row dict of either header set
+    Output: dict with the keys of RP_COLUMNS, None for a missing column
+    """
+    return {key: next((row[name] for name in names if row.get(name)), None) for key, names in RP_COLUMNS.items()}
+
+def register_start(point_id):
+    """Output: E14 register reading (kWh) of an AP before its first generated read"""
+    return float(zlib.crc32(str(point_id).encode('utf-8')) % REGISTER_START_RANGE)
+
 class Printer:
     """Simple utility to print data to stdout on one line, overwriting previous."""
     def __init__(self, data):
@@ -46,11 +159,16 @@ class ConsumptionGenerator:
         self.cmd_args = cmd_args if cmd_args else {}
         self.config = {}  # Populated by _load_config
 
-        self.db_path = 'fingrid.db'
-        self.apoint_csv_path = 'kp.csv'
-        self.rpoint_csv_path = 'rp.csv'
-        self.xml_output_dir = 'xml/'
-        self.log_dir = 'log/' # For future use if sending logic is added here, or for detailed logs
+        # Run data lives in the selected workspace (libs/workspace.py), by default the current directory
+        self.db_path = workspace.path('fingrid.db')
+        self.apoint_csv_path = workspace.path('kp.csv')
+        self.rpoint_csv_path = workspace.input_path('rp.csv') # Shared rp.csv unless the workspace has its own
+        self.xml_output_dir = workspace.path('xml/')
+        self.log_dir = workspace.path('log/') # For future use if sending logic is added here, or for detailed logs
+        self._templates = {} # XML template path -> text, see _xml_template()
+
+        # Indexed view of kp.csv, re-imported automatically when kp.csv changes
+        self.ap_registry = APRegistry(self.apoint_csv_path)
 
         # Replaces global 'storage' dictionary for data that changes per generation run
         # or is set by the interactive prompt for a single generation.
@@ -63,12 +181,17 @@ class ConsumptionGenerator:
             'end_date_iso': None,   # YYYY-MM-DDTHH:MM:SSZ
             'metric': 'kWh',        # Default
             'metric_id': '8716867000030', # Default
+            'series_resolution': HOURLY, # Time axis of the run, PT1H or PT15M
+            'resolution': HOURLY,   # ResolutionDuration of the XML being generated
             'last_generated_xml_path': None, # For the prompt to send
             # For rpoint specific transient data
             'current_rpoint_in_area': None,
             'current_rpoint_out_area': None,
         }
 
+        if self.cmd_args.get('quarter_hourly'):
+            self.transient_data['series_resolution'] = QUARTER_HOURLY
+
         self._load_config()
         self._ensure_dirs_exist()
         # self._ensure_db_tables_exist() # Call this when generation starts, or once if db is persistent
@@ -92,6 +215,66 @@ class ConsumptionGenerator:
             # This is a critical error, so re-raise to be caught by main handler
             raise
 
+        try: # Optional, older fconfig.py files do not have it
+            from libs.fconfig import load_profile_mix
+        except ImportError:
+            load_profile_mix = None
+        # None keeps the original uniform random consumption
+        self.load_profiles = LoadProfiles(load_profile_mix) if load_profile_mix else None
+
+        try: # Optional as well
+            from libs.fconfig import replay_file
+        except ImportError:
+            replay_file = None
+        self.replay = None
+        if replay_file:
+            try:
+                self.replay = open_replay(replay_file)
+            except (OSError, ValueError) as e:
+                print(red + bold + f"Error: cannot use replay_file '{replay_file}': {e}" + reset)
+                raise
+
+        try: # Optional as well
+            from libs.fconfig import columnar_dir
+        except ImportError:
+            columnar_dir = None
+        self.columnar = ColumnStore(workspace.path(columnar_dir)) if columnar_dir else None
+
+        try: # Optional as well
+            from libs.fconfig import db_storage
+        except ImportError:
+            db_storage = 'rows'
+        if db_storage not in ('rows', 'series'):
+            raise ValueError(f"db_storage must be 'rows' or 'series', not '{db_storage}'")
+        self.db_storage = db_storage
+
+        try: # Optional as well
+            from libs.fconfig import db_partitioning
+        except ImportError:
+            db_partitioning = None
+        try: # Optional as well
+            from libs.fconfig import exchange_flows
+        except ImportError:
+            exchange_flows = 'random'
+        if exchange_flows not in ('random', 'derived'):
+            raise ValueError(f"exchange_flows must be 'random' or 'derived', not '{exchange_flows}'")
+        self.exchange_flows = exchange_flows
+
+        try: # Optional as well
+            from libs.fconfig import e14_read_period
+        except ImportError:
+            e14_read_period = MONTHLY
+        if e14_read_period not in READ_PERIODS:
+            raise ValueError(f"e14_read_period must be one of {', '.join(READ_PERIODS)}, not '{e14_read_period}'")
+        self.e14_read_period = e14_read_period
+
+        self.xml_layout = xmllayout.configured() # flat or sharded xml/, see libs/xmllayout.py
+
+        self.partitions = None
+        if db_partitioning:
+            self.partitions = PartitionSet(self.db_path, db_partitioning,
+                                           lambda cursor: self._create_tables(cursor, main_db=False))
+
     def _ensure_dirs_exist(self):
         """Ensures that XML output and log directories exist."""
         dirs_to_check = [self.xml_output_dir, self.log_dir]
@@ -107,18 +290,39 @@ class ConsumptionGenerator:
 
     @staticmethod
     def _generate_session_id(length=32):
-        """Generates a random ID string (moved from global generate_id)."""
-        # This was 'generate_id' in original, renamed for clarity if it's only for sessions.
-        # If used for XML Identifications, 'generate_identifier' might be better.
-        # For now, assuming it's for DB session_id primarily.
-        return ''.join(ra.choice("abcdef1234567890") for _ in range(length))
+        """Generates a run-unique hex ID string for DB session ids and XML identifications."""
+        return id_source(length).next()
 
     def run(self):
         """Main execution logic for the generator."""
         # Ensure DB tables are ready before any generation attempt.
         self._ensure_db_tables_exist()
 
-        if self.cmd_args.get('interactive_mode'):
+        if self.cmd_args.get('report'):
+            if self.cmd_args['report'] == 'rebuild':
+                self.rebuild_aggregates()
+            else:
+                self.print_report(self.cmd_args['report'], self.cmd_args.get('start_date_str'),
+                                  self.cmd_args.get('num_days_str'))
+            return
+        if self.cmd_args.get('resume'):
+            checkpoint = self._load_checkpoint()
+            if checkpoint is None:
+                print(yellow + "No interrupted batch run to resume." + reset)
+                return
+            print(cyan + f"Resuming batch from {checkpoint['start_date']} ({checkpoint['num_days']} days) "
+                  f"after {checkpoint['phase']} {checkpoint['point']}." + reset)
+            self.transient_data['hours_to_generate'] = checkpoint['hours_to_generate']
+            self.transient_data['start_time_for_generation'] = checkpoint['start_time_for_generation']
+            self.transient_data['series_resolution'] = checkpoint.get('series_resolution', HOURLY)
+            self._batch_generate_consumption(
+                start_date_input=checkpoint['start_date'],
+                num_days_input=checkpoint['num_days'],
+                metering_state_code=checkpoint['metering_state_code'],
+                incremental=checkpoint['incremental'],
+                resume_state=checkpoint
+            )
+        elif self.cmd_args.get('interactive_mode'):
             prompt = InteractivePrompt(self) # Pass generator instance
             prompt.cmdloop()
         elif self.cmd_args.get('start_date_str') and self.cmd_args.get('num_days_str'):
@@ -126,11 +330,12 @@ class ConsumptionGenerator:
             # transient_data for hours/start_time will use defaults unless overridden by future cmd args
             self._batch_generate_consumption(
                 start_date_input=self.cmd_args['start_date_str'],
-                num_days_input=self.cmd_args['num_days_str']
+                num_days_input=self.cmd_args['num_days_str'],
+                incremental=self.cmd_args.get('incremental', False)
             )
         else:
             # Default batch mode (prompts for dates if not provided, generates for all APs)
-            self._batch_generate_consumption(None, None)
+            self._batch_generate_consumption(None, None, incremental=self.cmd_args.get('incremental', False))
 
         print("Consumption generation process finished.")
 
@@ -146,6 +351,20 @@ class ConsumptionGenerator:
 
     def _ensure_db_tables_exist(self):
         """Ensures that the necessary database tables (apoint, rpoint) exist."""
+        try:
+            with self._db_connect() as conn:
+                self._create_tables(conn.cursor())
+                conn.commit()
+        except sqlite3.Error as e:
+            print(red + f"Database error during table creation: {e}" + reset)
+            raise # Critical error, propagate
+
+    @staticmethod
+    def _create_tables(cursor, main_db=True):
+        """
+        Creates the reading tables with cursor, in fingrid.db or in a partition
+        file. main_db adds the batch checkpoint and aggregate tables.
+        """
         # SQL table creation queries (similar to original createSQL)
         # Using TEXT for types like INT that might store large numbers or have specific string formats from source.
         # Consider constraints and actual data types carefully.
@@ -165,6 +384,7 @@ class ConsumptionGenerator:
             AP_TYPE        TEXT,
             REMOTE_READ    TEXT,
             METHOD         TEXT,
+            RESOLUTION     TEXT, /* PT15M, PT1H or P1D, NULL in databases from before PT15M support */
             PRIMARY KEY(APOINT_ID, TIMESTAMP)
         );"""
         # Note: Original PRIMARY KEY was (APOINT_ID, TIMESTAMP) effectively,
@@ -187,34 +407,50 @@ class ConsumptionGenerator:
             AP_TYPE        TEXT, /* Usually NULL for rpoints */
             REMOTE_READ    TEXT, /* Usually NULL for rpoints */
             METHOD         TEXT, /* Usually NULL for rpoints */
+            RESOLUTION     TEXT,
             PRIMARY KEY(RPOINT_ID, TIMESTAMP)
         );"""
         # Original key for rpoint was (RPOINT_ID, TIMESTAMP).
 
-        try:
-            with self._db_connect() as conn:
-                cursor = conn.cursor()
-                cursor.execute(create_apoint_table_sql)
-                cursor.execute(create_rpoint_table_sql)
-                conn.commit()
-        except sqlite3.Error as e:
-            print(red + f"Database error during table creation: {e}" + reset)
-            raise # Critical error, propagate
+        # Resume point of an interrupted batch, written in the same transaction as each point's rows
+        create_checkpoint_table_sql = """
+        CREATE TABLE IF NOT EXISTS batch_checkpoint (
+            ID             INTEGER PRIMARY KEY CHECK (ID = 1),
+            STATE          TEXT NOT NULL
+        );"""
 
-    def _generate_dates(self, start_date_str_input, num_days_str_input,
-                        start_time_str=None, hours_per_day_val=None):
+        # Last time point covered by each AP's period reads (P1D/P1M), which are stamped at their first point
+        create_read_coverage_table_sql = """
+        CREATE TABLE IF NOT EXISTS read_coverage (
+            APOINT_ID      TEXT PRIMARY KEY,
+            LAST_TS        TEXT NOT NULL
+        ) WITHOUT ROWID;"""
+
+        cursor.execute(create_apoint_table_sql)
+        cursor.execute(create_rpoint_table_sql)
+        if main_db:
+            cursor.execute(create_checkpoint_table_sql)
+            cursor.execute(create_read_coverage_table_sql)
+            aggregates.ensure_tables(cursor)
+        SeriesStore(cursor.connection).ensure_tables()
+        # Databases created before PT15M support lack the RESOLUTION column
+        for table in ('apoint', 'rpoint'):
+            columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+            if 'RESOLUTION' not in columns:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN RESOLUTION TEXT")
+
+    def _generate_time_axis(self, start_date_str_input, num_days_str_input,
+                            start_time_str=None, hours_per_day_val=None):
         """
-        Generates a list of hourly timestamps based on inputs.
+        Builds the run's UTC time axis from local (Europe/Helsinki) inputs.
         Refactors original dategen and date_input logic.
         Sets self.transient_data['start_date_iso'] and self.transient_data['end_date_iso'].
-        Returns list of formatted hourly timestamps or raises ValueError/TypeError.
+        Returns a TimeAxis or raises ValueError/TypeError.
         """
         # Use transient_data for defaults if not provided, which are set by prompt or batch defaults
         start_time_to_use = start_time_str if start_time_str is not None else self.transient_data['start_time_for_generation']
         hours_val = hours_per_day_val if hours_per_day_val is not None else self.transient_data['hours_to_generate']
 
-        generated_timestamps = []
-
         try:
             num_days = 0
             if num_days_str_input is None: # Interactive or default batch mode, prompt for days
@@ -246,155 +482,242 @@ class ConsumptionGenerator:
                 except ValueError:
                     raise ValueError(f"Invalid start date format: '{start_date_str_input}'. Use dd.mm.yyyy.")
 
-            # Incorporate start_time_to_use
+            # Validate start_time_to_use
             try:
                 hour, minute = map(int, start_time_to_use.split(':'))
-                start_datetime_dt = current_date_dt.replace(hour=hour, minute=minute, second=0, microsecond=0)
+                datetime.time(hour, minute)
             except ValueError:
                 raise ValueError(f"Invalid start time format: '{start_time_to_use}'. Use HH:MM.")
 
-            # Calculate end datetime based on total hours to generate
-            # If hours_val is for the total duration (e.g. prompt set 'hours' directly)
-            # Or if it's per day (then multiply by num_days)
-            # Original logic: dategen took nro_days, and storage['hours'] was total hours if nro_days was None,
-            # or hours per day if nro_days was set.
-            # This new method is simpler: hours_val is total hours for the period defined by num_days * 24 (if hours_val is 24),
-            # or a specific total number of hours if hours_val is different from 24.
-            # Let's assume hours_val is total hours if it's not 24 and num_days is 1,
-            # or it's hours per day if num_days > 1.
-            # For simplicity, let's assume hours_val is the number of hours to generate per day specified by num_days.
-            # The total duration is num_days * hours_val.
-            # No, the original `dategen` with `storage['hours']` implies `hours_val` is total hours if `num_days` is effectively 1 for that mode.
-            # If `num_days_input` is given (batch), then `hours_val` (default 24) is per day.
-            # If called from prompt's single_kulutus, `self.days_val` is used for `num_days` and `self.hours_val` for total hours.
-
-            # Let's clarify: this function generates `num_days` worth of data.
-            # `hours_val` (from transient_data) determines how many hours are in *each* of those `num_days`.
-            # The loop will iterate `num_days * hours_val` times, advancing by 1 hour each time.
-
-            total_hours_to_generate = num_days * hours_val
-            end_datetime_dt = start_datetime_dt + datetime.timedelta(hours=total_hours_to_generate)
-
-            # Store ISO formatted start and end dates in transient_data for XML
-            self.transient_data['start_date_iso'] = start_datetime_dt.strftime("%Y-%m-%dT%H:%M:%SZ")
-            self.transient_data['end_date_iso'] = end_datetime_dt.strftime("%Y-%m-%dT%H:%M:%SZ")
-
-            current_loop_dt = start_datetime_dt
-            for _ in range(total_hours_to_generate):
-                generated_timestamps.append(current_loop_dt.strftime("%d-%m-%YT%H:%M:%SZ")) # Format for DB/internal use
-                current_loop_dt += datetime.timedelta(hours=1)
-
-            return generated_timestamps
+            # hours_val (from transient_data) is the number of hours in *each* of the num_days.
+            # Full days follow the local calendar, so DST change days have 23 or 25 hours.
+            axis = TimeAxis.for_local_period(current_date_dt.date(), start_time_to_use, num_days,
+                                             hours_val, self._interval_minutes())
+            if len(axis):
+                self._set_period(axis, 0, len(axis))
+            return axis
 
         except ValueError as e: # Catch parsing errors for dates/days/times
             print(red + f"Date/Time generation error: {e}" + reset)
             raise # Propagate to caller
         except Exception as e: # Catch any other unexpected error
-            print(red + f"Unexpected error in _generate_dates: {e}" + reset)
+            print(red + f"Unexpected error in _generate_time_axis: {e}" + reset)
             raise
 
-    def _calculate_hourly_consumption(self, min_val_str=None, max_val_str=None,
-                                      use_prod_value=False, prod_config_key=None):
+    def _interval_minutes(self):
+        """Minutes between two points of the run's time axis."""
+        return INTERVAL_MINUTES[self.transient_data['series_resolution']]
+
+    def _draw_consumption(self, count, min_val_str=None, max_val_str=None,
+                          use_prod_value=False, prod_config_key=None):
         """
-        Calculates a single hourly consumption value.
-        Refactors original kulutus() logic.
+        Draws count hourly consumption values (kWh) in one call.
+        Refactors original kulutus() logic: fixed fconfig production value, or
+        uniform 0.1 kWh steps between MIN/MAX (default 0-10 kWh).
         """
         if use_prod_value and prod_config_key and prod_config_key in self.config:
             prod_val = self.config[prod_config_key]
             if isinstance(prod_val, (int, float)):
-                return float(prod_val) # Ensure it's a float
+                return [float(prod_val)] * count
             else:
                 print(yellow + f"Warning: Prod value for '{prod_config_key}' in fconfig is not a number. Using random." + reset)
 
+        min_val, max_val = 0, 100 # Original default
         try:
-            if min_val_str is not None and max_val_str is not None:
-                min_val = int(min_val_str)
-                max_val = int(max_val_str)
-                if min_val < max_val:
-                    return round(ra.randint(min_val, max_val) / 10.0, 1) # Original logic divides by 10
-            # Default random generation if specific range is not valid or not provided
-            return round(ra.randint(0, 100) / 10.0, 1) # Original default
+            if min_val_str is not None and max_val_str is not None and int(min_val_str) < int(max_val_str):
+                min_val, max_val = int(min_val_str), int(max_val_str)
         except ValueError:
             print(yellow + "Warning: Invalid min/max for consumption range. Using default random." + reset)
-            return round(ra.randint(0, 100) / 10.0, 1) # Fallback to default
+        # One C level draw for the whole block instead of a randint call per reading
+        return [value / 10.0 for value in ra.choices(range(min_val, max_val + 1), k=count)] # Original logic divides by 10
 
-    def _insert_apoint_consumption_db(self, conn_cursor, data_dict):
-        """Inserts a single accounting point consumption record into the database."""
-        # Convert DD-MM-YYYYTHH:MM:SSZ from _generate_dates to YYYY-MM-DD HH:MM:SS for DB
+    def _insert_consumption_db(self, conn_cursor, kind, details, readings, resolution):
+        """
+        Inserts the readings [(DB timestamp, consumption)] of one accounting point
+        (kind 'apoint') or exchange point (kind 'rpoint').
+        With db_partitioning the readings go to the partition files instead of
+        fingrid.db, with db_storage 'series' to the point's compressed monthly
+        chunks instead of the row tables.
+        Returns the number of inserted rows.
+        """
+        insert = self._insert_consumption_series if self.db_storage == 'series' else self._insert_consumption_rows
+        if self.partitions is None:
+            return insert(conn_cursor, kind, details, readings, resolution)
+        return sum(insert(cursor, kind, details, part, resolution)
+                   for cursor, part in self.partitions.split(readings, details))
+
+    def _insert_consumption_rows(self, conn_cursor, kind, details, readings, resolution):
+        """
+        Inserts the readings as apoint/rpoint rows with one executemany.
+        Readings already in the DB are kept and reported.
+        """
+        session_ids = id_source(32).bulk(len(readings))
+        if kind == 'apoint':
+            sql = """INSERT OR IGNORE INTO apoint (
+                        SESSION_ID, APOINT_ID, METERINGPOINT, TIMESTAMP, DSO, MGA, SUPPLIER,
+                        KULUTUS, AP_TYPE, REMOTE_READ, METHOD, RESOLUTION
+                     ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+            point_id = details.get('apoint_id')
+            head = (point_id, details.get('meteringpoint')) # meteringpoint is fetched from kp.csv for the apoint_id
+            tail = (details.get('dso'), details.get('mga'), details.get('supplier'))
+            attrs = (details.get('ap_type'), details.get('remote_read'),
+                     (details.get('method') or '').strip(), resolution) # Ensure method is stripped
+            rows = [(sid,) + head + (ts,) + tail + (kwh,) + attrs
+                    for sid, (ts, kwh) in zip(session_ids, readings)]
+        else:
+            sql = """INSERT OR IGNORE INTO rpoint (
+                        SESSION_ID, RPOINT_ID, TIMESTAMP, DSO, R_IN, R_OUT, KULUTUS, RESOLUTION
+                     ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+            point_id = details.get('rpoint_id')
+            attrs = (details.get('dso'), details.get('r_in'), details.get('r_out'))
+            rows = [(sid, point_id, ts) + attrs + (kwh, resolution)
+                    for sid, (ts, kwh) in zip(session_ids, readings)]
         try:
-            ts_parts = data_dict['timestamp'].split('T')
-            date_parts = ts_parts[0].split('-') # DD, MM, YYYY
-            time_part = ts_parts[1][:-1] # HH:MM:SS (remove Z)
-            db_timestamp_str = f"{date_parts[2]}-{date_parts[1]}-{date_parts[0]} {time_part}"
-        except IndexError:
-             raise ValueError(f"Invalid timestamp format for DB insertion: {data_dict['timestamp']}")
-
-        sql = """INSERT INTO apoint (
-                    SESSION_ID, APOINT_ID, METERINGPOINT, TIMESTAMP, DSO, MGA, SUPPLIER,
-                    KULUTUS, AP_TYPE, REMOTE_READ, METHOD
-                 ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+            before = conn_cursor.connection.total_changes
+            conn_cursor.executemany(sql, rows)
+            inserted = conn_cursor.connection.total_changes - before
+        except sqlite3.Error as e:
+            print(red + f"DB error inserting {kind} consumption for {point_id}: {e}" + reset)
+            return 0
+        if inserted < len(rows):
+            # APOINT_ID/RPOINT_ID + TIMESTAMP combination already exists
+            print(cyan + f"{len(rows) - inserted} reading(s) of {point_id} already in DB. Skipped." + reset)
+        return inserted
+
+    def _insert_consumption_series(self, conn_cursor, kind, details, readings, resolution):
+        """db_storage 'series' variant of _insert_consumption_db."""
+        if kind == 'apoint':
+            point_id = details.get('apoint_id')
+            attributes = {'METERINGPOINT': details.get('meteringpoint'), 'DSO': details.get('dso'),
+                          'MGA': details.get('mga'), 'SUPPLIER': details.get('supplier'),
+                          'AP_TYPE': details.get('ap_type'), 'REMOTE_READ': details.get('remote_read'),
+                          'METHOD': (details.get('method') or '').strip()}
+        else:
+            point_id = details.get('rpoint_id')
+            attributes = {'DSO': details.get('dso'), 'R_IN': details.get('r_in'), 'R_OUT': details.get('r_out')}
+        attributes['RESOLUTION'] = resolution
         try:
-            session_id = self._generate_session_id()
-            params = (
-                session_id,
-                data_dict.get('apoint_id'),
-                data_dict.get('meteringpoint'), # This needs to be fetched from kp.csv for the apoint_id
-                db_timestamp_str,
-                data_dict.get('dso'),
-                data_dict.get('mga'),
-                data_dict.get('supplier'),
-                data_dict.get('kulutus'),
-                data_dict.get('ap_type'),
-                data_dict.get('remote_read'),
-                data_dict.get('method', '').strip() # Ensure method is stripped
-            )
-            conn_cursor.execute(sql, params)
-            return True # Indicate success
-        except sqlite3.IntegrityError:
-            # This means APOINT_ID + TIMESTAMP combination already exists
-            print(cyan + f"Data for AP {data_dict.get('apoint_id')} at {db_timestamp_str} already in DB. Skipping." + reset)
-            return False
+            inserted = SeriesStore(conn_cursor.connection).insert(kind, point_id, attributes, readings)
         except sqlite3.Error as e:
-            print(red + f"DB error inserting apoint consumption: {e}" + reset)
-            # Depending on severity, might raise or just return False
-            return False
+            print(red + f"DB error inserting {kind} consumption for {point_id}: {e}" + reset)
+            return 0
+        if inserted < len(readings):
+            print(cyan + f"{len(readings) - inserted} reading(s) of {point_id} already in DB. Skipped." + reset)
+        return inserted
 
+    def _update_aggregates(self, cursor, kind, details, readings, local_days, resolution, inserted):
+        """
+        Adds a point's readings to the aggregate tables of fingrid.db, in the
+        transaction of the readings. local_days are 'DD-MM-YYYY'. If only some
+        readings were new the aggregates are marked stale instead; with
+        partitions even none, as the readings may come from a partition commit
+        whose fingrid.db transaction was lost.
+        """
+        if inserted != len(readings):
+            if inserted or self.partitions is not None:
+                aggregates.mark_stale(cursor)
+            return
+        totals = aggregates.Totals()
+        if kind == 'apoint':
+            totals.add_apoint(details, readings, [f"{d[6:]}-{d[3:5]}-{d[:2]}" for d in local_days], resolution)
+        else:
+            totals.add_rpoint(details, readings)
+        totals.flush(cursor)
 
-    def _insert_rpoint_consumption_db(self, conn_cursor, data_dict):
-        """Inserts a single exchange point consumption record into the database."""
-        try:
-            ts_parts = data_dict['timestamp'].split('T')
-            date_parts = ts_parts[0].split('-')
-            time_part = ts_parts[1][:-1]
-            db_timestamp_str = f"{date_parts[2]}-{date_parts[1]}-{date_parts[0]} {time_part}"
-        except IndexError:
-             raise ValueError(f"Invalid timestamp format for DB insertion: {data_dict['timestamp']}")
-
-        sql = """INSERT INTO rpoint (
-                    SESSION_ID, RPOINT_ID, TIMESTAMP, DSO, R_IN, R_OUT, KULUTUS
-                 ) VALUES (?, ?, ?, ?, ?, ?, ?)"""
+    def _exchange_flows(self, cursor, axis):
+        """
+        Output: aggregates.ExchangeFlows of the rp.csv exchange points over the
+        time axis, from the MGA hourly totals of the accounting points.
+        """
+        with open(self.rpoint_csv_path, 'r', newline='', encoding='utf-8') as rp_csvfile:
+            links = [(row['ID'], row['IN_AREA'], row['OUT_AREA'])
+                     for row in map(rp_fields, csv.DictReader(rp_csvfile))]
+        if aggregates.is_stale(cursor):
+            print(yellow + "Warning: aggregates are stale, derived exchange flows may be off. "
+                  "Run --report rebuild first." + reset)
+        return aggregates.ExchangeFlows(cursor, [link for link in links if link[0]],
+                                        axis.db_timestamps[0], axis.db_end(len(axis)))
+
+    def _reading_rows(self, conn):
+        """
+        Yields (kind, reading dict with the apoint/rpoint row columns) of all
+        stored readings: row tables and series chunks, of fingrid.db (through
+        the caller's connection conn) or of every partition.
+        """
+        if self.partitions is None:
+            connections = [conn]
+        else:
+            connections = [self.partitions.connection(key) for key in self.partitions.keys()]
+        for part_conn in connections:
+            rows = part_conn.cursor()
+            rows.row_factory = sqlite3.Row
+            for kind in ('apoint', 'rpoint'):
+                yield from ((kind, row) for row in rows.execute(f"SELECT * FROM {kind}"))
+                yield from ((kind, row) for row in SeriesStore(part_conn).readings(kind))
+
+    def rebuild_aggregates(self):
+        """Recomputes the aggregate tables from all stored readings."""
+        with self._db_connect() as conn:
+            count = aggregates.rebuild(conn.cursor(), self._reading_rows(conn))
+            conn.commit()
+        print(green + f"Aggregates rebuilt from {count} reading(s)." + reset)
+
+    def print_report(self, name, start_date_str=None, num_days_str=None):
+        """
+        Prints an aggregate report (aggregates.REPORTS), optionally for num_days
+        local days from start_date_str (dd.mm.yyyy).
+        """
+        if name not in aggregates.REPORTS:
+            print(red + f"Unknown report '{name}'. Choose from: {', '.join(aggregates.REPORTS)}, rebuild." + reset)
+            return
+        start = end = None
+        if start_date_str:
+            first_day = datetime.datetime.strptime(start_date_str, "%d.%m.%Y").date()
+            axis = TimeAxis.for_local_period(first_day, '00:00', int(num_days_str or 1), 24, 60)
+            if name in ('mga', 'exchange'): # UTC hours
+                start, end = axis.db_timestamps[0], axis.db_end(len(axis))
+            else:
+                start = first_day.isoformat()
+                end = (first_day + datetime.timedelta(days=int(num_days_str or 1))).isoformat()
+        with self._db_connect() as conn:
+            cursor = conn.cursor()
+            if aggregates.is_stale(cursor):
+                print(yellow + "Warning: aggregates are stale (readings were partly regenerated). "
+                      "Run the rebuild report to recompute them." + reset)
+            columns, rows = aggregates.report(cursor, name, start, end)
+        if not rows:
+            print(yellow + "No aggregated readings for the period." + reset)
+            return
+        table = [columns] + [[f"{v:.3f}" if isinstance(v, float) else str(v) for v in row] for row in rows]
+        widths = [max(len(row[i]) for row in table) for i in range(len(columns))]
         try:
-            session_id = self._generate_session_id()
-            params = (
-                session_id,
-                data_dict.get('rpoint_id'),
-                db_timestamp_str,
-                data_dict.get('dso'),
-                data_dict.get('r_in'),
-                data_dict.get('r_out'),
-                data_dict.get('kulutus')
-            )
-            conn_cursor.execute(sql, params)
-            return True
-        except sqlite3.IntegrityError:
-            print(cyan + f"Data for RP {data_dict.get('rpoint_id')} at {db_timestamp_str} already in DB. Skipping." + reset)
-            return False
-        except sqlite3.Error as e:
-            print(red + f"DB error inserting rpoint consumption: {e}" + reset)
-            return False
+            for n, row in enumerate(table):
+                line = "  ".join(v.ljust(w) if i < 2 else v.rjust(w) for i, (v, w) in enumerate(zip(row, widths)))
+                print(cyan + line + reset if n == 0 else line)
+            sys.stdout.flush()
+        except BrokenPipeError: # Piped into e.g. head, which stopped reading
+            # Further output (and the flush at exit) goes nowhere instead of raising again
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+    @staticmethod
+    def _save_checkpoint(cursor, state):
+        """Stores the resume point. Becomes durable with the caller's commit."""
+        cursor.execute("INSERT OR REPLACE INTO batch_checkpoint (ID, STATE) VALUES (1, ?)", (json.dumps(state),))
+
+    def _load_checkpoint(self):
+        """Output: resume point of an interrupted batch run or None"""
+        with self._db_connect() as conn:
+            row = conn.execute("SELECT STATE FROM batch_checkpoint WHERE ID = 1").fetchone()
+        if row is None:
+            return None
+        state = json.loads(row[0])
+        # random.setstate() needs the tuples JSON turned into lists
+        version, internal, gauss_next = state['rng_state']
+        state['rng_state'] = (version, tuple(internal), gauss_next)
+        return state
 
     def _get_apoint_details(self, apoint_id_to_find):
-        """Fetches details for a specific accounting point from apoint_csv_path (kp.csv)."""
+        """Fetches details for a specific accounting point from the kp.csv registry."""
         if not os.path.exists(self.apoint_csv_path):
             print(red + f"Error: Accounting point CSV file not found: {self.apoint_csv_path}" + reset)
             # This is a critical issue for this operation.
@@ -402,26 +725,12 @@ class ConsumptionGenerator:
             raise FileNotFoundError(f"{self.apoint_csv_path} not found. Please run kpgen first.")
 
         try:
-            with open(self.apoint_csv_path, 'r', newline='', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile) # Using DictReader for easier column access
-                for row in reader:
-                    # Assuming 'Accounting point' is the column name for AP IDs in kp.csv
-                    if row.get('Accounting point') == apoint_id_to_find:
-                        # Map CSV headers to a dictionary. Ensure keys match CSV headers.
-                        # Example mapping based on typical kp.csv structure from kpgen.py
-                        return {
-                            'apoint_id': row.get('Accounting point'),
-                            'meteringpoint': row.get('Metering Area'), # Or specific metering point ID if different
-                            'supplier': row.get('Supplier'),
-                            'dso': row.get('DSO'),
-                            'mga': row.get('MGA'),
-                            'ap_type': row.get('AP type'),
-                            'remote_read': row.get('Remote readable'),
-                            'method': row.get('Metering method')
-                            # Add other fields if needed from kp.csv
-                        }
-            return None # AP ID not found
-        except FileNotFoundError: # Should be caught by os.path.exists, but as safeguard
+            details = self.ap_registry.get(apoint_id_to_find)
+            if details is None:
+                return None # AP ID not found
+            return {key: details[key] for key in ('apoint_id', 'meteringpoint', 'supplier', 'dso',
+                                                  'mga', 'ap_type', 'remote_read', 'method')}
+        except FileNotFoundError: # kp.csv removed between the check and the lookup
             print(red + f"Error: File not found during _get_apoint_details: {self.apoint_csv_path}" + reset)
             raise
         except Exception as e: # Catch other potential errors like CSV parsing issues
@@ -436,21 +745,16 @@ class ConsumptionGenerator:
 
         try:
             with open(self.rpoint_csv_path, 'r', newline='', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile) # Assuming rp.csv also has headers
-                # Headers in rp.csv from original luo_kulutus: ID,DSO,IN_AREA,OUT_AREA,MIN_KWH,MAX_KWH
-                # Example: line.split(',')[0] for ID.
-                for row in reader:
-                    # Assuming first column in rp.csv is the RPOINT_ID (needs actual header name)
-                    # Let's assume the header for rpoint ID is 'ID' or 'RPOINT_ID'
-                    # This needs to match the actual CSV header in rp.csv
-                    if row.get('ID') == rpoint_id_to_find or row.get('RPOINT_ID') == rpoint_id_to_find : # Check common names
+                # Either header set of rp.csv, see rp_fields()
+                for row in map(rp_fields, csv.DictReader(csvfile)):
+                    if row['ID'] == rpoint_id_to_find:
                         return {
                             'rpoint_id': rpoint_id_to_find,
-                            'dso': row.get('DSO'),
-                            'in_area': row.get('IN_AREA'), # Or actual header name
-                            'out_area': row.get('OUT_AREA'), # Or actual header name
-                            'min_kwh': row.get('MIN_KWH'),   # For consumption calculation range
-                            'max_kwh': row.get('MAX_KWH')    # For consumption calculation range
+                            'dso': row['DSO'],
+                            'in_area': row['IN_AREA'],
+                            'out_area': row['OUT_AREA'],
+                            'min_kwh': row['MIN_KWH'],   # For consumption calculation range
+                            'max_kwh': row['MAX_KWH']    # For consumption calculation range
                         }
             return None # RP ID not found
         except FileNotFoundError:
@@ -460,8 +764,42 @@ class ConsumptionGenerator:
             print(red + f"Error reading or parsing {self.rpoint_csv_path}: {e}" + reset)
             raise
 
-    def _generate_apoint_xml(self, ap_id_val, date_str_for_filename_part, xml_data_points_str):
-        """Generates the XML file for an accounting point's consumption data."""
+    def _xml_template(self, template_path):
+        """
+        Output: ElementTree of the template with OBSERVATIONS_SLOT in place of
+        the observations placeholder. The template file is read only once.
+        """
+        text = self._templates.get(template_path)
+        if text is None:
+            with open(template_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            if OBSERVATIONS_PLACEHOLDER not in text:
+                raise ET.ParseError(f"'{OBSERVATIONS_PLACEHOLDER}' missing from {template_path}")
+            # The whole placeholder line is replaced, like the observations used to be written
+            text = self._templates[template_path] = re.sub(r'[ \t]*' + re.escape(OBSERVATIONS_PLACEHOLDER) + r'[^\n]*\n?',
+                                                           OBSERVATIONS_SLOT, text, count=1)
+        return ET.ElementTree(ET.fromstring(text))
+
+    def _write_xml(self, tree, out_file_name, observations):
+        """
+        Writes the filled template with the observations in place of
+        OBSERVATIONS_SLOT to xml/ in the configured xml_layout (a file or a
+        segment record). observations is an iterable of XML text chunks,
+        written as they are produced, so the file is never held in memory.
+        """
+        head, _, tail = ET.tostring(tree.getroot(), encoding='unicode').partition(OBSERVATIONS_SLOT)
+        with xmllayout.create(self.xml_output_dir, out_file_name, self.xml_layout) as outfile:
+            outfile.write("<?xml version='1.0' encoding='utf-8'?>\n")
+            outfile.write(head)
+            for chunk in observations:
+                outfile.write(chunk)
+            outfile.write(tail)
+
+    def _generate_apoint_xml(self, ap_id_val, date_str_for_filename_part, observations):
+        """
+        Generates the XML file for an accounting point's consumption data.
+        observations: iterable of observation XML chunks, see _write_xml().
+        """
         template_path = 'libs/kulutus_template.xml'
         # Ensure XML output directory exists (though _ensure_dirs_exist should handle it)
         if not os.path.exists(self.xml_output_dir): os.makedirs(self.xml_output_dir)
@@ -469,23 +807,14 @@ class ConsumptionGenerator:
         # Construct output filename (similar to original)
         # date_str_for_filename_part should be like 'ddmmyyyy' from the first date of generation for that file
         out_file_name = f"kulutus_{ap_id_val}_{date_str_for_filename_part.replace('-', '')}.xml"
-        out_file_path = os.path.join(self.xml_output_dir, out_file_name)
+        out_file_path = xmllayout.path_for(self.xml_output_dir, out_file_name, self.xml_layout)
 
         self.transient_data['last_generated_xml_path'] = out_file_path # Store for prompt's send command
 
         try:
-            # First, write the main structure by replacing placeholder in template
-            # This part is from the original generate_apoint_xml (before finalize_xml)
-            with open(template_path, 'r', encoding='utf-8') as infile, \
-                 open(out_file_path, 'w', encoding='utf-8') as outfile:
-                for row in infile:
-                    if '<!-- Kulutus data points placeholder -->' in row: # Requires placeholder in template
-                        outfile.write(xml_data_points_str)
-                    else:
-                        outfile.write(row)
-
-            # Second, parse the newly created file and fill in header/context details (finalize_xml logic)
-            tree = ET.parse(out_file_path)
+            # Fill in header/context details of the template (finalize_xml logic),
+            # the observations are streamed in place of the placeholder when writing
+            tree = self._xml_template(template_path)
 
             # Namespaces - must match those in kulutus_template.xml
             # These are examples; actual URIs should be verified from template
@@ -518,6 +847,9 @@ class ConsumptionGenerator:
             end_elem = tree.find(f".//{{{ns_e66_elements}}}End")
             if end_elem is not None: end_elem.text = self.transient_data.get('end_date_iso', '')
 
+            resolution_elem = tree.find(f".//{{{ns_e66_elements}}}ResolutionDuration")
+            if resolution_elem is not None: resolution_elem.text = self.transient_data.get('resolution', HOURLY)
+
             # ProductIncludedProductCharacteristic - assuming two occurrences
             prod_chars = tree.findall(f".//{{{ns_e66_elements}}}ProductIncludedProductCharacteristic/{{{ns_e66_elements}}}Identification")
             if len(prod_chars) > 0: prod_chars[0].text = self.transient_data.get('metric_id', '')
@@ -528,41 +860,38 @@ class ConsumptionGenerator:
 
             mga_used_loc_elem = tree.find(f".//{{{ns_e66_elements}}}MeteringGridAreaUsedDomainLocation/{{{ns_e66_elements}}}Identification")
             if mga_used_loc_elem is not None: mga_used_loc_elem.text = str(self.transient_data.get('current_mga', ''))
-            
-            tree.write(out_file_path, encoding='utf-8', xml_declaration=True)
+
+            self._write_xml(tree, out_file_name, observations)
             return out_file_path
 
         except FileNotFoundError:
             print(red + f"Error: XML template file '{template_path}' not found for AP {ap_id_val}." + reset)
         except ET.ParseError as e:
-            print(red + f"Error parsing XML for AP {ap_id_val} from '{out_file_path}': {e}" + reset)
+            print(red + f"Error parsing XML template '{template_path}' for AP {ap_id_val}: {e}" + reset)
         except IOError as e:
             print(red + f"Error writing XML for AP {ap_id_val} to '{out_file_path}': {e}" + reset)
+        except sqlite3.Error:
+            raise # Storing the streamed observations failed, handled by the batch
         except Exception as e:
             print(red + f"An unexpected error occurred during XML generation for AP {ap_id_val}: {e}" + reset)
         return None # Return None on failure
 
 
-    def _generate_rpoint_xml(self, rp_id_val, date_str_for_filename_part, xml_data_points_str):
-        """Generates the XML file for an exchange point's consumption data."""
+    def _generate_rpoint_xml(self, rp_id_val, date_str_for_filename_part, observations):
+        """
+        Generates the XML file for an exchange point's consumption data.
+        observations: iterable of observation XML chunks, see _write_xml().
+        """
         template_path = 'libs/rajapiste_template.xml' # Assuming this is the correct template
         if not os.path.exists(self.xml_output_dir): os.makedirs(self.xml_output_dir)
 
         out_file_name = f"rajapiste_{rp_id_val}_{date_str_for_filename_part.replace('-', '')}.xml"
-        out_file_path = os.path.join(self.xml_output_dir, out_file_name)
+        out_file_path = xmllayout.path_for(self.xml_output_dir, out_file_name, self.xml_layout)
 
         self.transient_data['last_generated_xml_path'] = out_file_path # Store for prompt's send command
 
         try:
-            with open(template_path, 'r', encoding='utf-8') as infile, \
-                 open(out_file_path, 'w', encoding='utf-8') as outfile:
-                for row in infile:
-                    if '<!-- Kulutus data points placeholder -->' in row: # Requires placeholder
-                        outfile.write(xml_data_points_str)
-                    else:
-                        outfile.write(row)
-
-            tree = ET.parse(out_file_path)
+            tree = self._xml_template(template_path)
 
             ns_hdr = "urn:fi:Datahub:mif:common:HDR_Header:elements:v1"
             ns_e66_ts = "urn:fi:Datahub:mif:metering:E66_EnergyTimeSeries:v1"
@@ -589,6 +918,9 @@ class ConsumptionGenerator:
             end_elem = tree.find(f".//{{{ns_e66_elements}}}End")
             if end_elem is not None: end_elem.text = self.transient_data.get('end_date_iso', '')
 
+            resolution_elem = tree.find(f".//{{{ns_e66_elements}}}ResolutionDuration")
+            if resolution_elem is not None: resolution_elem.text = self.transient_data.get('resolution', HOURLY)
+
             # For RPoint, it's MeteringPointUsedDomainLocation for the RP ID itself
             rp_used_loc_elem = tree.find(f".//{{{ns_e66_elements}}}MeteringPointUsedDomainLocation/{{{ns_e66_elements}}}Identification")
             if rp_used_loc_elem is not None: rp_used_loc_elem.text = str(rp_id_val)
@@ -600,48 +932,341 @@ class ConsumptionGenerator:
             out_area_elem = tree.find(f".//{{{ns_e66_elements}}}OutAreaUsedDomainLocation/{{{ns_e66_elements}}}Identification")
             if out_area_elem is not None: out_area_elem.text = str(self.transient_data.get('current_rpoint_out_area', ''))
 
-            tree.write(out_file_path, encoding='utf-8', xml_declaration=True)
+            self._write_xml(tree, out_file_name, observations)
             return out_file_path
 
         except FileNotFoundError:
             print(red + f"Error: XML template file '{template_path}' not found for RP {rp_id_val}." + reset)
         except ET.ParseError as e:
-            print(red + f"Error parsing XML for RP {rp_id_val} from '{out_file_path}': {e}" + reset)
+            print(red + f"Error parsing XML template '{template_path}' for RP {rp_id_val}: {e}" + reset)
         except IOError as e:
             print(red + f"Error writing XML for RP {rp_id_val} to '{out_file_path}': {e}" + reset)
+        except sqlite3.Error:
+            raise # Storing the streamed observations failed, handled by the batch
         except Exception as e:
             print(red + f"An unexpected error occurred during XML generation for RP {rp_id_val}: {e}" + reset)
         return None
 
 
+    def _set_period(self, axis, start, end):
+        """Sets XML Start/End in transient_data for time axis points start..end-1."""
+        self.transient_data['start_date_iso'] = axis.iso_timestamps[start]
+        self.transient_data['end_date_iso'] = axis.iso_end(end)
+
+    @staticmethod
+    def _load_covered_periods(cursor, table, id_column, point_ids=None):
+        """
+        Returns {point id: (first, last) DB timestamp} with one grouped query
+        over the (ID, TIMESTAMP) primary key index, optionally only of point_ids.
+        """
+        where = f" WHERE {id_column} IN ({', '.join('?' * len(point_ids))})" if point_ids is not None else ""
+        cursor.execute(f"SELECT {id_column}, MIN(TIMESTAMP), MAX(TIMESTAMP) FROM {table}{where} GROUP BY {id_column}",
+                       list(point_ids or ()))
+        return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+    @staticmethod
+    def _period_bounds(axis, resolution):
+        """Output: (start, end) index functions of the local days or months of a read period resolution"""
+        if resolution == MONTHLY:
+            return axis.month_start, axis.month_end
+        return axis.day_start, axis.day_end
+
+    @staticmethod
+    def _missing_segments(axis, covered, resolution=HOURLY, read_end=None):
+        """
+        Returns (start, end) index ranges of the time axis outside the covered
+        (first, last) DB timestamp period, i.e. the points before and after
+        existing data. Reads of a read period resolution (P1D, P1M) are stored
+        at their first point and may cover only part of their day or month:
+        read_end is the last point they cover (read_coverage), so the rest of
+        a partial period is generated as a read of its own. Without it
+        (databases from before read_coverage) the last read is taken to cover
+        the rest of its period.
+        """
+        count = len(axis)
+        if covered is None:
+            return [(0, count)] if count else []
+        first, last = covered
+        lo = bisect.bisect_left(axis.db_timestamps, first)
+        if resolution in READ_PERIODS and read_end is not None and read_end >= last:
+            hi = bisect.bisect_right(axis.db_timestamps, read_end)
+        else:
+            hi = bisect.bisect_right(axis.db_timestamps, last)
+            if resolution in READ_PERIODS and lo < hi:
+                _, period_end = ConsumptionGenerator._period_bounds(axis, resolution)
+                hi = period_end(hi - 1)
+        return [(start, end) for start, end in ((0, lo), (hi, count)) if end > start]
+
+    @staticmethod
+    def _read_ends(cursor, point_ids):
+        """Output: {AP ID: last DB timestamp covered by its period reads} of point_ids"""
+        cursor.execute(f"SELECT APOINT_ID, LAST_TS FROM read_coverage WHERE APOINT_ID IN ({', '.join('?' * len(point_ids))})",
+                       list(point_ids))
+        return dict(cursor.fetchall())
+
+    @staticmethod
+    def _read_periods(axis, start, end, resolution):
+        """
+        Groups time axis points start..end-1 into read periods of the resolution.
+        Output: list of (first index, points in period)
+        """
+        if resolution not in READ_PERIODS:
+            return [(i, 1) for i in range(start, end)]
+        _, period_end = ConsumptionGenerator._period_bounds(axis, resolution)
+        periods = []
+        i = start
+        while i < end:
+            next_start = min(period_end(i), end)
+            periods.append((i, next_start - i))
+            i = next_start
+        return periods
+
+    def _ap_profile(self, ap_id, ap_type):
+        """
+        Output: (source, assignment) for an AP, None for uniform random consumption.
+        A measured series of the AP type wins over the load profiles.
+        """
+        if self.config.get('prod_ap'): # A static prod_ap value wins
+            return None
+        for source in (self.replay, self.load_profiles):
+            if source is not None:
+                assignment = source.assign(ap_id, ap_type)
+                if assignment is not None:
+                    return source, assignment
+        return None
+
+    @staticmethod
+    def _period_blocks(axis, periods):
+        """
+        Splits read periods into blocks of one UTC month, the unit in which
+        a point's values are generated, stored and rendered. A block is at
+        most 2976 PT15M points, whatever the length of the run.
+        """
+        db_timestamps = axis.db_timestamps
+        return [list(block) for _, block in itertools.groupby(periods, key=lambda p: db_timestamps[p[0]][:7])]
+
+    def _block_values(self, axis, periods, resolution, profile, consumption_args):
+        """Output: the rounded values (kWh per reading) of the read periods of one block"""
+        step_hours = self._interval_minutes() / 60.0
+        if profile is not None:
+            # One vectorised step for every point of the block
+            source, assignment = profile
+            start = periods[0][0]
+            end = periods[-1][0] + periods[-1][1]
+            energies = [kwh * step_hours for kwh in source.block(assignment, axis, start, end)]
+            if resolution in READ_PERIODS:
+                return [round(sum(energies[i - start:i - start + points]), 3) for i, points in periods]
+            return [round(kwh, 3) for kwh in energies]
+
+        draws = self._draw_consumption(len(periods), **(consumption_args or {}))
+        # Draws are hourly energies, scale them to the length of each reading
+        if resolution in READ_PERIODS:
+            return [round(kwh * points * step_hours, 3) for kwh, (_, points) in zip(draws, periods)]
+        if step_hours != 1:
+            return [round(kwh * step_hours, 3) for kwh in draws]
+        return draws
+
+    def _generate_point_consumption(self, cursor, kind, point_id, db_details_base, axis, start, end,
+                                    metering_state_code='', consumption_args=None, resolution=HOURLY,
+                                    profile=None, register=None):
+        """
+        Generates, stores and renders the consumption of one accounting point
+        (kind 'apoint') or exchange point (kind 'rpoint') for time axis points
+        start..end-1. The period goes through in blocks of one UTC month
+        (_period_blocks): the block's values are drawn, inserted in bulk and
+        appended to the XML file before the next block is generated, so the
+        memory used does not grow with the length of the period.
+        With resolution P1D or P1M one read per local day or month is generated
+        and stored at the period's first time point. With profile (source,
+        assignment) the values follow the load profile or replayed series,
+        otherwise they are uniform random draws. With register (the E14 meter
+        register in kWh before start) the XML reports the cumulative register
+        after each read instead of the read's energy; the DB always stores
+        the energies, which the aggregates sum.
+        Returns the generated XML path or None.
+        """
+        if end <= start:
+            return None
+        periods = self._read_periods(axis, start, end, resolution)
+
+        if kind == 'apoint':
+            # Original format: <urn4:OBS><urn4:SEQ>{}</urn4:SEQ><urn4:EOBS><urn4:QTY>{}</urn4:QTY><urn4:QQ>{}</urn4:QQ></urn4:EOBS></urn4:OBS>
+            quality = f"<QualityCode>{metering_state_code}</QualityCode>" if metering_state_code else "<QualityCode />"
+        else:
+            # Note: RPoint XML structure might be simpler or different for QualityCode
+            quality = '' if not metering_state_code else f'<QualityCode>{metering_state_code}</QualityCode>'
+        observation = ("\t\t\t\t\t\t\t\t<Observation>\n\t\t\t\t\t\t\t\t\t<Sequence>{}</Sequence>\n\t\t\t\t\t\t\t\t\t<EnergyObservation>\n"
+                       "\t\t\t\t\t\t\t\t\t\t<Quantity>{}</Quantity>\n\t\t\t\t\t\t\t\t\t\t" + quality +
+                       "\n\t\t\t\t\t\t\t\t\t</EnergyObservation>\n\t\t\t\t\t\t\t\t</Observation>\n")
+
+        def stored_observations():
+            """Generates and stores the blocks, yielding the XML observations of each."""
+            nonlocal register
+            db_timestamps, local_days = axis.db_timestamps, axis.local_days
+            sequence = 1
+            for block in self._period_blocks(axis, periods):
+                values = self._block_values(axis, block, resolution, profile, consumption_args)
+                readings = [(db_timestamps[i], value) for (i, _), value in zip(block, values)]
+                inserted = self._insert_consumption_db(cursor, kind, db_details_base, readings, resolution)
+                self._update_aggregates(cursor, kind, db_details_base, readings, [local_days[i] for i, _ in block],
+                                        resolution, inserted)
+                if self.columnar is not None:
+                    self.columnar.write(kind, axis, point_id, [(i, value) for (i, _), value in zip(block, values)])
+                if kind == 'apoint' and resolution in READ_PERIODS:
+                    last_index, last_points = block[-1]
+                    cursor.execute("INSERT INTO read_coverage (APOINT_ID, LAST_TS) VALUES (?, ?) "
+                                   "ON CONFLICT(APOINT_ID) DO UPDATE SET LAST_TS = MAX(LAST_TS, excluded.LAST_TS)",
+                                   (point_id, db_timestamps[last_index + last_points - 1]))
+                if register is not None: # Register readings carry over from block to block
+                    values = [round(total, 3) for total in itertools.accumulate(values, initial=register)][1:]
+                    register = values[-1]
+                yield "".join([observation.format(seq, value) for seq, value in enumerate(values, sequence)])
+                sequence += len(values)
+
+        self._set_period(axis, start, end)
+        self.transient_data['resolution'] = resolution
+        date_str_for_filename = axis.local_days[start] # DD-MM-YYYY, local date of the first point
+        observations = stored_observations()
+        if kind == 'apoint':
+            xml_path = self._generate_apoint_xml(point_id, date_str_for_filename, observations)
+        else:
+            xml_path = self._generate_rpoint_xml(point_id, date_str_for_filename, observations)
+        for _ in observations: # The XML could not be written, the readings are stored anyway
+            pass
+        return xml_path
+
+    def _commit(self, conn):
+        """
+        Commits the partitions and the columnar store first, so a committed
+        checkpoint never runs ahead of them.
+        """
+        if self.partitions is not None:
+            self.partitions.commit()
+        if self.columnar is not None:
+            self.columnar.commit()
+        conn.commit()
+
+    def _register_before(self, conn, point_id, before):
+        """
+        Output: E14 register reading (kWh) of an AP at the DB timestamp before:
+        register_start() plus the energies of its stored readings before it,
+        over all partitions, so incremental runs continue the register.
+        """
+        connections = [conn] if self.partitions is None else \
+            [self.partitions.connection(key) for key in self.partitions.keys()]
+        total = register_start(point_id)
+        for part_conn in connections:
+            if self.db_storage == 'series':
+                total += sum(row['KULUTUS'] for row in SeriesStore(part_conn).readings('apoint', point_id, end=before))
+            else:
+                total += part_conn.execute("SELECT COALESCE(SUM(KULUTUS), 0) FROM apoint WHERE APOINT_ID = ? AND TIMESTAMP < ?",
+                                           (point_id, before)).fetchone()[0]
+        return total
+
+    def _covered_periods(self, conn, kind, point_ids=None):
+        """
+        Returns {point id: (first, last) DB timestamp} of kind's stored
+        readings, over all partitions when the database is partitioned.
+        The batch asks for one chunk of point_ids at a time.
+        """
+        id_column = 'APOINT_ID' if kind == 'apoint' else 'RPOINT_ID'
+        connections = [conn] if self.partitions is None else \
+            [self.partitions.connection(key) for key in self.partitions.keys()]
+        covered = {}
+        for part_conn in connections:
+            if self.db_storage == 'series':
+                periods = SeriesStore(part_conn).covered_periods(kind, point_ids)
+            else:
+                periods = self._load_covered_periods(part_conn.cursor(), kind, id_column, point_ids)
+            for point_id, (first, last) in periods.items():
+                if point_id in covered:
+                    first, last = min(first, covered[point_id][0]), max(last, covered[point_id][1])
+                covered[point_id] = (first, last)
+        return covered
+
+    @staticmethod
+    def _csv_chunks(csvfile, size=CHUNK_SIZE, fields=None):
+        """
+        Yields lists of (row number, row dict) of an open CSV file, size rows
+        at a time. fields (e.g. rp_fields) maps each row dict first.
+        """
+        rows = csv.DictReader(csvfile)
+        rows = enumerate(map(fields, rows) if fields else rows)
+        while True:
+            chunk = list(itertools.islice(rows, size))
+            if not chunk:
+                return
+            yield chunk
+
     def _batch_generate_consumption(self, start_date_input, num_days_input,
-                                  target_apoint_id=None, metering_state_code=''):
+                                  target_apoint_id=None, metering_state_code='', incremental=False,
+                                  resume_state=None):
         """
         Orchestrates the consumption data generation for APs and RPs.
         Can run for a single AP/RP or all APs/RPs found in CSV files.
+        With incremental=True only hours outside the period each point
+        already has in the database are generated, stored and rendered.
+
+        Points are read from the CSV files CHUNK_SIZE at a time, so memory use
+        does not depend on the amount of points. In batch mode a checkpoint
+        (CSV position and RNG state) is committed together with each chunk's rows. resume_state continues from such a
+        checkpoint and produces the same consumption values an uninterrupted
+        run would have.
         """
         print(cyan + "Starting consumption generation batch..." + reset)
         try:
             # Use transient_data for hours/start_time which are set by prompt or defaults
-            hourly_timestamps = self._generate_dates(
+            axis = self._generate_time_axis(
                 start_date_str_input=start_date_input,
                 num_days_str_input=num_days_input
                 # start_time_str and hours_per_day_val will use defaults from self.transient_data
                 # if not overridden by more specific logic (e.g. prompt setting them directly)
             )
-            if not hourly_timestamps:
+            if not len(axis):
                 print(red + "Failed to generate date range. Aborting batch." + reset)
                 return
 
-            first_date_for_filename = hourly_timestamps[0].split('T')[0] # Get DD-MM-YYYY part
+            # Resolved run parameters, so a resumed run needs no prompts
+            checkpoint_base = {
+                'start_date': axis.start_date.strftime("%d.%m.%Y"),
+                'num_days': str(axis.num_days),
+                'hours_to_generate': self.transient_data['hours_to_generate'],
+                'series_resolution': self.transient_data['series_resolution'],
+                'start_time_for_generation': self.transient_data['start_time_for_generation'],
+                'metering_state_code': metering_state_code,
+                'incremental': incremental,
+            }
+            resume_phase = resume_state['phase'] if resume_state else None
+            resume_row = resume_state['row'] if resume_state else 0
+            if resume_state:
+                ra.setstate(resume_state['rng_state'])
 
         except (ValueError, TypeError) as e:
             print(red + f"Error in date setup: {e}. Aborting batch." + reset)
             return
 
+        series = self.transient_data['series_resolution']
+
+        def segments_for(covered_periods, point_id, resolution=HOURLY, read_ends=None):
+            """Time axis (start, end) ranges to generate for a point, the whole axis unless incremental."""
+            if not incremental:
+                return [(0, len(axis))]
+            return self._missing_segments(axis, covered_periods.get(point_id), resolution,
+                                          (read_ends or {}).get(point_id))
+
+        def register_for(method, point_id, start):
+            """E14 register before time axis point start, None for the other metering methods."""
+            if (method or '').strip() != 'E14':
+                return None
+            return self._register_before(conn, point_id, axis.db_timestamps[start])
+
         try:
             with self._db_connect() as conn: # Ensure DB connection is managed per batch
                 cursor = conn.cursor()
+                ap_consumption_args = {'use_prod_value': bool(self.config.get('prod_ap')), # True if prod_ap has a value
+                                       'prod_config_key': 'prod_ap'}
+                skipped = 0
+                unmetered = 0
 
                 if target_apoint_id: # Single AP generation mode
                     print(f"Generating for single AP: {target_apoint_id}")
@@ -654,28 +1279,20 @@ class ConsumptionGenerator:
                     self.transient_data['current_mga'] = ap_details.get('mga')
                     # Other transient_data like metric, metric_id are already set by __init__ or prompt
 
-                    xml_data_points_str = ""
-                    obs_count = 0
-                    for ts_str in hourly_timestamps:
-                        obs_count += 1
-                        consumption = self._calculate_hourly_consumption(
-                            use_prod_value=bool(self.config.get('prod_ap')), # True if prod_ap has a value
-                            prod_config_key='prod_ap'
-                        )
-                        # Accumulate XML data points string
-                        # Original format: <urn4:OBS><urn4:SEQ>{}</urn4:SEQ><urn4:EOBS><urn4:QTY>{}</urn4:QTY><urn4:QQ>{}</urn4:QQ></urn4:EOBS></urn4:OBS>
-                        # Assuming urn4 is the namespace for E66_EnergyTimeSeries:elements
-                        # This structure needs to be exact. For now, using a simplified placeholder for data points.
-                        # The actual XML structure for observations should be confirmed from template.
-                        xml_data_points_str += f"\t\t\t\t\t\t\t\t<Observation>\n\t\t\t\t\t\t\t\t\t<Sequence>{obs_count}</Sequence>\n\t\t\t\t\t\t\t\t\t<EnergyObservation>\n\t\t\t\t\t\t\t\t\t\t<Quantity>{consumption}</Quantity>\n\t\t\t\t\t\t\t\t\t\t<QualityCode>{metering_state_code}</QualityCode>\n\t\t\t\t\t\t\t\t\t</EnergyObservation>\n\t\t\t\t\t\t\t\t</Observation>\n"
-
-                        db_data = {**ap_details, 'timestamp': ts_str, 'kulutus': consumption}
-                        self._insert_apoint_consumption_db(cursor, db_data)
-
-                    conn.commit() # Commit after all DB operations for this AP
-
-                    if xml_data_points_str:
-                        generated_xml_path = self._generate_apoint_xml(target_apoint_id, first_date_for_filename, xml_data_points_str)
+                    resolution = ap_resolution(ap_details.get('method'), series, self.e14_read_period)
+                    if resolution is None:
+                        print(yellow + f"AP {target_apoint_id} is unmetered (E16), no metered data to generate." + reset)
+                        return
+
+                    ap_covered = self._covered_periods(conn, 'apoint', [target_apoint_id]) if incremental else {}
+                    read_ends = self._read_ends(cursor, [target_apoint_id]) if incremental else {}
+                    profile = self._ap_profile(target_apoint_id, ap_details.get('ap_type'))
+                    for start, end in segments_for(ap_covered, target_apoint_id, resolution, read_ends):
+                        generated_xml_path = self._generate_point_consumption(
+                            cursor, 'apoint', target_apoint_id, ap_details, axis, start, end,
+                            metering_state_code, ap_consumption_args, resolution, profile,
+                            register_for(ap_details.get('method'), target_apoint_id, start))
+                        self._commit(conn) # Commit after all DB operations for this AP
                         if generated_xml_path:
                             Printer(f"AP {target_apoint_id}: XML generated at {generated_xml_path}")
                         else:
@@ -689,45 +1306,57 @@ class ConsumptionGenerator:
                     else:
                         print(cyan + f"Processing Accounting Points from {self.apoint_csv_path}..." + reset)
                         with open(self.apoint_csv_path, 'r', newline='', encoding='utf-8') as ap_csvfile:
-                            ap_reader = csv.DictReader(ap_csvfile)
-                            for row_num, ap_row in enumerate(ap_reader):
-                                current_ap_id = ap_row.get('Accounting point')
-                                if not current_ap_id:
-                                    print(yellow + f"Warning: Skipping row {row_num+2} in {self.apoint_csv_path} due to missing AP ID." + reset)
-                                    continue
-
-                                Printer(f"Processing AP: {current_ap_id}...")
-                                self.transient_data['current_dso'] = ap_row.get('DSO')
-                                self.transient_data['current_mga'] = ap_row.get('MGA')
-                                # Populate other needed ap_details for DB insert from ap_row
-                                ap_db_details_base = {
-                                    'apoint_id': current_ap_id,
-                                    'meteringpoint': ap_row.get('Metering Area'),
-                                    'supplier': ap_row.get('Supplier'),
-                                    'dso': ap_row.get('DSO'),
-                                    'mga': ap_row.get('MGA'),
-                                    'ap_type': ap_row.get('AP type'),
-                                    'remote_read': ap_row.get('Remote readable'),
-                                    'method': ap_row.get('Metering method')
-                                }
-
-                                xml_data_points_str = ""
-                                obs_count = 0
-                                for ts_str in hourly_timestamps:
-                                    obs_count += 1
-                                    consumption = self._calculate_hourly_consumption(
-                                        use_prod_value=bool(self.config.get('prod_ap')),
-                                        prod_config_key='prod_ap'
-                                    )
-                                    xml_data_points_str += f"\t\t\t\t\t\t\t\t<Observation>\n\t\t\t\t\t\t\t\t\t<Sequence>{obs_count}</Sequence>\n\t\t\t\t\t\t\t\t\t<EnergyObservation>\n\t\t\t\t\t\t\t\t\t\t<Quantity>{consumption}</Quantity>\n\t\t\t\t\t\t\t\t\t\t<QualityCode>{metering_state_code}</QualityCode>\n\t\t\t\t\t\t\t\t\t</EnergyObservation>\n\t\t\t\t\t\t\t\t</Observation>\n"
-
-                                    db_data = {**ap_db_details_base, 'timestamp': ts_str, 'kulutus': consumption}
-                                    self._insert_apoint_consumption_db(cursor, db_data)
-
-                                conn.commit() # Commit per AP
-                                if xml_data_points_str:
-                                    self._generate_apoint_xml(current_ap_id, first_date_for_filename, xml_data_points_str)
-                                Printer(f"AP {current_ap_id} processing complete.\n")
+                            for chunk in self._csv_chunks(ap_csvfile):
+                                if resume_phase == 'rpoint' or (resume_phase == 'apoint' and chunk[-1][0] < resume_row):
+                                    continue # Done before the interruption
+                                chunk_ids = [row.get('Accounting point') for _, row in chunk]
+                                ap_covered = self._covered_periods(conn, 'apoint', chunk_ids) if incremental else {}
+                                read_ends = self._read_ends(cursor, chunk_ids) if incremental else {}
+                                for row_num, ap_row in chunk:
+                                    if resume_phase == 'rpoint' or (resume_phase == 'apoint' and row_num < resume_row):
+                                        continue # Done before the interruption
+                                    current_ap_id = ap_row.get('Accounting point')
+                                    if not current_ap_id:
+                                        print(yellow + f"Warning: Skipping row {row_num+2} in {self.apoint_csv_path} due to missing AP ID." + reset)
+                                        continue
+
+                                    resolution = ap_resolution(ap_row.get('Metering method'), series, self.e14_read_period)
+                                    if resolution is None:
+                                        unmetered += 1
+                                        continue
+
+                                    segments = segments_for(ap_covered, current_ap_id, resolution, read_ends)
+                                    if not segments:
+                                        skipped += 1
+                                        continue
+
+                                    Printer(f"Processing AP: {current_ap_id}...")
+                                    self.transient_data['current_dso'] = ap_row.get('DSO')
+                                    self.transient_data['current_mga'] = ap_row.get('MGA')
+                                    # Populate other needed ap_details for DB insert from ap_row
+                                    ap_db_details_base = {
+                                        'apoint_id': current_ap_id,
+                                        'meteringpoint': ap_row.get('Metering Area'),
+                                        'supplier': ap_row.get('Supplier'),
+                                        'dso': ap_row.get('DSO'),
+                                        'mga': ap_row.get('MGA'),
+                                        'ap_type': ap_row.get('AP type'),
+                                        'remote_read': ap_row.get('Remote readable'),
+                                        'method': ap_row.get('Metering method')
+                                    }
+
+                                    profile = self._ap_profile(current_ap_id, ap_row.get('AP type'))
+                                    for start, end in segments:
+                                        self._generate_point_consumption(
+                                            cursor, 'apoint', current_ap_id, ap_db_details_base, axis, start, end,
+                                            metering_state_code, ap_consumption_args, resolution, profile,
+                                            register_for(ap_row.get('Metering method'), current_ap_id, start))
+                                    Printer(f"AP {current_ap_id} processing complete.\n")
+                                # The chunk's readings, aggregates and checkpoint are committed together
+                                self._save_checkpoint(cursor, {**checkpoint_base, 'phase': 'apoint', 'row': chunk[-1][0] + 1,
+                                                               'point': chunk[-1][1].get('Accounting point'),
+                                                               'rng_state': ra.getstate()})
+                                self._commit(conn)
                         sys.stdout.write("\n") # Newline after Printer loop
 
                     # --- Exchange Points (rp.csv) ---
@@ -735,50 +1364,65 @@ class ConsumptionGenerator:
                         print(yellow + f"Warning: {self.rpoint_csv_path} not found. Skipping exchange point consumption." + reset)
                     else:
                         print(cyan + f"Processing Exchange Points from {self.rpoint_csv_path}..." + reset)
+                        flows = self._exchange_flows(cursor, axis) if self.exchange_flows == 'derived' else None
                         with open(self.rpoint_csv_path, 'r', newline='', encoding='utf-8') as rp_csvfile:
-                            rp_reader = csv.DictReader(rp_csvfile)
-                            # Expected headers in rp.csv: ID,DSO,IN_AREA,OUT_AREA,MIN_KWH,MAX_KWH (example)
-                            for row_num, rp_row in enumerate(rp_reader):
-                                current_rp_id = rp_row.get('ID') or rp_row.get('RPOINT_ID') # Check common names
-                                if not current_rp_id:
-                                    print(yellow + f"Warning: Skipping row {row_num+2} in {self.rpoint_csv_path} due to missing RP ID." + reset)
-                                    continue
-
-                                Printer(f"Processing RP: {current_rp_id}...")
-                                self.transient_data['current_dso'] = rp_row.get('DSO')
-                                self.transient_data['current_rpoint_in_area'] = rp_row.get('IN_AREA')
-                                self.transient_data['current_rpoint_out_area'] = rp_row.get('OUT_AREA')
-                                rp_min_kwh = rp_row.get('MIN_KWH')
-                                rp_max_kwh = rp_row.get('MAX_KWH')
-
-                                rp_db_details_base = {
-                                    'rpoint_id': current_rp_id,
-                                    'dso': rp_row.get('DSO'),
-                                    'r_in': rp_row.get('IN_AREA'),
-                                    'r_out': rp_row.get('OUT_AREA')
-                                }
-
-                                xml_data_points_str = ""
-                                obs_count = 0
-                                for ts_str in hourly_timestamps:
-                                    obs_count += 1
-                                    consumption = self._calculate_hourly_consumption(
-                                        min_val_str=rp_min_kwh, max_val_str=rp_max_kwh,
-                                        use_prod_value=bool(self.config.get('prod_ep')),
-                                        prod_config_key='prod_ep'
-                                    )
-                                    # Note: RPoint XML structure might be simpler or different for QualityCode
-                                    xml_data_points_str += f"\t\t\t\t\t\t\t\t<Observation>\n\t\t\t\t\t\t\t\t\t<Sequence>{obs_count}</Sequence>\n\t\t\t\t\t\t\t\t\t<EnergyObservation>\n\t\t\t\t\t\t\t\t\t\t<Quantity>{consumption}</Quantity>\n\t\t\t\t\t\t\t\t\t\t{'' if not metering_state_code else f'<QualityCode>{metering_state_code}</QualityCode>'}\n\t\t\t\t\t\t\t\t\t</EnergyObservation>\n\t\t\t\t\t\t\t\t</Observation>\n"
-
-                                    db_data = {**rp_db_details_base, 'timestamp': ts_str, 'kulutus': consumption}
-                                    self._insert_rpoint_consumption_db(cursor, db_data)
-
-                                conn.commit() # Commit per RP
-                                if xml_data_points_str:
-                                    self._generate_rpoint_xml(current_rp_id, first_date_for_filename, xml_data_points_str)
-                                Printer(f"RP {current_rp_id} processing complete.\n")
+                            # Rows with the RP_COLUMNS keys whichever header rp.csv has
+                            for chunk in self._csv_chunks(rp_csvfile, fields=rp_fields):
+                                if resume_phase == 'rpoint' and chunk[-1][0] < resume_row:
+                                    continue # Done before the interruption
+                                rp_covered = self._covered_periods(
+                                    conn, 'rpoint', [row['ID'] for _, row in chunk]) if incremental else {}
+                                for row_num, rp_row in chunk:
+                                    if resume_phase == 'rpoint' and row_num < resume_row:
+                                        continue # Done before the interruption
+                                    current_rp_id = rp_row['ID']
+                                    if not current_rp_id:
+                                        print(yellow + f"Warning: Skipping row {row_num+2} in {self.rpoint_csv_path} due to missing RP ID." + reset)
+                                        continue
+
+                                    segments = segments_for(rp_covered, current_rp_id)
+                                    if not segments:
+                                        skipped += 1
+                                        continue
+
+                                    Printer(f"Processing RP: {current_rp_id}...")
+                                    self.transient_data['current_dso'] = rp_row.get('DSO')
+                                    self.transient_data['current_rpoint_in_area'] = rp_row.get('IN_AREA')
+                                    self.transient_data['current_rpoint_out_area'] = rp_row.get('OUT_AREA')
+
+                                    rp_db_details_base = {
+                                        'rpoint_id': current_rp_id,
+                                        'dso': rp_row.get('DSO'),
+                                        'r_in': rp_row.get('IN_AREA'),
+                                        'r_out': rp_row.get('OUT_AREA')
+                                    }
+                                    rp_consumption_args = {
+                                        'min_val_str': rp_row.get('MIN_KWH'), 'max_val_str': rp_row.get('MAX_KWH'),
+                                        'use_prod_value': bool(self.config.get('prod_ep')),
+                                        'prod_config_key': 'prod_ep'
+                                    }
+
+                                    profile = (flows, current_rp_id) if flows is not None else None
+                                    for start, end in segments:
+                                        self._generate_point_consumption(
+                                            cursor, 'rpoint', current_rp_id, rp_db_details_base, axis, start, end,
+                                            metering_state_code, rp_consumption_args, series, profile)
+                                    Printer(f"RP {current_rp_id} processing complete.\n")
+                                self._save_checkpoint(cursor, {**checkpoint_base, 'phase': 'rpoint', 'row': chunk[-1][0] + 1,
+                                                               'point': chunk[-1][1]['ID'],
+                                                               'rng_state': ra.getstate()})
+                                self._commit(conn)
                         sys.stdout.write("\n") # Newline after Printer loop
 
+                    # Batch completed, nothing left to resume
+                    cursor.execute("DELETE FROM batch_checkpoint")
+                    self._commit(conn)
+
+                if unmetered:
+                    print(cyan + f"{unmetered} unmetered (E16) AP(s) have no metered data, skipped." + reset)
+                if incremental and skipped:
+                    print(cyan + f"Incremental mode: {skipped} point(s) already had the whole period, skipped." + reset)
+
         except FileNotFoundError as e: # Catch if CSVs are not found when attempting to open
             print(red + f"Error: Required CSV file not found: {e}. Aborting batch." + reset)
         except sqlite3.Error as e:
@@ -788,9 +1432,11 @@ class ConsumptionGenerator:
             import traceback
             traceback.print_exc()
 
-    def get_all_apoint_ids_from_csv(self):
-        """Reads apoint_csv_path and returns a list of Accounting Point IDs."""
-        ap_ids = []
+    def get_all_apoint_ids_from_csv(self, **filters):
+        """
+        Returns a list of Accounting Point IDs from the kp.csv registry.
+        Optional filters: dso, mga, supplier, ap_type, method.
+        """
         if not os.path.exists(self.apoint_csv_path):
             # This was the original behavior of kpaikat() if kp.csv missing, it would run kpgen.
             # That's too much of a side effect for a 'list' or data gathering command.
@@ -799,12 +1445,7 @@ class ConsumptionGenerator:
             return []
 
         try:
-            with open(self.apoint_csv_path, 'r', newline='', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    if row.get('Accounting point'):
-                        ap_ids.append(row['Accounting point'])
-            return ap_ids
+            return self.ap_registry.ids(**filters)
         except Exception as e:
             print(red + f"Error reading AP IDs from {self.apoint_csv_path}: {e}" + reset)
             return []
@@ -834,14 +1475,17 @@ class InteractivePrompt(Cmd):
         self.metric_name = 'kWh'
         self.metric_id_val = '8716867000030' # Default metric ID for kWh
 
-        # For 'list_apoint' command
-        self._cached_apoint_ids = None # Can be used to cache if CSV reading is slow
-
     def do_list_apoint(self, arg):
-        """Lists all accounting points found in the kp.csv file."""
-        # Invalidate cache if arg is 'refresh' or similar, or just always re-read for simplicity
-        # For now, always re-read.
-        ap_ids = self.generator.get_all_apoint_ids_from_csv()
+        """Lists accounting points found in the kp.csv file, optionally filtered."""
+        # The registry re-imports kp.csv only when it has changed
+        filters = {}
+        for item in arg.split():
+            key, _, value = item.partition('=')
+            if key not in ('dso', 'mga', 'supplier') or not value:
+                print(red + f"Invalid filter '{item}'. Use dso=<id>, mga=<id> or supplier=<id>." + reset)
+                return
+            filters[key] = value
+        ap_ids = self.generator.get_all_apoint_ids_from_csv(**filters)
         if not ap_ids:
             print(magenta + "No accounting points found or kp.csv is missing/empty." + reset)
             return
@@ -859,8 +1503,8 @@ class InteractivePrompt(Cmd):
         print(cyan + f"\nTotal: {len(ap_ids)}" + reset)
 
     def help_list_apoint(self):
-        print("Syntax: list_apoint")
-        print("-- Lists all available accounting points from kp.csv.")
+        print("Syntax: list_apoint [dso=<id>] [mga=<id>] [supplier=<id>]")
+        print("-- Lists all available accounting points from kp.csv, optionally filtered.")
 
     def do_reset(self, arg):
         """Resets all prompt settings to their default values."""
@@ -881,6 +1525,7 @@ class InteractivePrompt(Cmd):
         self.generator.transient_data['start_time_for_generation'] = "00:00"
         self.generator.transient_data['metric'] = 'kWh'
         self.generator.transient_data['metric_id'] = '8716867000030'
+        self.generator.transient_data['series_resolution'] = HOURLY
         self.generator.transient_data['last_generated_xml_path'] = None
 
         self.prompt = green + '<kulugen> ' + reset # Reset prompt appearance
@@ -906,18 +1551,18 @@ class InteractivePrompt(Cmd):
                  print(red + "Error: Number of Days (or specific Hours) not set correctly. Use 'set days <n>' or 'set hours <h>'." + reset)
                  return
             elif self.hours_val > 0 and self.hours_val < 24 :
-                 # This is a sub-day generation, set days_val to 1 for _generate_dates logic.
+                 # This is a sub-day generation, set days_val to 1 for _generate_time_axis logic.
                  # The actual duration is handled by hours_val in transient_data.
-                 # _generate_dates uses num_days * hours_val for total hours.
+                 # _generate_time_axis uses num_days * hours_val for total hours.
                  # So if we want to generate for X hours total, and days_val is 1, hours_val should be X.
                  # If self.days_val is 0 from 'set days 0', but 'set hours X' was used,
                  # it means user wants to generate for X total hours, starting on startdate.
-                 # _generate_dates will use num_days=1 (implicit if days_val=0 passed as num_days_str_input=None to it, or explicit)
+                 # _generate_time_axis will use num_days=1 (implicit if days_val=0 passed as num_days_str_input=None to it, or explicit)
                  # and hours_per_day_val = self.hours_val.
                  # For now, let's ensure days_val is at least 1 if hours_val implies a full day or more.
                  # If hours_val is < 24, it's fine for days_val to be 1.
-                 # The logic in _generate_dates might need to be robust to days_val=0 if hours_val is the primary driver.
-                 # Current _generate_dates requires days_val >= 1 if num_days_str_input is None.
+                 # The logic in _generate_time_axis might need to be robust to days_val=0 if hours_val is the primary driver.
+                 # Current _generate_time_axis requires days_val >= 1 if num_days_str_input is None.
                  # Let's assume if hours_val is set to <24, days_val should be 1.
                  if self.days_val == 0: self.days_val = 1 # Default to 1 day if generating specific hours.
 
@@ -926,7 +1571,7 @@ class InteractivePrompt(Cmd):
         print(f"  Metric: {self.metric_name} ({self.metric_id_val}), State: '{self.metering_state_code if self.metering_state_code else 'OK'}'")
 
         # Update generator's transient_data with prompt's current settings
-        self.generator.transient_data['hours_to_generate'] = self.hours_val # This is hours_per_day for _generate_dates
+        self.generator.transient_data['hours_to_generate'] = self.hours_val # This is hours_per_day for _generate_time_axis
         self.generator.transient_data['start_time_for_generation'] = self.starttime_str
         self.generator.transient_data['metric'] = self.metric_name
         self.generator.transient_data['metric_id'] = self.metric_id_val
@@ -934,7 +1579,7 @@ class InteractivePrompt(Cmd):
 
         self.generator._batch_generate_consumption(
             start_date_input=self.startdate_str,
-            num_days_str_input=str(self.days_val),
+            num_days_input=str(self.days_val),
             target_apoint_id=self.apoint,
             metering_state_code=self.metering_state_code # Pass the code directly
         )
@@ -944,7 +1589,7 @@ class InteractivePrompt(Cmd):
             print(red + "XML generation may have failed or was skipped." + reset)
 
     # --- `set` command and its helpers ---
-    _set_commands = ('apoint', 'startdate', 'days', 'hours', 'starttime', 'metering_state', 'metric', 'mga')
+    _set_commands = ('apoint', 'startdate', 'days', 'hours', 'starttime', 'metering_state', 'metric', 'mga', 'resolution')
     # (Note: 'mga' was in original set_commands, but its direct utility in kulugen prompt was less clear
     # as MGA for XML is derived from apoint's CSV data. Keeping for compatibility if some logic used it.)
 
@@ -988,6 +1633,8 @@ class InteractivePrompt(Cmd):
                 self._set_metric(value)
             elif setting == 'mga': # MGA is usually derived, but allow display/override if needed
                 self._set_mga(value)
+            elif setting == 'resolution':
+                self._set_resolution(value)
         except ValueError as e:
             print(red + f"Error setting '{setting}': {e}" + reset)
 
@@ -1003,6 +1650,7 @@ class InteractivePrompt(Cmd):
         print(f"  Start Time (starttime):  {green}{self.starttime_str}{reset}")
         print(f"  Metering State (state):  {green}{self.metering_state_code if self.metering_state_code else 'OK'}{reset}")
         print(f"  Metric (metric):         {green}{self.metric_name} (ID: {self.metric_id_val}){reset}")
+        print(f"  Resolution (resolution): {green}{self.generator.transient_data['series_resolution']}{reset}")
 
     def _require_apoint_set(self, for_setting):
         if not self.apoint:
@@ -1122,6 +1770,13 @@ class InteractivePrompt(Cmd):
         self.mga = mga_str # This is prompt's local MGA, distinct from AP's MGA.
         print(cyan + f"Prompt MGA manually set to: {self.mga}. This may be overridden by 'set apoint'." + reset)
 
+    def _set_resolution(self, resolution_str):
+        resolution = resolution_str.upper()
+        if resolution not in INTERVAL_MINUTES:
+            raise ValueError(f"Invalid resolution '{resolution_str}'. Valid resolutions: {', '.join(INTERVAL_MINUTES)}.")
+        self.generator.transient_data['series_resolution'] = resolution
+        print(cyan + f"Resolution set to: {resolution}" + reset)
+
     def help_set(self):
         print(cyan + "Usage: set <parameter> <value>" + reset)
         print("Sets parameters for consumption data generation. Type 'set' to see current values.")
@@ -1133,6 +1788,7 @@ class InteractivePrompt(Cmd):
         print("         set startdate 01.01.2023")
         print("         set days 7")
         print("         set metering_state Estimated")
+        print("         set resolution PT15M")
         print(magenta + "Note: 'apoint' must typically be set first." + reset)
 
     def complete_set(self, text, line, begidx, endidx):
@@ -1176,6 +1832,28 @@ class InteractivePrompt(Cmd):
         print("-- If start_date and num_days are not provided, you will be prompted for them.")
         print("-- This does not use 'set' parameters like specific apoint or metering_state.")
 
+    def do_report(self, arg_str):
+        """Prints balance aggregates or rebuilds them."""
+        args = arg_str.split()
+        if not args or len(args) > 3:
+            self.help_report()
+            return
+        if args[0] == 'rebuild':
+            self.generator.rebuild_aggregates()
+            return
+        try:
+            self.generator.print_report(args[0], *args[1:])
+        except ValueError as e:
+            print(red + f"Invalid date or days: {e}" + reset)
+
+    def help_report(self):
+        print("Syntax: report mga|dso|supplier|exchange [start_date_dd.mm.yyyy [num_days]]")
+        print("        report rebuild")
+        print("-- Prints the balance aggregates kulugen maintains while generating:")
+        print("-- mga: MGA hourly consumption/production, dso and supplier: daily totals,")
+        print("-- exchange: hourly exchange point energy in/out per area.")
+        print("-- 'rebuild' recomputes them from the stored readings.")
+
     # do_send is now more specific to the last generated single_kulutus XML
     def do_send(self, arg):
         """Sends the last generated XML file (from 'single_kulutus') to Datahub."""
@@ -1194,11 +1872,11 @@ class InteractivePrompt(Cmd):
         xml_filename_only = os.path.basename(last_xml_path)
 
         # Confirm the file actually exists where req_utils expects it
-        # req_utils.send_generic prepends its own 'xml/' path
-        expected_path_for_req_utils = os.path.join("xml", xml_filename_only)
-        if not os.path.exists(expected_path_for_req_utils):
-            # This might happen if last_xml_path was absolute or not in the root 'xml/' dir.
-            # For simplicity, we assume generator places it in 'xml/' relative to script root.
+        # req_utils.send_generic prepends the 'xml/' path of the workspace
+        expected_path_for_req_utils = workspace.path("xml", xml_filename_only) # Any xml_layout
+        if not xmllayout.exists(workspace.path("xml"), xml_filename_only):
+            # This might happen if last_xml_path was absolute or not in the workspace 'xml/' dir.
+            # For simplicity, we assume generator places it in 'xml/' of the workspace.
             print(red + f"Error: XML file '{xml_filename_only}' not found at expected location '{expected_path_for_req_utils}'." + reset)
             print(red + "Ensure it was generated into the correct directory by 'single_kulutus'." + reset)
             return
@@ -1262,6 +1940,11 @@ class InteractivePrompt(Cmd):
         print(cyan + "Use 'help <command>' to get help on a specific command." + reset)
         print(cyan + "Available commands are listed when you type 'help' or '?'." + reset)
 
+    def do_exit(self, arg):
+        """Exits the interactive command prompt."""
+        print(cyan + "Bye!" + reset)
+        return True
+
     def help_exit(self):
         print("Syntax: exit")
         print("-- Exits the interactive command prompt.")
@@ -1272,15 +1955,18 @@ class InteractivePrompt(Cmd):
 
 def main_cli(argv):
     """Main command-line interface handler for kulugen."""
-    cmd_opts_dict = {'interactive_mode': False}
+    cmd_opts_dict = {'interactive_mode': False, 'incremental': False, 'resume': False, 'quarter_hourly': False,
+                     'report': None}
     start_date_str = None
     num_days_str = None
 
     try:
-        opts, args = getopt(argv, "hcs:d:", ["help", "interactive", "startdate=", "days="])
-    except GetoptError as e:
+        argv = workspace.from_argv(argv)
+        opts, args = getopt(argv, "hcirqs:d:", ["help", "interactive", "incremental", "resume", "quarter", "report=",
+                                                 "startdate=", "days="])
+    except (GetoptError, ValueError) as e:
         print(red + f"Argument parsing error: {e}" + reset, file=sys.stderr)
-        print(cyan + "Usage: kulugen.py [-c] [-s <startdate>] [-d <days>] [-h]" + reset, file=sys.stderr)
+        print(cyan + "Usage: kulugen.py [--workspace <dir>] [-c] [-i] [-r] [-q] [--report <name>] [-s <startdate>] [-d <days>] [-h]" + reset, file=sys.stderr)
         sys.exit(2)
 
     for opt, arg_val in opts:
@@ -1291,6 +1977,12 @@ def main_cli(argv):
             print("  -c, --interactive : Run in interactive command-line mode.")
             print("  -s, --startdate dd.mm.yyyy : Specify start date for batch generation.")
             print("  -d, --days <number>        : Specify number of days for batch generation.")
+            print("  -i, --incremental          : Generate only hours missing from fingrid.db.")
+            print("  -r, --resume               : Continue an interrupted batch run from its checkpoint.")
+            print("  -q, --quarter              : Generate 15 minute (PT15M) series instead of hourly.")
+            print("  --report mga|dso|supplier|exchange : Print balance aggregates (for -d days from -s).")
+            print("  --report rebuild           : Recompute the aggregates from the stored readings.")
+            print("  --workspace <dir>          : Keep kp.csv, xml/, log/ and the databases under <dir>.")
             print("  -h, --help                 : Display this help message.")
             print("\nIf -s and -d are provided without -c, runs in batch mode.")
             print("If only -c is provided, runs in interactive mode.")
@@ -1298,6 +1990,14 @@ def main_cli(argv):
             sys.exit(0)
         elif opt in ("-c", "--interactive"):
             cmd_opts_dict['interactive_mode'] = True
+        elif opt in ("-i", "--incremental"):
+            cmd_opts_dict['incremental'] = True
+        elif opt in ("-r", "--resume"):
+            cmd_opts_dict['resume'] = True
+        elif opt in ("-q", "--quarter"):
+            cmd_opts_dict['quarter_hourly'] = True
+        elif opt == "--report":
+            cmd_opts_dict['report'] = arg_val
         elif opt in ("-s", "--startdate"):
             start_date_str = arg_val
         elif opt in ("-d", "--days"):
@@ -1305,7 +2005,7 @@ def main_cli(argv):
 
     # Validate date and days if both provided for batch mode
     if start_date_str or num_days_str: # if either is set, both should be for non-interactive batch
-        if not (start_date_str and num_days_str):
+        if not (start_date_str and num_days_str) and not cmd_opts_dict['report']:
             print(red + "Error: Both start date (-s) and number of days (-d) must be provided for batch mode." + reset, file=sys.stderr)
             sys.exit(2)
         # Further validation (format, type) can be done here or in ConsumptionGenerator
@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Materialised balance aggregates of kulugen.
+
+kulugen adds every point's new readings to these tables of fingrid.db in
+the same transaction as the readings (and the batch checkpoint):
+
+    agg_mga_hour       MGA, UTC hour: consumption and AG02 production
+    agg_dso_day        DSO, local day: consumption and production
+    agg_supplier_day   supplier, local day: consumption and production
+    agg_exchange_hour  area, UTC hour: exchange point energy in and out
+
+Daily (P1D) and monthly (P1M) reads have no hour, so they are in the day
+tables (a monthly read on the first day of its month) but not in
+agg_mga_hour. An exchange point reading flows out of its OUT_AREA into its
+IN_AREA. When kulugen cannot tell which readings were new (part of a point's
+readings already existed) the tables are marked stale, and rebuild()
+recomputes them from the stored readings in one pass.
+
+ExchangeFlows derives exchange point readings from agg_mga_hour instead of
+drawing them, so that the hourly net consumption (consumption - production)
+of every area is covered by its exchange flows where the links allow it.
+"""
+
+import datetime
+
+import pytz
+
+from libs.timeaxis import LOCAL_TZ
+
+PRODUCTION_AP_TYPE = 'AG02'
+READ_PERIODS = ('P1D', 'P1M') # Resolutions of period reads, see kulugen.py
+
+REPORTS = {
+    # name: (table, key columns, value columns)
+    'mga': ('agg_mga_hour', ('MGA', 'HOUR'), ('CONSUMPTION', 'PRODUCTION', 'READINGS')),
+    'dso': ('agg_dso_day', ('DSO', 'DAY'), ('CONSUMPTION', 'PRODUCTION', 'READINGS')),
+    'supplier': ('agg_supplier_day', ('SUPPLIER', 'DAY'), ('CONSUMPTION', 'PRODUCTION', 'READINGS')),
+    'exchange': ('agg_exchange_hour', ('AREA', 'HOUR'), ('IN_KWH', 'OUT_KWH', 'READINGS')),
+}
+
+
+def ensure_tables(cursor):
+    for table, keys, values in REPORTS.values():
+        columns = ''.join(f"            {key} TEXT NOT NULL,\n" for key in keys)
+        columns += ''.join(f"            {value} {'INTEGER' if value == 'READINGS' else 'REAL'} NOT NULL DEFAULT 0,\n"
+                           for value in values)
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+{columns}            PRIMARY KEY({', '.join(keys)})
+        ) WITHOUT ROWID""")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS agg_state (
+            ID             INTEGER PRIMARY KEY CHECK (ID = 1),
+            STALE          INTEGER NOT NULL DEFAULT 0
+        )""")
+
+
+def local_day(db_timestamp, tz=LOCAL_TZ):
+    """UTC 'YYYY-MM-DD HH:MM:SS' -> local 'YYYY-MM-DD'"""
+    utc = pytz.utc.localize(datetime.datetime.strptime(db_timestamp, "%Y-%m-%d %H:%M:%S"))
+    return utc.astimezone(tz).strftime("%Y-%m-%d")
+
+
+class Totals:
+    """
+    Sums of a block of readings per aggregate key, written with one upsert per table.
+    """
+
+    def __init__(self):
+        self.sums = {name: {} for name in REPORTS}
+
+    @staticmethod
+    def _add(table, key, first, second, count=1):
+        row = table.get(key)
+        if row is None:
+            table[key] = [first, second, count]
+        else:
+            row[0] += first
+            row[1] += second
+            row[2] += count
+
+    def add_apoint(self, details, readings, days, resolution):
+        """
+        Input: {'mga', 'dso', 'supplier', 'ap_type'}, readings [(UTC DB timestamp, kWh)],
+               local 'YYYY-MM-DD' day of each reading, resolution
+        """
+        production = (details.get('ap_type') or '').strip() == PRODUCTION_AP_TYPE
+        mga, dso, supplier = details.get('mga') or '', details.get('dso') or '', details.get('supplier') or ''
+        mga_hour, dso_day, supplier_day = self.sums['mga'], self.sums['dso'], self.sums['supplier']
+        for (timestamp, kwh), day in zip(readings, days):
+            consumed, produced = (0.0, kwh) if production else (kwh, 0.0)
+            if resolution not in READ_PERIODS:
+                self._add(mga_hour, (mga, timestamp[:13] + ':00:00'), consumed, produced)
+            self._add(dso_day, (dso, day), consumed, produced)
+            self._add(supplier_day, (supplier, day), consumed, produced)
+
+    def add_rpoint(self, details, readings):
+        """Input: {'r_in', 'r_out'}, readings [(UTC DB timestamp, kWh)]"""
+        exchange = self.sums['exchange']
+        in_area, out_area = details.get('r_in') or '', details.get('r_out') or ''
+        for timestamp, kwh in readings:
+            hour = timestamp[:13] + ':00:00'
+            self._add(exchange, (in_area, hour), kwh, 0.0)
+            self._add(exchange, (out_area, hour), 0.0, kwh)
+
+    def flush(self, cursor):
+        for name, sums in self.sums.items():
+            if not sums:
+                continue
+            table, keys, values = REPORTS[name]
+            updates = ', '.join(f"{value} = {value} + excluded.{value}" for value in values)
+            cursor.executemany(f"INSERT INTO {table} ({', '.join(keys + values)}) VALUES (?, ?, ?, ?, ?) "
+                               f"ON CONFLICT({', '.join(keys)}) DO UPDATE SET {updates}",
+                               [key + tuple(row) for key, row in sums.items()])
+            sums.clear()
+
+
+def mark_stale(cursor):
+    cursor.execute("INSERT OR REPLACE INTO agg_state (ID, STALE) VALUES (1, 1)")
+
+
+def is_stale(cursor):
+    row = cursor.execute("SELECT STALE FROM agg_state WHERE ID = 1").fetchone()
+    return bool(row and row[0])
+
+
+def rebuild(cursor, reading_rows):
+    """
+    Recomputes all aggregates.
+    Input: iterable of (kind, reading dict with the apoint/rpoint row columns)
+    Output: amount of readings aggregated
+    """
+    for table, _, _ in REPORTS.values():
+        cursor.execute(f"DELETE FROM {table}")
+    totals = Totals()
+    days = {}
+    count = 0
+    for kind, row in reading_rows:
+        timestamp = row['TIMESTAMP']
+        reading = [(timestamp, row['KULUTUS'] or 0.0)]
+        if kind == 'apoint':
+            hour = timestamp[:13]
+            if hour not in days:
+                days[hour] = local_day(timestamp)
+            details = {'mga': row['MGA'], 'dso': row['DSO'], 'supplier': row['SUPPLIER'], 'ap_type': row['AP_TYPE']}
+            totals.add_apoint(details, reading, [days[hour]], row['RESOLUTION'])
+        else:
+            totals.add_rpoint({'r_in': row['R_IN'], 'r_out': row['R_OUT']}, reading)
+        count += 1
+        if count % 100000 == 0:
+            totals.flush(cursor)
+    totals.flush(cursor)
+    cursor.execute("INSERT OR REPLACE INTO agg_state (ID, STALE) VALUES (1, 0)")
+    return count
+
+
+def report(cursor, name, start=None, end=None):
+    """
+    Input: report name (REPORTS), optional [start, end) of the HOUR (UTC
+           DB timestamp) or DAY (local 'YYYY-MM-DD') column
+    Output: (column names, rows)
+    """
+    table, keys, values = REPORTS[name]
+    where, params = [], []
+    if start is not None:
+        where.append(f"{keys[1]} >= ?")
+        params.append(start)
+    if end is not None:
+        where.append(f"{keys[1]} < ?")
+        params.append(end)
+    rows = cursor.execute(f"SELECT {', '.join(keys + values)} FROM {table}"
+                          + (" WHERE " + " AND ".join(where) if where else "")
+                          + f" ORDER BY {keys[0]}, {keys[1]}", params).fetchall()
+    return keys + values, rows
+
+
+class ExchangeFlows:
+    """
+    Exchange point flows balancing the MGA hourly net consumption of a period.
+    Used by kulugen like a load profile source: assign() and block().
+    """
+
+    def __init__(self, cursor, links, start, end):
+        """
+        Input: cursor of fingrid.db, links [(exchange point ID, IN_AREA, OUT_AREA)],
+               [start, end) UTC DB timestamps of the period
+        """
+        net = {} # hour -> {MGA: consumption - production}, one grouped query
+        for mga, hour, consumed, produced in cursor.execute(
+                "SELECT MGA, HOUR, SUM(CONSUMPTION), SUM(PRODUCTION) FROM agg_mga_hour "
+                "WHERE HOUR >= ? AND HOUR < ? GROUP BY MGA, HOUR", (start, end)):
+            net.setdefault(hour, {})[mga] = consumed - produced
+
+        # Areas without accounting points (e.g. the transmission grid) take or give any amount
+        internal = {mga for areas in net.values() for mga in areas}
+        self.by_out, self.from_outside, self.to_outside = {}, {}, {}
+        for point_id, in_area, out_area in links:
+            if in_area in internal and out_area in internal:
+                self.by_out.setdefault(out_area, []).append((point_id, in_area))
+            elif in_area in internal:
+                self.from_outside.setdefault(in_area, []).append(point_id)
+            elif out_area in internal:
+                self.to_outside.setdefault(out_area, []).append(point_id)
+
+        self.flows = {point_id: {} for point_id, _, _ in links}
+        for hour, areas in net.items():
+            for point_id, flow in self._balance(areas).items():
+                if flow:
+                    self.flows[point_id][hour] = flow
+
+    def _balance(self, areas):
+        """
+        Input: {MGA: net consumption} of one hour
+        Output: {exchange point ID: flow from OUT_AREA to IN_AREA}
+        A surplus goes to the linked deficit areas in proportion to their
+        deficits, no area receiving more than its deficit. What is left of a
+        deficit comes evenly over the links from areas without accounting
+        points, what is left of a surplus leaves evenly over the links to them.
+        """
+        deficit = {area: value for area, value in areas.items() if value > 0}
+        offers, offered = [], {}
+        for out_area, value in areas.items():
+            if value >= 0:
+                continue
+            targets = [(point_id, in_area) for point_id, in_area in self.by_out.get(out_area, ()) if in_area in deficit]
+            total = sum(deficit[in_area] for _, in_area in targets)
+            for point_id, in_area in targets:
+                amount = -value * deficit[in_area] / total
+                offers.append((point_id, out_area, in_area, amount))
+                offered[in_area] = offered.get(in_area, 0.0) + amount
+
+        flows, imported, exported = {}, {}, {}
+        for point_id, out_area, in_area, amount in offers:
+            flow = amount * min(1.0, deficit[in_area] / offered[in_area])
+            flows[point_id] = flow
+            imported[in_area] = imported.get(in_area, 0.0) + flow
+            exported[out_area] = exported.get(out_area, 0.0) + flow
+        for area, value in areas.items():
+            rest, points = (value - imported.get(area, 0.0), self.from_outside.get(area)) if value > 0 else \
+                           (-value - exported.get(area, 0.0), self.to_outside.get(area))
+            for point_id in points or ():
+                flows[point_id] = flows.get(point_id, 0.0) + max(rest, 0.0) / len(points)
+        return flows
+
+    def assign(self, point_id, _type=None):
+        return point_id if point_id in self.flows else None
+
+    def block(self, point_id, axis, start, end, rng=None):
+        """Output: hourly energies of the exchange point for time axis points start..end-1"""
+        flows = self.flows[point_id]
+        return [flows.get(timestamp[:13] + ':00:00', 0.0) for timestamp in axis.db_timestamps[start:end]]
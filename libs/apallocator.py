@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Persistent accounting point ID allocator.
+
+AP IDs are <8 digit DSO prefix><9 digit number><check digit>. The allocator
+keeps the already reserved number ranges per DSO prefix as a sorted list of
+non-overlapping half-open intervals and hands out blocks that do not overlap
+any of them, so repeated kpgen runs against the same environment never
+produce the same metering point twice. Reservations are stored in
+ap_ranges.json; on first use the state is seeded from the IDs in kp.csv.
+The state is shared by all run workspaces, so reserve() holds a lock file
+and re-reads the state, and kpgen runs in parallel get disjoint blocks.
+
+is_free() is a bisect, O(log n). Finding a free block walks the gaps from
+the wanted position, O(n) over the intervals of the prefix: reserve()
+re-reads ap_ranges.json under the lock anyway, which is O(n) as well, and
+coalesced blocks keep n at about one interval per kpgen run and prefix.
+"""
+
+import bisect
+import contextlib
+import csv
+import json
+import os
+import random as ra
+import time
+
+from libs import workspace
+
+DEFAULT_STATE_PATH = 'ap_ranges.json'
+LOCK_TIMEOUT = 30 # Seconds; an older lock file is left over from a crashed run
+MIN_ID_NUM = 1
+MAX_ID_NUM = 90000000 # Exclusive upper bound of the numeric part, as in kpgen
+
+
+class APIdAllocator:
+    """
+    Reserves collision-free AP ID number blocks per DSO prefix.
+    """
+
+    def __init__(self, state_path=DEFAULT_STATE_PATH, csv_path=None):
+        self.state_path = state_path
+        self.csv_path = csv_path or workspace.path('kp.csv')
+        self.starts = {} # prefix -> sorted list of interval starts
+        self.ends = {}   # prefix -> matching list of exclusive interval ends
+        self._load()
+
+    def _load(self):
+        """Loads reserved ranges, seeding from kp.csv if no state exists yet."""
+        self.starts, self.ends = {}, {}
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+            except (IOError, ValueError) as e:
+                raise ValueError(f"AP ID allocator state '{self.state_path}' is unreadable: {e}")
+            for prefix, ranges in state.items():
+                self._set_ranges(prefix, [tuple(r) for r in ranges])
+        elif os.path.exists(self.csv_path):
+            self._seed_from_csv()
+
+    def _seed_from_csv(self):
+        """Marks every AP ID already in kp.csv as reserved."""
+        numbers = {}
+        with open(self.csv_path, 'r', newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                ap_id = row.get('Accounting point') or ''
+                if len(ap_id) == 18 and ap_id.isdigit():
+                    numbers.setdefault(ap_id[:8], []).append(int(ap_id[8:17]))
+        for prefix, nums in numbers.items():
+            self._set_ranges(prefix, [(n, n + 1) for n in nums])
+        if numbers:
+            self.save()
+
+    def _set_ranges(self, prefix, ranges):
+        """Stores ranges for prefix sorted and coalesced."""
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.starts[prefix] = [r[0] for r in merged]
+        self.ends[prefix] = [r[1] for r in merged]
+
+    def save(self):
+        """Writes the reserved ranges atomically."""
+        state = {prefix: [[s, e] for s, e in zip(self.starts[prefix], self.ends[prefix])]
+                 for prefix in sorted(self.starts)}
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Holds ap_ranges.json.lock, created exclusively, for one reservation."""
+        lock_path = self.state_path + '.lock'
+        waited = 0.0
+        while True:
+            try:
+                os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) > LOCK_TIMEOUT:
+                        os.remove(lock_path)
+                        continue
+                except OSError:
+                    continue # Released meanwhile
+                if waited > LOCK_TIMEOUT:
+                    raise ValueError(f"AP ID allocator state '{self.state_path}' is locked by another run.")
+                time.sleep(0.05)
+                waited += 0.05
+        try:
+            yield
+        finally:
+            os.remove(lock_path)
+
+    def is_free(self, prefix, start, count):
+        """True if numbers start..start+count-1 are not reserved for prefix. O(log n)."""
+        starts = self.starts.get(prefix, [])
+        ends = self.ends.get(prefix, [])
+        i = bisect.bisect_right(starts, start) - 1
+        if i >= 0 and ends[i] > start:
+            return False
+        return i + 1 >= len(starts) or starts[i + 1] >= start + count
+
+    def _first_free(self, prefix, start, count, limit=MAX_ID_NUM):
+        """
+        First free block of count numbers at or after start that ends by limit,
+        None if none fits. Bisects to start, then walks the gaps: O(n) when
+        the small gaps after start are many.
+        """
+        starts = self.starts.get(prefix, [])
+        ends = self.ends.get(prefix, [])
+        i = bisect.bisect_right(starts, start) - 1
+        if i >= 0 and ends[i] > start:
+            start = ends[i]
+        i += 1
+        # Skip forward over gaps that are too small
+        while i < len(starts) and starts[i] - start < count and starts[i] < limit:
+            start = max(start, ends[i])
+            i += 1
+        if start + count > limit:
+            return None
+        return start
+
+    def _insert(self, prefix, start, count):
+        starts = self.starts.setdefault(prefix, [])
+        ends = self.ends.setdefault(prefix, [])
+        end = start + count
+        i = bisect.bisect_left(starts, start)
+        # Merge with neighbours that touch the new block
+        if i > 0 and ends[i - 1] == start:
+            i -= 1
+            ends[i] = end
+        else:
+            starts.insert(i, start)
+            ends.insert(i, end)
+        if i + 1 < len(starts) and starts[i + 1] == end:
+            ends[i] = ends[i + 1]
+            del starts[i + 1], ends[i + 1]
+
+    def reserve(self, prefix, count, start=None):
+        """
+        Reserves count consecutive numbers for prefix and persists the state.
+
+        Input: 8 digit DSO prefix, amount of numbers, optional first number
+               (fconfig id_range). Without start a random position is used.
+        Output: first reserved number
+        """
+        if count < 1:
+            raise ValueError("Amount of AP IDs to reserve must be positive.")
+        if count > MAX_ID_NUM - MIN_ID_NUM:
+            raise ValueError(f"Cannot reserve {count} AP IDs, the ID space has only {MAX_ID_NUM - MIN_ID_NUM}.")
+
+        wanted = start if start is not None else ra.randint(MIN_ID_NUM, MAX_ID_NUM - count)
+        with self._locked():
+            self._load() # Reservations of runs in other workspaces since our last look
+            first = self._first_free(prefix, wanted, count)
+            if first is None: # Wrap around, the gaps after wanted were walked already
+                first = self._first_free(prefix, MIN_ID_NUM, count, min(wanted + count, MAX_ID_NUM))
+            if first is None:
+                raise ValueError(f"No free block of {count} AP IDs left for prefix {prefix}.")
+            self._insert(prefix, first, count)
+            self.save()
+        if start is not None and first != start:
+            print(f"Note: AP IDs from {start} already reserved for {prefix}, using range starting at {first}.")
+        return first
@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Indexed accounting point registry built from kp.csv.
+
+kp.csv is imported into a small SQLite database with indexes on AP id, DSO,
+MGA and supplier so that single AP lookups and filtered iteration do not
+need to scan the whole CSV file. The registry checks the modification time
+and size of kp.csv before every query: rows appended by kpgen are imported
+incrementally, any other change rebuilds the registry from scratch.
+"""
+
+import csv
+import io
+import os
+import sqlite3
+
+from libs import workspace
+
+DEFAULT_DB_PATH = 'kp_registry.db'
+
+# kp.csv header (see kpgen.write_csv_summary) -> registry column / details key
+CSV_COLUMNS = [
+    ('Accounting point', 'apoint_id'),
+    ('Metering Area', 'meteringpoint'),
+    ('Supplier', 'supplier'),
+    ('DSO', 'dso'),
+    ('MGA', 'mga'),
+    ('ZIP', 'zip'),
+    ('Street', 'street'),
+    ('City', 'city'),
+    ('AP type', 'ap_type'),
+    ('Remote readable', 'remote_read'),
+    ('Metering method', 'method'),
+]
+COLUMNS = [column for _, column in CSV_COLUMNS]
+FILTERS = ('dso', 'mga', 'supplier', 'ap_type', 'method')
+_TAIL_BYTES = 64
+
+
+class APRegistry:
+    """
+    Registry of accounting points from kp.csv.
+
+    get() returns the same details dictionary as kulugen used to build
+    from a kp.csv row, iter_points() and ids() accept optional filters
+    (dso, mga, supplier, ap_type, method).
+    """
+
+    def __init__(self, csv_path=None, db_path=None):
+        self.csv_path = csv_path or workspace.path('kp.csv')
+        self.db_path = db_path or workspace.path(DEFAULT_DB_PATH)
+        self._conn = None
+        self._checked_stat = None
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, timeout=10)
+            self._conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS registry (
+                {', '.join(c + ' TEXT' for c in COLUMNS)},
+                PRIMARY KEY (apoint_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS registry_dso ON registry (dso);
+            CREATE INDEX IF NOT EXISTS registry_mga ON registry (mga);
+            CREATE INDEX IF NOT EXISTS registry_supplier ON registry (supplier);
+            CREATE TABLE IF NOT EXISTS registry_source (
+                ID INTEGER PRIMARY KEY CHECK (ID = 0),
+                PATH TEXT, MTIME_NS INTEGER, SIZE INTEGER, HEADER TEXT, TAIL BLOB
+            );""")
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def refresh(self):
+        """
+        Brings the registry up to date with kp.csv.
+        Output: False if kp.csv does not exist, True otherwise.
+        """
+        try:
+            stat = os.stat(self.csv_path)
+        except FileNotFoundError:
+            return False
+        current = (stat.st_mtime_ns, stat.st_size)
+        if current == self._checked_stat:
+            return True
+
+        conn = self._connect()
+        source = conn.execute("SELECT PATH, MTIME_NS, SIZE, HEADER, TAIL FROM registry_source").fetchone()
+        if source is None or source[0] != os.path.abspath(self.csv_path):
+            self._import(conn, stat, offset=0)
+        elif (source[1], source[2]) != current:
+            if stat.st_size > source[2] and self._is_append(source):
+                self._import(conn, stat, offset=source[2], header=source[3])
+            else:
+                self._import(conn, stat, offset=0)
+        self._checked_stat = current
+        return True
+
+    def _is_append(self, source):
+        """True if kp.csv still starts with the already imported content."""
+        _, _, size, header, tail = source
+        with open(self.csv_path, 'rb') as f:
+            if f.readline().decode('utf-8').strip() != header:
+                return False
+            f.seek(max(0, size - _TAIL_BYTES))
+            return f.read(min(size, _TAIL_BYTES)) == tail
+
+    def _import(self, conn, stat, offset, header=None):
+        """Imports kp.csv rows starting at byte offset, full rebuild when offset is 0."""
+        with open(self.csv_path, 'rb') as f:
+            if offset:
+                f.seek(offset)
+                data = f.read(stat.st_size - offset)
+            else:
+                header = f.readline().decode('utf-8').strip()
+                data = f.read(stat.st_size - f.tell())
+            f.seek(max(0, stat.st_size - _TAIL_BYTES))
+            tail = f.read(min(stat.st_size, _TAIL_BYTES))
+
+        fieldnames = next(csv.reader([header])) if header else []
+        reader = csv.DictReader(io.StringIO(data.decode('utf-8'), newline=''), fieldnames=fieldnames)
+        rows = ([row.get(csv_name) for csv_name, _ in CSV_COLUMNS]
+                for row in reader if row.get('Accounting point'))
+
+        with conn:
+            if not offset:
+                conn.execute("DELETE FROM registry")
+            conn.executemany(f"INSERT OR REPLACE INTO registry ({', '.join(COLUMNS)}) "
+                             f"VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+            conn.execute("INSERT OR REPLACE INTO registry_source VALUES (0, ?, ?, ?, ?, ?)",
+                         (os.path.abspath(self.csv_path), stat.st_mtime_ns, stat.st_size, header, tail))
+
+    def get(self, ap_id):
+        """
+        Input: accounting point ID
+        Output: details dictionary or None if not found
+        """
+        if not self.refresh():
+            raise FileNotFoundError(f"{self.csv_path} not found. Please run kpgen first.")
+        cursor = self._connect().execute(f"SELECT {', '.join(COLUMNS)} FROM registry WHERE apoint_id = ?", (ap_id,))
+        row = cursor.fetchone()
+        return dict(zip(COLUMNS, row)) if row else None
+
+    def _where(self, filters):
+        unknown = [key for key in filters if key not in FILTERS]
+        if unknown:
+            raise ValueError(f"Unknown registry filter(s): {', '.join(unknown)}")
+        used = [(key, value) for key, value in filters.items() if value is not None]
+        clause = ' AND '.join(f"{key} = ?" for key, _ in used)
+        return (' WHERE ' + clause if clause else ''), [value for _, value in used]
+
+    def iter_points(self, **filters):
+        """Yields details dictionaries ordered by AP id, optionally filtered."""
+        if not self.refresh():
+            return
+        where, params = self._where(filters)
+        for row in self._connect().execute(f"SELECT {', '.join(COLUMNS)} FROM registry{where} ORDER BY apoint_id", params):
+            yield dict(zip(COLUMNS, row))
+
+    def ids(self, **filters):
+        """Output: list of accounting point IDs, optionally filtered."""
+        if not self.refresh():
+            return []
+        where, params = self._where(filters)
+        return [row[0] for row in self._connect().execute(f"SELECT apoint_id FROM registry{where} ORDER BY apoint_id", params)]
+
+    def __len__(self):
+        if not self.refresh():
+            return 0
+        return self._connect().execute("SELECT COUNT(*) FROM registry").fetchone()[0]
+
+    def __contains__(self, ap_id):
+        if not self.refresh():
+            return False
+        return self._connect().execute("SELECT 1 FROM registry WHERE apoint_id = ?", (ap_id,)).fetchone() is not None
@@ -0,0 +1,268 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped columnar store of kulugen readings.
+
+Next to the row-per-reading apoint/rpoint tables of fingrid.db kulugen can
+write every run into a float32 (point x interval) matrix file. A matrix
+belongs to one time axis (UTC start, step, interval count) and one point
+kind; each point gets a row of the matrix, readings that were not generated
+are NaN. The catalogue (catalog.db in the store directory) holds the
+segments and the row of every point ID, so slicing a point or a time range
+is an offset calculation on the mapped file instead of a table scan.
+
+    store = ColumnStore('columnar/')
+    seg = store.segments('apoint')[0]
+    seg.slice('642702010000000001', '2025-03-01 00:00:00', '2025-03-02 00:00:00')
+    seg.interval_totals() # sum of all points per interval
+"""
+
+import datetime
+import math
+import mmap
+import os
+import sqlite3
+import sys
+from array import array
+
+DEFAULT_DIR = 'columnar/'
+KINDS = ('apoint', 'rpoint')
+_EPOCH = datetime.datetime(1970, 1, 1)
+_NAN = float('nan')
+
+
+def to_epoch(value):
+    """Input: epoch seconds or UTC 'YYYY-MM-DD HH:MM:SS' / ISO string. Output: epoch seconds"""
+    if value is None or isinstance(value, int):
+        return value
+    value = value.strip().rstrip('Z').replace('T', ' ')
+    return int((datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S") - _EPOCH).total_seconds())
+
+
+class Segment:
+    """
+    One matrix file: the readings of kind's points over one time axis.
+    """
+
+    def __init__(self, store, segment_id, kind, start, step, count, filename):
+        self.store = store
+        self.id = segment_id
+        self.kind = kind
+        self.start = start
+        self.step = step
+        self.count = count
+        self.path = os.path.join(store.directory, filename)
+        self._rows = None
+        self._size = None
+        self._mmap = None
+        self._view = None
+
+    def __repr__(self):
+        return f"Segment({self.kind}, {self.timestamp(0)}, {self.size} points x {self.count} x {self.step // 60} min)"
+
+    @property
+    def rows(self):
+        """Output: dict point ID -> matrix row of all points, loaded for whole-segment reads"""
+        if self._rows is None:
+            self._rows = dict(self.store.conn.execute(
+                "SELECT POINT_ID, ROW FROM point WHERE SEGMENT_ID = ?", (self.id,)))
+        return self._rows
+
+    @property
+    def size(self):
+        """Output: amount of points (matrix rows)"""
+        if self._size is None:
+            self._size = self.store.conn.execute("SELECT COUNT(*) FROM point WHERE SEGMENT_ID = ?",
+                                                 (self.id,)).fetchone()[0]
+        return self._size
+
+    def row_of(self, point_id):
+        """Output: matrix row of a point or None, looked up without loading all rows"""
+        if self._rows is not None:
+            return self._rows.get(point_id)
+        row = self.store.conn.execute("SELECT ROW FROM point WHERE SEGMENT_ID = ? AND POINT_ID = ?",
+                                      (self.id, point_id)).fetchone()
+        return None if row is None else row[0]
+
+    def _add_row(self, point_id):
+        """Output: the next free matrix row, now the point's"""
+        row = self.size
+        self.store.conn.execute("INSERT INTO point VALUES (?, ?, ?)", (self.id, point_id, row))
+        self._size += 1
+        if self._rows is not None:
+            self._rows[point_id] = row
+        return row
+
+    @property
+    def end(self):
+        return self.start + self.count * self.step
+
+    def timestamp(self, index):
+        """Output: UTC 'YYYY-MM-DD HH:MM:SS' of interval index, as in fingrid.db"""
+        return (_EPOCH + datetime.timedelta(seconds=self.start + index * self.step)).strftime("%Y-%m-%d %H:%M:%S")
+
+    def index_range(self, start=None, end=None):
+        """Input: time range [start, end) as epochs or UTC strings. Output: (first, last + 1) interval index"""
+        start, end = to_epoch(start), to_epoch(end)
+        first = 0 if start is None else min(self.count, max(0, -(-(start - self.start) // self.step)))
+        last = self.count if end is None else min(self.count, max(0, -(-(end - self.start) // self.step)))
+        return first, max(first, last)
+
+    def matrix(self):
+        """Output: float32 memoryview of the whole mapped matrix (rows * count)"""
+        size = self.size * self.count * 4
+        if self._view is None or len(self._view) * 4 != size:
+            self.close()
+            if not size:
+                return memoryview(array('f'))
+            with open(self.path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mmap).cast('f')
+        return self._view
+
+    def slice(self, point_id, start=None, end=None):
+        """Output: list of the point's readings in [start, end), NaN where none was generated"""
+        row = self.row_of(point_id)
+        if row is None:
+            return []
+        first, last = self.index_range(start, end)
+        base = row * self.count
+        return self.matrix()[base + first:base + last].tolist()
+
+    def block(self, point_ids=None, start=None, end=None):
+        """Output: dict point ID -> list of readings in [start, end) for point_ids (default all)"""
+        first, last = self.index_range(start, end)
+        matrix, count, rows = self.matrix(), self.count, self.rows
+        ids = rows if point_ids is None else [p for p in point_ids if p in rows]
+        return {p: matrix[rows[p] * count + first:rows[p] * count + last].tolist() for p in ids}
+
+    def interval_totals(self, start=None, end=None, point_ids=None):
+        """Output: list of per-interval sums over the points, NaN readings count as 0"""
+        first, last = self.index_range(start, end)
+        totals = [0.0] * (last - first)
+        for values in self.block(point_ids, start, end).values():
+            totals = [t if v != v else t + v for t, v in zip(totals, values)]
+        return totals
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._mmap.close()
+        self._view = self._mmap = None
+
+
+class ColumnStore:
+    """
+    Catalogue and matrix files of the columnar store.
+    """
+
+    def __init__(self, directory=DEFAULT_DIR):
+        if array('f').itemsize != 4 or sys.byteorder != 'little':
+            raise ValueError("The columnar store needs 4 byte little endian floats.")
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(directory, 'catalog.db'))
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS segment (
+                ID INTEGER PRIMARY KEY,
+                KIND TEXT NOT NULL,
+                START INTEGER NOT NULL,
+                STEP INTEGER NOT NULL,
+                COUNT INTEGER NOT NULL,
+                FILENAME TEXT NOT NULL,
+                UNIQUE (KIND, START, STEP, COUNT)
+            );
+            CREATE TABLE IF NOT EXISTS point (
+                SEGMENT_ID INTEGER NOT NULL,
+                POINT_ID TEXT NOT NULL,
+                ROW INTEGER NOT NULL,
+                PRIMARY KEY (SEGMENT_ID, POINT_ID)
+            ) WITHOUT ROWID;
+        """)
+        self._segments = {}
+        self._by_key = {} # (kind, start, step, count) -> Segment, for repeated writes of a run
+        self._files = {}
+
+    def segments(self, kind=None):
+        """Output: list of Segments, optionally of one kind, in time order"""
+        query = "SELECT ID, KIND, START, STEP, COUNT, FILENAME FROM segment"
+        rows = self.conn.execute(query + (" WHERE KIND = ?" if kind else "") + " ORDER BY START",
+                                 (kind,) if kind else ())
+        return [self._segment(row) for row in rows]
+
+    def _segment(self, row):
+        if row[0] not in self._segments:
+            self._segments[row[0]] = Segment(self, *row)
+        return self._segments[row[0]]
+
+    def segment_for(self, kind, axis):
+        """Output: Segment of kind over the time axis, created when missing"""
+        start, step, count = axis.epochs[0], axis.step, len(axis)
+        key = (kind, start, step, count)
+        if key in self._by_key:
+            return self._by_key[key]
+        row = self.conn.execute("SELECT ID, KIND, START, STEP, COUNT, FILENAME FROM segment "
+                                "WHERE KIND = ? AND START = ? AND STEP = ? AND COUNT = ?", key).fetchone()
+        if row is None:
+            filename = f"{kind}_{start}_{step}_{count}.f32"
+            cur = self.conn.execute("INSERT INTO segment (KIND, START, STEP, COUNT, FILENAME) VALUES (?, ?, ?, ?, ?)",
+                                    key + (filename,))
+            row = (cur.lastrowid,) + key + (filename,)
+        segment = self._by_key[key] = self._segment(row)
+        return segment
+
+    def write(self, kind, axis, point_id, readings):
+        """
+        Input: point kind, run's time axis, point ID, list of (axis index, value)
+        Stores the readings in the point's row, allocating a NaN row for a new point.
+        Called per block of readings; the point's row is looked up in the
+        catalogue, so writing does not keep a dict of all points in memory.
+        """
+        if kind not in KINDS:
+            raise ValueError(f"Unknown point kind '{kind}'.")
+        if not readings:
+            return
+        segment = self.segment_for(kind, axis)
+        f = self._files.get(segment.id)
+        if f is None:
+            f = self._files[segment.id] = open(segment.path, 'r+b' if os.path.exists(segment.path) else 'w+b')
+        row = segment.row_of(point_id)
+        if row is None:
+            row = segment._add_row(point_id)
+            f.seek(row * segment.count * 4)
+            f.write(array('f', [_NAN]).tobytes() * segment.count)
+
+        base = row * segment.count * 4
+        first = readings[0][0]
+        if readings[-1][0] - first == len(readings) - 1: # Consecutive indexes, one write
+            f.seek(base + first * 4)
+            f.write(array('f', [value for _, value in readings]).tobytes())
+        else:
+            for index, value in readings:
+                f.seek(base + index * 4)
+                f.write(array('f', [value]).tobytes())
+
+    def read(self, kind, point_id, start=None, end=None):
+        """Output: list of (UTC timestamp, value) of the point over all segments in [start, end)"""
+        result = []
+        for segment in self.segments(kind):
+            first, _ = segment.index_range(start, end)
+            result.extend((segment.timestamp(first + i), value)
+                          for i, value in enumerate(segment.slice(point_id, start, end)) if not math.isnan(value))
+        return sorted(result)
+
+    def commit(self):
+        """Flushes the matrix files and commits the catalogue."""
+        for f in self._files.values():
+            f.flush()
+        self.conn.commit()
+
+    def close(self):
+        self.commit()
+        for f in self._files.values():
+            f.close()
+        for segment in self._segments.values():
+            segment.close()
+        self._files = {}
+        self._by_key = {}
+        self.conn.close()
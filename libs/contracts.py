@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Record of generated supply contracts.
+
+sopimusgen stores every contract it writes (AP, HETU, name, file) in
+contracts.db, so later runs only produce contracts for accounting points
+that kpgen has added since. If the record does not exist yet it is seeded
+once from the sopimus_<ap>.xml and DONE_sopimus_<ap>.xml files already in
+the xml directory.
+"""
+
+import os
+import sqlite3
+import time
+
+from libs import workspace, xmllayout
+
+DEFAULT_DB_PATH = 'contracts.db'
+CONTRACT_PREFIXES = ('sopimus_', 'DONE_sopimus_')
+
+
+class ContractRecord:
+    """
+    SQLite backed set of accounting points that already have a contract.
+    """
+
+    def __init__(self, db_path=None, xml_dir=None):
+        self.db_path = db_path or workspace.path(DEFAULT_DB_PATH)
+        self.xml_dir = xml_dir or workspace.path('xml/')
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS contract (
+                APOINT_ID TEXT PRIMARY KEY,
+                HETU TEXT,
+                NAME TEXT,
+                FILENAME TEXT,
+                CREATED_AT REAL
+            ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+        if not self.conn.execute("SELECT 1 FROM contract LIMIT 1").fetchone():
+            self.seed_from_dir()
+
+    def seed_from_dir(self):
+        """
+        Indexes existing contract files of the xml directory in one pass.
+        Output: amount of contracts found
+        """
+        if not os.path.isdir(self.xml_dir):
+            return 0
+        rows = []
+        for prefix in CONTRACT_PREFIXES:
+            for name, mtime in xmllayout.entries(self.xml_dir, prefix): # Any xml_layout
+                if name.endswith('.xml'):
+                    rows.append((name[len(prefix):-4], None, None, name, mtime))
+        self.conn.executemany("INSERT OR IGNORE INTO contract VALUES (?, ?, ?, ?, ?)", rows)
+        self.conn.commit()
+        return len(rows)
+
+    def ids(self):
+        """Output: set of AP IDs that already have a contract"""
+        return {row[0] for row in self.conn.execute("SELECT APOINT_ID FROM contract")}
+
+    def hetus(self):
+        """Output: list of HETUs handed out by earlier runs"""
+        return [row[0] for row in self.conn.execute("SELECT HETU FROM contract WHERE HETU IS NOT NULL")]
+
+    def record(self, ap_id, hetu, name, filename):
+        """Stores a generated contract. Committed by commit() to batch the writes."""
+        self.conn.execute("INSERT OR REPLACE INTO contract VALUES (?, ?, ?, ?, ?)",
+                          (ap_id, hetu, name, filename, time.time()))
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM contract").fetchone()[0]
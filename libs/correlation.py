@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Correlation store linking messages sent by req_utils.send_generic to the
+asynchronous BA01/BA02 status messages that putsi.py later peeks.
+
+Every successfully sent message is recorded with its header Identification,
+document type and send time. When putsi peeks a status message, all
+identifiers found in it are matched against the store and the response
+status and arrival time are stored for the original message. From this
+the end-to-end processing latency per document type and the list of
+messages that never got a response can be reported.
+"""
+
+import os
+import re
+import sqlite3
+import sys
+import time
+
+from libs import workspace
+
+DEFAULT_DB_PATH = 'correlation.db'
+
+# Header Identification is the first <prefix:Identification> without attributes
+# in all MaSi templates. DocumentType sits next to it in the same header.
+_header_id_re = re.compile(r'<(?:\w+:)?Identification>\s*([^<\s]+)\s*</(?:\w+:)?Identification>')
+_doc_type_re = re.compile(r'<(?:\w+:)?DocumentType>\s*([^<\s]+)\s*</(?:\w+:)?DocumentType>')
+# Any identifier-like element in a status message may carry the reference
+# to the original document (OriginalBusinessDocumentReference, DocumentReferenceNumber, ...)
+_reference_re = re.compile(r'<(?:\w+:)?(?:\w*Identification|\w*Reference\w*)(?:\s[^>]*)?>\s*([^<\s]+)\s*</')
+
+
+def parse_header(xml_content):
+    """
+    Input: XML message content as string
+    Output: (header identification, document type), None for missing parts
+    """
+    id_match = _header_id_re.search(xml_content)
+    type_match = _doc_type_re.search(xml_content)
+    return (id_match.group(1) if id_match else None,
+            type_match.group(1) if type_match else None)
+
+
+def parse_references(xml_content):
+    """
+    Input: XML response content as string
+    Output: list of unique identifier candidates found in the message
+    """
+    seen = []
+    for ref in _reference_re.findall(xml_content):
+        if ref not in seen:
+            seen.append(ref)
+    return seen
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class CorrelationStore:
+    """
+    SQLite backed store of sent messages and their asynchronous responses.
+    One short-lived connection is used per operation so the store can be
+    shared by the threaded senders.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or workspace.path(DEFAULT_DB_PATH)
+        self._ensure_tables_exist()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _ensure_tables_exist(self):
+        with self._connect() as conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS sent_message (
+                IDENTIFICATION  TEXT PRIMARY KEY,
+                FILENAME        TEXT,
+                DOC_TYPE        TEXT,
+                SENT_AT         REAL NOT NULL,
+                RESPONSE_STATUS TEXT,
+                RESPONSE_AT     REAL,
+                RESPONSE_DOCREF TEXT,
+                PROCESS         TEXT
+            );""")
+            conn.execute("CREATE INDEX IF NOT EXISTS sent_message_open ON sent_message (RESPONSE_AT)")
+
+    def record_sent(self, xml_content, filename, sent_at=None):
+        """
+        Records a sent message. Returns the header Identification or None
+        if it could not be parsed from the message.
+        """
+        identification, doc_type = parse_header(xml_content)
+        if identification is None:
+            return None
+        sent_at = time.time() if sent_at is None else sent_at
+        with self._connect() as conn:
+            conn.execute("""INSERT OR REPLACE INTO sent_message
+                            (IDENTIFICATION, FILENAME, DOC_TYPE, SENT_AT)
+                            VALUES (?, ?, ?, ?)""",
+                         (identification, filename, doc_type, sent_at))
+        return identification
+
+    def record_response(self, xml_content, docref, status, process=None, received_at=None):
+        """
+        Matches a peeked status message against the sent messages.
+        Returns the matched sent Identification or None.
+        """
+        candidates = [ref for ref in parse_references(xml_content) if ref != docref]
+        if not candidates:
+            return None
+        received_at = time.time() if received_at is None else received_at
+        placeholders = ','.join('?' * len(candidates))
+        with self._connect() as conn:
+            row = conn.execute(f"""SELECT IDENTIFICATION FROM sent_message
+                                   WHERE IDENTIFICATION IN ({placeholders})
+                                   AND RESPONSE_AT IS NULL LIMIT 1""", candidates).fetchone()
+            if row is None:
+                return None
+            conn.execute("""UPDATE sent_message
+                            SET RESPONSE_STATUS = ?, RESPONSE_AT = ?, RESPONSE_DOCREF = ?, PROCESS = ?
+                            WHERE IDENTIFICATION = ?""",
+                         (status, received_at, docref, process, row[0]))
+        return row[0]
+
+    def latency_by_doc_type(self):
+        """
+        Output: {doc_type: {'count', 'BA01', 'BA02', 'min', 'p50', 'p90', 'p99', 'max'}}
+        Latencies are seconds from send to peeked status message.
+        """
+        latencies = {}
+        statuses = {}
+        with self._connect() as conn:
+            for doc_type, status, latency in conn.execute(
+                    """SELECT DOC_TYPE, RESPONSE_STATUS, RESPONSE_AT - SENT_AT FROM sent_message
+                       WHERE RESPONSE_AT IS NOT NULL ORDER BY DOC_TYPE, RESPONSE_AT - SENT_AT"""):
+                doc_type = doc_type or 'Unknown'
+                latencies.setdefault(doc_type, []).append(latency)
+                counts = statuses.setdefault(doc_type, {'BA01': 0, 'BA02': 0})
+                if status in counts:
+                    counts[status] += 1
+
+        report = {}
+        for doc_type, values in latencies.items():
+            report[doc_type] = {
+                'count': len(values),
+                'BA01': statuses[doc_type]['BA01'],
+                'BA02': statuses[doc_type]['BA02'],
+                'min': values[0],
+                'p50': percentile(values, 50),
+                'p90': percentile(values, 90),
+                'p99': percentile(values, 99),
+                'max': values[-1],
+            }
+        return report
+
+    def unanswered(self, older_than=0):
+        """
+        Output: list of (identification, filename, doc_type, sent_at) for sent
+        messages without a response, optionally only those older than given seconds.
+        """
+        cutoff = time.time() - older_than
+        with self._connect() as conn:
+            return conn.execute("""SELECT IDENTIFICATION, FILENAME, DOC_TYPE, SENT_AT FROM sent_message
+                                   WHERE RESPONSE_AT IS NULL AND SENT_AT <= ?
+                                   ORDER BY SENT_AT""", (cutoff,)).fetchall()
+
+    def print_report(self):
+        """Prints latency distribution per document type and unanswered messages."""
+        report = self.latency_by_doc_type()
+        print("--- End-to-end latency (s) per document type ---")
+        if not report:
+            print("No correlated responses yet.")
+        for doc_type, r in sorted(report.items()):
+            print(f"{doc_type:6} n={r['count']:<6} BA01={r['BA01']:<6} BA02={r['BA02']:<6} "
+                  f"min={r['min']:.1f} p50={r['p50']:.1f} p90={r['p90']:.1f} p99={r['p99']:.1f} max={r['max']:.1f}")
+
+        missing = self.unanswered()
+        print(f"--- Messages without response: {len(missing)} ---")
+        for identification, filename, doc_type, sent_at in missing:
+            sent_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(sent_at))
+            print(f"{identification}  {doc_type or 'Unknown':6} {sent_str}  {filename}")
+
+
+if __name__ == "__main__":
+    workspace.from_argv(sys.argv[1:])
+    if not os.path.exists(workspace.path(DEFAULT_DB_PATH)):
+        print(f"Error: {workspace.path(DEFAULT_DB_PATH)} not found. Nothing has been sent yet.")
+    else:
+        CorrelationStore().print_report()
@@ -28,8 +28,9 @@ MGA = ["6427020100000000","6427020100000100","6427020100000200"]
 #dealers = None
 dealers = ['6427010100003','6427010200000', "6427010300007"]
 
-# Limit for kpaikka, shouldn't be changed without good reason.
-limit = 10000
+# Limit for kpaikka. kpgen and kulugen stream the APs in chunks, so
+# memory use does not grow with the amount of APs.
+limit = 3000000
 
 ##################################################################
 #                                                                #
@@ -41,6 +42,19 @@ limit = 10000
 ##################################################################
 id_range = None
 
+##################################################################
+# MGA postal regions                                             #
+#                                                                #
+# Addresses for accounting points of an MGA are drawn only from  #
+# the listed postal code prefixes or city names. MGAs not listed #
+# get addresses from the whole country.                          #
+# Example: mga_postal_regions = {                                #
+#              "6427020100000000": ["00", "01", "02"],           #
+#              "6427020100000100": ["tampere", "nokia"]}         #
+# Default value: None                                            #
+##################################################################
+mga_postal_regions = None
+
 #--------------------- Soap request tool settings ----------------------------
 
 # Datahub API destination URL
@@ -68,6 +82,110 @@ DDQ = {'6427010100003': 'B2BFGddq27AAdmin',
 prod_ap = None
 prod_ep = None
 
+##################################################################
+# Load profiles                                                  #
+#                                                                #
+# Share of consumption accounting points (AG01) per load profile #
+# (household, electric_heating, business). Production points     #
+# (AG02) always use the production profile. Consumption follows  #
+# the profile's daily, weekly and seasonal shape.                #
+# None = uniform random consumption (0-10 kWh per hour)          #
+# Example: load_profile_mix = {"household": 60,                  #
+#                              "electric_heating": 25,           #
+#                              "business": 15}                   #
+# Default value: None                                            #
+##################################################################
+load_profile_mix = None
+
+##################################################################
+# Measured profiles                                              #
+#                                                                #
+# Replays measured or anonymised meter series instead of random  #
+# values. A CSV export (see libs/replay.py) is converted once to #
+# a memory-mapped .replay file next to it. APs get a series of   #
+# their AP type, scaled and shifted by whole days. AP types      #
+# without series fall back to load_profile_mix.                  #
+# Example: replay_file = "profiles/mittaukset_2023.csv"          #
+# Default value: None                                            #
+##################################################################
+replay_file = None
+
+##################################################################
+# Columnar store                                                 #
+#                                                                #
+# Directory where kulugen also writes its readings as memory-    #
+# mapped float32 (point x interval) matrices with a catalogue    #
+# (catalog.db), for analytics without scanning fingrid.db.       #
+# See libs/colstore.py for the slicing API.                      #
+# Example: columnar_dir = "columnar/"                            #
+# Default value: None                                            #
+##################################################################
+columnar_dir = None
+
+##################################################################
+# Reading storage in fingrid.db                                  #
+#                                                                #
+# "rows":   one apoint/rpoint row per reading (original format)  #
+# "series": one compressed chunk per point and month in          #
+#           apoint_series/rpoint_series, a fraction of the size. #
+#           python3 -m libs.seriesstore expand fingrid.db writes #
+#           the rows back for tools that read the row tables.    #
+# Default value: "rows"                                          #
+##################################################################
+db_storage = "rows"
+
+##################################################################
+# Partitioned reading databases                                  #
+#                                                                #
+# "month": readings in one file per UTC month (fingrid-YYYYMM.db)#
+# "dso":   one file per DSO (fingrid-dso-<DSO>.db)               #
+# Old months are dropped by deleting their files, see            #
+# python3 -m libs.partitions. fingrid.db keeps the checkpoint.   #
+# Default value: None (everything in fingrid.db)                 #
+##################################################################
+db_partitioning = None
+
+##################################################################
+# Exchange point flows                                           #
+#                                                                #
+# "random":  rp.csv points are drawn from their min..max         #
+# "derived": flows balance the hourly net consumption (AG01 -    #
+#            AG02) of the MGAs generated in the same run:        #
+#            surpluses feed linked deficit MGAs, the rest comes  #
+#            from / goes to areas without APs (e.g. the grid).   #
+# Default value: "random"                                        #
+##################################################################
+exchange_flows = "random"
+
+##################################################################
+# Read period of E14 reading-metered APs (kp.csv)                #
+#                                                                #
+# E13 APs get the run's hourly (or PT15M) series whether or not  #
+# they are remote readable. E14 APs get one cumulative meter     #
+# register reading per period, not an energy series:             #
+# "P1M": one read per local month                                #
+# "P1D": one read per local day                                  #
+# The DB stores the energy of each read period, the XML the      #
+# register after it. E16 APs get no metered data.                #
+# Default value: "P1M"                                           #
+##################################################################
+e14_read_period = "P1M"
+
+##################################################################
+# Layout of xml/ and log/                                        #
+#                                                                #
+# "flat":     every file directly in xml/ and log/               #
+# "sharded":  files in xml/<type>/<ab>/<cd>/ by the MD5 of their #
+#             name, e.g. xml/kulutus/3f/a2/kulutus_....xml, so   #
+#             directories stay small with millions of files.     #
+# "segments": no file per document; documents and responses are  #
+#             appended to large segment files (xml/*.seg,        #
+#             log/resp-*.seg), see libs/segments.py.             #
+# The senders read every layout, see libs/xmllayout.py.          #
+# Default value: "flat"                                          #
+##################################################################
+xml_layout = "flat"
+
 # Use with caution. Not recommended for normal testing
 # disabled by default
 thread = False
@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Unique Finnish personal identity code (HETU) generator.
+
+All valid birth dates of the year range are precomputed once together with
+their contribution to the check character. Issued (date, individual number)
+pairs are tracked in a bitmap over the whole identity space, so every
+generated HETU is unique within the generator (and against any HETUs marked
+as issued, e.g. from earlier contract runs).
+"""
+
+import datetime
+import random as ra
+
+CHECK_KEYS = "0123456789ABCDEFHJKLMNPRSTUVWXY"
+CENTURIES = {18: '+', 19: '-', 20: 'A'}
+ORDER_MIN = 2   # Individual number range used by sopimusgen
+ORDER_MAX = 899
+_RANDOM_TRIES = 32
+
+
+class HetuGenerator:
+    """
+    Hands out unique HETUs for birth years start_year..end_year.
+    """
+
+    def __init__(self, start_year=1900, end_year=1999, rng=ra):
+        if start_year > end_year:
+            raise ValueError("HETU start year must not be after end year.")
+        self.rng = rng
+        self.orders = ORDER_MAX - ORDER_MIN + 1
+
+        # Valid date table: 'DDMMYY' + century sign, and (DDMMYY * 1000) % 31 for the check character
+        self.date_heads = []
+        self.date_mods = []
+        day = datetime.date(start_year, 1, 1)
+        last = datetime.date(end_year, 12, 31)
+        one_day = datetime.timedelta(days=1)
+        while day <= last:
+            ddmmyy = f"{day.day:02d}{day.month:02d}{day.year % 100:02d}"
+            self.date_heads.append(ddmmyy + CENTURIES.get(day.year // 100, 'A'))
+            self.date_mods.append(int(ddmmyy) * 1000 % 31)
+            day += one_day
+        self._date_index = {head: i for i, head in enumerate(self.date_heads)}
+
+        self.size = len(self.date_heads) * self.orders
+        self.bitmap = bytearray((self.size + 7) // 8)
+        self.issued = 0
+
+    def _is_set(self, index):
+        return self.bitmap[index >> 3] & (1 << (index & 7))
+
+    def _set(self, index):
+        self.bitmap[index >> 3] |= 1 << (index & 7)
+        self.issued += 1
+
+    def _format(self, index):
+        date_i, order_i = divmod(index, self.orders)
+        order = order_i + ORDER_MIN
+        return f"{self.date_heads[date_i]}{order:03d}{CHECK_KEYS[(self.date_mods[date_i] + order) % 31]}"
+
+    def _next_free(self, index):
+        """First free identity at or after index, wrapping around."""
+        for start, stop in ((index, self.size), (0, index)):
+            i = start
+            while i < stop:
+                if (i & 7) == 0 and self.bitmap[i >> 3] == 0xFF:
+                    i += 8 # Skip fully issued bytes in one go
+                    continue
+                if not self._is_set(i):
+                    return i
+                i += 1
+        return None
+
+    def _draw_index(self):
+        if self.issued >= self.size:
+            raise ValueError("HETU identity space exhausted for the configured year range.")
+        for _ in range(_RANDOM_TRIES):
+            index = self.rng.randrange(self.size)
+            if not self._is_set(index):
+                return index
+        # Dense bitmap, walk forward from a random position instead
+        return self._next_free(self.rng.randrange(self.size))
+
+    def next(self):
+        """Output: one unique HETU string"""
+        index = self._draw_index()
+        self._set(index)
+        return self._format(index)
+
+    def bulk(self, count):
+        """Output: list of count unique HETU strings"""
+        indexes = []
+        for _ in range(count):
+            index = self._draw_index()
+            self._set(index)
+            indexes.append(index)
+        return [self._format(index) for index in indexes]
+
+    def mark_issued(self, hetu):
+        """
+        Marks an existing HETU as issued so it is never handed out.
+        Output: True if the HETU is inside this generator's space.
+        """
+        if not hetu or len(hetu) != 11:
+            return False
+        date_i = self._date_index.get(hetu[:7])
+        if date_i is None or not hetu[7:10].isdigit():
+            return False
+        order = int(hetu[7:10])
+        if not ORDER_MIN <= order <= ORDER_MAX:
+            return False
+        index = date_i * self.orders + order - ORDER_MIN
+        if not self._is_set(index):
+            self._set(index)
+        return True
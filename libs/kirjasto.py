@@ -1,21 +1,79 @@
-import random as ra
+import os
+import threading
+
+class IdSource:
+    """
+    Run-unique lowercase hex identifiers of a fixed length.
+
+    The first half of every id is a random run prefix from os.urandom, the
+    second half a counter starting from a random offset, so ids never repeat
+    within a run and look random across runs. bulk() hands out a whole block
+    with one lock acquisition and one string format per id.
+    """
+
+    def __init__(self, length=24):
+        if length < 8:
+            raise ValueError("Identifier length must be at least 8.")
+        self.counter_len = length // 2
+        self.prefix = os.urandom(length).hex()[:length - self.counter_len]
+        self._limit = 16 ** self.counter_len
+        # Start in the lower half so the counter cannot wrap within a run
+        self._next = int.from_bytes(os.urandom(8), 'big') % (self._limit // 2)
+        self._fmt = f"{{}}{{:0{self.counter_len}x}}"
+        self._lock = threading.Lock()
+
+    def _take(self, count):
+        with self._lock:
+            first = self._next
+            self._next += count
+        if self._next > self._limit:
+            raise OverflowError("Identifier counter exhausted for this run.")
+        return first
+
+    def next(self):
+        """Output: one identifier string"""
+        return self._fmt.format(self.prefix, self._take(1))
+
+    def bulk(self, count):
+        """Output: list of count identifier strings"""
+        first = self._take(count)
+        prefix, fmt = self.prefix, self._fmt
+        return [fmt.format(prefix, n) for n in range(first, first + count)]
+
+_id_sources = {}
+_id_sources_lock = threading.Lock()
+if hasattr(os, 'register_at_fork'): # Forked workers (kpgen -p) get their own run prefixes
+    os.register_at_fork(after_in_child=_id_sources.clear)
+
+def id_source(length):
+    """
+    Input: identifier length
+    Output: shared IdSource of that length for this run
+    """
+    with _id_sources_lock:
+        if length not in _id_sources:
+            _id_sources[length] = IdSource(length)
+        return _id_sources[length]
 
 def gen_id(backdoor=False):
     """
     Input: True/False, default: False
-    Output: string [32]
+    Output: string [28], 'MaSi' + 24 hex, prefixed with '[TT]' if backdoor
     """
-    symbols = "abcdef1234567890"
-    id = ""
-    for i in range (0, 24):
-        id += ra.choice(symbols)
-
-    id = 'MaSi' + id
+    id = 'MaSi' + id_source(24).next()
     if not backdoor:
         return id
     else:
         return '[TT]'+id
 
+def gen_ids(count, backdoor=False):
+    """
+    Input: amount of ids, True/False, default: False
+    Output: list of gen_id formatted strings, unique within the run
+    """
+    head = '[TT]MaSi' if backdoor else 'MaSi'
+    return [head + i for i in id_source(24).bulk(count)]
+
 def add_check_digit(upc_str):
     """
     Input: string
@@ -39,6 +97,27 @@ def add_check_digit(upc_str):
         check_digit = 0
     return upc_str + str(check_digit)
 
+# Weighted digit sums of 3-digit chunks for add_check_digit_block.
+# Odd positions (1-based) of the base string weigh 3, even positions 1.
+_CHUNK_313 = [3 * (n // 100) + (n // 10) % 10 + 3 * (n % 10) for n in range(1000)]
+_CHUNK_131 = [(n // 100) + 3 * ((n // 10) % 10) + (n % 10) for n in range(1000)]
+
+def add_check_digit_block(prefix, start, count):
+    """
+    Input: 8 digit prefix string, first numeric part, amount of IDs
+    Output: list of strings, prefix + zero padded 9 digit numeric part + check digit
+
+    Same result as add_check_digit for every ID of the block, but the prefix
+    is summed only once and the numeric part through lookup tables.
+    """
+    prefix = str(prefix)
+    if len(prefix) != 8 or not prefix.isdigit():
+        raise ValueError(f"AP ID prefix must be 8 digits, got '{prefix}'")
+    prefix_sum = sum(int(c) * (3 if i % 2 == 0 else 1) for i, c in enumerate(prefix))
+    t313, t131 = _CHUNK_313, _CHUNK_131
+    return [f"{prefix}{n:09d}{-(prefix_sum + t313[n // 1000000] + t131[(n // 1000) % 1000] + t313[n % 1000]) % 10}"
+            for n in range(start, start + count)]
+
 def gen_timestamp(midnight=False):
     """
     Input: True/False, default: False
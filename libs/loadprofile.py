@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Load profile library for kulugen.
+
+Every profile is a precomputed shape table of 12 months x 168 hours of the
+week (local time), normalised to a mean of 1, plus a noise table of
+multipliers. A series for a block of time axis points is produced in one
+step: hourly scale * shape[key] * noise, where the noise multipliers for
+the whole block come from a single random.choices() call.
+
+Consumption APs (AG01) get the household, electric heating or business
+profile according to load_profile_mix in fconfig.py, production APs (AG02)
+the production profile. The profile and the AP's size factor are derived
+from a hash of the AP ID, so an AP keeps them across runs and they do not
+consume the random stream.
+"""
+
+import math
+import random as ra
+import zlib
+from statistics import NormalDist
+
+PROFILES = ('household', 'electric_heating', 'business', 'production')
+PRODUCTION_AP_TYPE = 'AG02'
+
+# Typical yearly energy of an AP of the profile, kWh
+ANNUAL_KWH = {
+    'household': 5000,
+    'electric_heating': 18000,
+    'business': 40000,
+    'production': 4000,
+}
+# Relative standard deviation of hourly values around the shape
+NOISE_SD = {
+    'household': 0.35,
+    'electric_heating': 0.25,
+    'business': 0.15,
+    'production': 0.30,
+}
+DEFAULT_MIX = {'household': 60, 'electric_heating': 25, 'business': 15}
+NOISE_STEPS = 512
+
+# Monthly level, January first
+_MONTHLY = {
+    'household': [1.35, 1.25, 1.1, 0.95, 0.85, 0.75, 0.7, 0.75, 0.9, 1.05, 1.2, 1.35],
+    'electric_heating': [2.0, 1.8, 1.5, 1.0, 0.6, 0.3, 0.25, 0.3, 0.6, 1.0, 1.5, 1.9],
+    'business': [1.2, 1.15, 1.05, 0.95, 0.9, 0.85, 0.75, 0.8, 0.95, 1.0, 1.1, 1.2],
+    'production': [0.05, 0.2, 0.5, 0.9, 1.2, 1.3, 1.3, 1.0, 0.6, 0.3, 0.08, 0.02],
+}
+# Hours of daylight per month, for the production day curve
+_DAYLIGHT_HOURS = [6, 9, 12, 14, 17, 19, 18, 16, 13, 10, 7, 5]
+
+
+def _household_day(weekend):
+    if weekend:
+        return [0.45, 0.4, 0.4, 0.4, 0.4, 0.45, 0.55, 0.7, 1.0, 1.3, 1.3, 1.2,
+                1.1, 1.0, 1.0, 1.0, 1.1, 1.4, 1.5, 1.5, 1.4, 1.2, 0.9, 0.6]
+    return [0.4, 0.35, 0.35, 0.35, 0.35, 0.45, 0.8, 1.2, 1.1, 0.7, 0.65, 0.7,
+            0.7, 0.65, 0.65, 0.75, 1.1, 1.5, 1.6, 1.6, 1.5, 1.3, 1.0, 0.6]
+
+
+def _day_curve(profile, month, weekday):
+    """Output: 24 relative hourly levels of a local day"""
+    weekend = weekday >= 5
+    if profile == 'household':
+        return _household_day(weekend)
+    if profile == 'electric_heating':
+        # Storage heating on the night tariff (22-07) on top of household use
+        return [0.6 * h + (0.4 * 1.8 if hour >= 22 or hour < 7 else 0.4 * 0.5)
+                for hour, h in enumerate(_household_day(weekend))]
+    if profile == 'business':
+        if weekend:
+            return [0.35] * 24
+        return [1.8 if 8 <= hour < 17 else 1.0 if hour in (7, 17) else 0.35 for hour in range(24)]
+    # production: daylight bell around local solar noon
+    daylight = _DAYLIGHT_HOURS[month]
+    sunrise = 13.0 - daylight / 2.0
+    curve = []
+    for hour in range(24):
+        position = (hour + 0.5 - sunrise) / daylight
+        curve.append(math.sin(math.pi * position) if 0.0 < position < 1.0 else 0.0)
+    return curve
+
+
+def build_shape(profile):
+    """Output: list of 12 * 168 levels indexed by month * 168 + weekday * 24 + hour, mean 1"""
+    shape = []
+    for month in range(12):
+        for weekday in range(7):
+            shape.extend(level * _MONTHLY[profile][month] for level in _day_curve(profile, month, weekday))
+    mean = sum(shape) / len(shape)
+    return [level / mean for level in shape]
+
+
+def build_noise(sd, steps=NOISE_STEPS):
+    """Output: sorted noise multipliers at evenly spaced normal quantiles, never below 0.05"""
+    normal = NormalDist(1.0, sd)
+    return [max(0.05, normal.inv_cdf((i + 0.5) / steps)) for i in range(steps)]
+
+
+class LoadProfiles:
+    """
+    Shape and noise tables of all profiles, built once per run.
+    """
+
+    def __init__(self, mix=None, annual_kwh=None):
+        mix = mix or DEFAULT_MIX
+        unknown = [name for name in mix if name not in PROFILES or name == 'production']
+        if unknown:
+            raise ValueError(f"Unknown consumption load profile(s) in load_profile_mix: {', '.join(unknown)}")
+        self.annual_kwh = dict(ANNUAL_KWH, **(annual_kwh or {}))
+        self.shapes = {name: build_shape(name) for name in PROFILES}
+        self.noise = {name: build_noise(NOISE_SD[name]) for name in PROFILES}
+
+        total = float(sum(mix.values()))
+        if total <= 0:
+            raise ValueError("load_profile_mix weights must add up to more than zero.")
+        self._mix = []
+        cumulative = 0.0
+        for name, weight in mix.items():
+            cumulative += weight / total
+            self._mix.append((cumulative, name))
+
+    def assign(self, ap_id, ap_type=None):
+        """
+        Input: AP ID, kp.csv 'AP type'
+        Output: (profile name, hourly scale in kWh), stable for the AP ID
+        """
+        h = zlib.crc32(str(ap_id).encode('utf-8'))
+        if (ap_type or '').strip() == PRODUCTION_AP_TYPE:
+            profile = 'production'
+        else:
+            pick = (h & 0xFFFF) / 65536.0
+            profile = next((name for limit, name in self._mix if pick < limit), self._mix[-1][1])
+        size = 0.5 + ((h >> 16) % 1000) / 1000.0 # 0.5 - 1.5 times the typical AP
+        return profile, self.annual_kwh[profile] * size / 8760.0
+
+    def series(self, profile, scale, keys, rng=ra):
+        """
+        Input: profile name, hourly scale, time axis profile keys of the block
+        Output: list of hourly energies (kWh) for the block
+        """
+        shape = self.shapes[profile]
+        multipliers = rng.choices(self.noise[profile], k=len(keys))
+        return [scale * shape[key] * noise for key, noise in zip(keys, multipliers)]
+
+    def block(self, assignment, axis, start, end, rng=ra):
+        """Output: hourly energies of time axis points start..end-1"""
+        profile, scale = assignment
+        return self.series(profile, scale, axis.profile_keys[start:end], rng)
@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Partitioned reading databases of kulugen.
+
+With db_partitioning set in fconfig.py kulugen writes the readings into one
+SQLite file per UTC month (fingrid-202503.db) or per DSO
+(fingrid-dso-6427020100000.db) next to fingrid.db. fingrid.db keeps the
+batch checkpoint. Every partition has the normal apoint/rpoint (and
+apoint_series/rpoint_series) tables, so a partition is dropped or archived
+by removing or moving its file, and separate kulugen runs can write to
+different partitions at the same time.
+
+For queries over several partitions view() attaches them to one
+connection, where TEMP views with the table names UNION ALL the
+partitions. SQLite attaches at most 10 databases, so longer periods
+are read with query(), which runs the SQL partition by partition:
+
+    python3 -m libs.partitions list
+    python3 -m libs.partitions query "SELECT COUNT(*) FROM apoint"
+    python3 -m libs.partitions prune 24      # keep the newest 24 months
+"""
+
+import glob
+import os
+import re
+import sqlite3
+import sys
+
+from libs import workspace
+
+SCHEMES = ('month', 'dso')
+READING_TABLES = ('apoint', 'rpoint', 'apoint_series', 'rpoint_series')
+MAX_ATTACHED = 10 # SQLite default SQLITE_MAX_ATTACHED
+
+
+class PartitionSet:
+    """
+    The partition files of one base database and their open write connections.
+    """
+
+    def __init__(self, base_path=None, scheme='month', create_tables=None):
+        if scheme not in SCHEMES:
+            raise ValueError(f"db_partitioning must be one of {', '.join(SCHEMES)}, not '{scheme}'")
+        self.scheme = scheme
+        self.stem = os.path.splitext(base_path or workspace.path('fingrid.db'))[0]
+        self.create_tables = create_tables
+        self._connections = {}
+
+    def key_for(self, timestamp, details):
+        """Output: partition key of a reading, 'YYYYMM' or 'dso-<DSO>'"""
+        if self.scheme == 'month':
+            return timestamp[0:4] + timestamp[5:7]
+        return 'dso-' + (re.sub(r'[^0-9A-Za-z_-]', '_', details.get('dso') or '') or 'unknown')
+
+    def path(self, key):
+        return f"{self.stem}-{key}.db"
+
+    def keys(self):
+        """Output: sorted keys of the existing partition files of the scheme"""
+        keys = []
+        for path in glob.glob(glob.escape(self.stem) + '-*.db'):
+            key = path[len(self.stem) + 1:-3]
+            if (key.isdigit() and len(key) == 6) == (self.scheme == 'month') and \
+                    (self.scheme == 'month' or key.startswith('dso-')):
+                keys.append(key)
+        return sorted(keys)
+
+    def connection(self, key):
+        """Output: write connection of a partition, created with the reading tables"""
+        conn = self._connections.get(key)
+        if conn is None:
+            conn = sqlite3.connect(self.path(key), timeout=10)
+            if self.create_tables is not None:
+                self.create_tables(conn.cursor())
+                conn.commit()
+            self._connections[key] = conn
+        return conn
+
+    def split(self, readings, details):
+        """
+        Input: readings [(DB timestamp, value)] of one point, point details
+        Output: list of (partition cursor, readings of the partition)
+        """
+        parts = {}
+        for reading in readings:
+            parts.setdefault(self.key_for(reading[0], details), []).append(reading)
+        return [(self.connection(key).cursor(), part) for key, part in parts.items()]
+
+    def commit(self):
+        for conn in self._connections.values():
+            conn.commit()
+
+    def close(self):
+        for conn in self._connections.values():
+            conn.commit()
+            conn.close()
+        self._connections = {}
+
+    def drop(self, key):
+        """Removes a partition file, i.e. all its readings."""
+        conn = self._connections.pop(key, None)
+        if conn is not None:
+            conn.close()
+        os.remove(self.path(key))
+
+    def view(self, keys=None):
+        """
+        Output: connection with the partitions (default all) attached and TEMP
+        views apoint, rpoint, apoint_series and rpoint_series over them.
+        """
+        keys = self.keys() if keys is None else list(keys)
+        if len(keys) > MAX_ATTACHED:
+            raise ValueError(f"{len(keys)} partitions, SQLite attaches at most {MAX_ATTACHED}. "
+                             "Narrow the keys or use query().")
+        conn = sqlite3.connect(':memory:')
+        aliases = []
+        for i, key in enumerate(keys):
+            conn.execute(f"ATTACH DATABASE ? AS p{i}", (self.path(key),))
+            aliases.append(f"p{i}")
+        for table in READING_TABLES:
+            sources = [alias for alias in aliases
+                       if conn.execute(f"SELECT 1 FROM {alias}.sqlite_master WHERE name = ?", (table,)).fetchone()]
+            if sources:
+                conn.execute(f"CREATE TEMP VIEW {table} AS " +
+                             " UNION ALL ".join(f"SELECT * FROM {alias}.{table}" for alias in sources))
+        return conn
+
+    def query(self, sql, params=(), keys=None):
+        """Output: rows of the SQL run in each partition (default all), concatenated in key order"""
+        rows = []
+        for key in (self.keys() if keys is None else keys):
+            conn = sqlite3.connect(self.path(key))
+            try:
+                rows.extend(conn.execute(sql, params).fetchall())
+            finally:
+                conn.close()
+        return rows
+
+
+if __name__ == "__main__":
+    usage = "Usage: python3 -m libs.partitions [--workspace <dir>] list | query <sql> | prune <months to keep> [month|dso]"
+    sys.argv[1:] = workspace.from_argv(sys.argv[1:])
+    if len(sys.argv) < 2 or sys.argv[1] not in ('list', 'query', 'prune'):
+        print(usage)
+        sys.exit(2)
+    action = sys.argv[1]
+    scheme = sys.argv[-1] if sys.argv[-1] in SCHEMES and len(sys.argv) > 2 else 'month'
+    partitions = PartitionSet(scheme=scheme)
+    if action == 'list':
+        for key in partitions.keys():
+            print(f"{key}\t{os.path.getsize(partitions.path(key)) // 1024} kB")
+    elif action == 'query' and len(sys.argv) > 2:
+        for row in partitions.query(sys.argv[2]):
+            print(*row, sep='\t')
+    elif action == 'prune' and len(sys.argv) > 2 and sys.argv[2].isdigit() and scheme == 'month':
+        keys = partitions.keys()
+        for key in keys[:max(0, len(keys) - int(sys.argv[2]))]:
+            partitions.drop(key)
+            print(f"Removed {partitions.path(key)}")
+    else:
+        print(usage)
+        sys.exit(2)
@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Population specification of kpgen.
+
+Instead of one DSO, MGA, AP type and metering method per run, a JSON spec
+gives the counts per DSO/MGA and the mix of AP types, remote reading and
+metering methods; kpgen -p <spec> generates the whole population in one run:
+
+    {
+      "defaults": {
+        "ap_type": {"AG01": 0.95, "AG02": 0.05},
+        "remote": {"1": 0.9, "0": 0.1},
+        "method": {"E13": 0.9, "E14": 0.08, "E16": 0.02}
+      },
+      "segments": [
+        {"dso": "6427020100000", "mga": "6427020100000000", "count": 200000},
+        {"dso": "6427020200000", "mga": "6427020100000100", "count": 50000,
+         "ap_type": {"AG02": 1}}
+      ]
+    }
+
+A mix missing from a segment comes from "defaults", a mix missing from both
+is AG01 / remote readable / E13. Ratios need not sum to 1, they are
+normalised. The count of a segment is split over every combination of the
+mixes with the largest remainder method, so the parts always add up to the
+count, and the combinations are cut into tasks of at most TASK_SIZE APs
+that kpgen runs in parallel.
+"""
+
+import itertools
+import json
+
+MIXES = ('ap_type', 'remote', 'method')
+CODES = {
+    'ap_type': ('AG01', 'AG02'),
+    'remote': ('0', '1'),
+    'method': ('E13', 'E14', 'E16'),
+}
+DEFAULT_MIX = {'ap_type': {'AG01': 1}, 'remote': {'1': 1}, 'method': {'E13': 1}}
+TASK_SIZE = 50000 # Most APs generated by one task
+
+
+def _mix(value, name, where):
+    """Output: [(code, weight)] of a mix, validated"""
+    if not isinstance(value, dict) or not value:
+        raise ValueError(f"{where}: '{name}' must be a non-empty object of code: ratio.")
+    mix = []
+    for code, weight in value.items():
+        code = str(code)
+        if code not in CODES[name]:
+            raise ValueError(f"{where}: unknown {name} '{code}', must be one of {', '.join(CODES[name])}.")
+        if not isinstance(weight, (int, float)) or weight < 0:
+            raise ValueError(f"{where}: ratio of {name} '{code}' must be a non-negative number.")
+        mix.append((code, float(weight)))
+    if not sum(weight for _, weight in mix):
+        raise ValueError(f"{where}: ratios of '{name}' sum to 0.")
+    return mix
+
+
+def split_count(count, weights):
+    """
+    Input: total, list of weights
+    Output: list of integer parts in proportion to the weights, summing to total
+    """
+    total = sum(weights)
+    exact = [count * weight / total for weight in weights]
+    parts = [int(x) for x in exact]
+    # Largest remainders get the units lost to rounding down
+    by_remainder = sorted(range(len(weights)), key=lambda i: exact[i] - parts[i], reverse=True)
+    for i in by_remainder[:count - sum(parts)]:
+        parts[i] += 1
+    return parts
+
+
+def load_spec(path, dsos, mgas, limit=None):
+    """
+    Input: spec file path, configured DSO and MGA lists (fconfig), optional
+           limit of APs per segment
+    Output: list of segments {'dso', 'mga', 'count', 'parts': [(ap_type, remote, method, count)]}
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            spec = json.load(f)
+    except ValueError as e:
+        raise ValueError(f"Population spec '{path}' is not valid JSON: {e}")
+    if not isinstance(spec, dict) or not isinstance(spec.get('segments'), list) or not spec['segments']:
+        raise ValueError(f"Population spec '{path}' needs a non-empty 'segments' list.")
+
+    defaults = spec.get('defaults') or {}
+    segments = []
+    for number, segment in enumerate(spec['segments'], 1):
+        where = f"{path} segment {number}"
+        dso, mga, count = str(segment.get('dso', '')), str(segment.get('mga', '')), segment.get('count')
+        if dso not in dsos:
+            raise ValueError(f"{where}: DSO '{dso}' is not in the configured jakeluverkkoyhtio list.")
+        if mga not in mgas:
+            raise ValueError(f"{where}: MGA '{mga}' is not in the configured MGA list.")
+        if not isinstance(count, int) or count < 1 or (limit is not None and count > limit):
+            raise ValueError(f"{where}: count must be an integer between 1 and {limit or 'the ID space'}.")
+
+        mixes = [_mix(segment.get(name, defaults.get(name, DEFAULT_MIX[name])), name, where) for name in MIXES]
+        combinations = list(itertools.product(*mixes))
+        counts = split_count(count, [a[1] * b[1] * c[1] for a, b, c in combinations])
+        parts = [(a[0], b[0], c[0], n) for (a, b, c), n in zip(combinations, counts) if n]
+        segments.append({'dso': dso, 'mga': mga, 'count': count, 'parts': parts})
+    return segments
+
+
+def tasks(segments, first_ids, task_size=TASK_SIZE):
+    """
+    Input: load_spec() segments, first reserved ID number of each segment
+    Output: list of (dso, mga, ap_type, remote, method, first ID number, count),
+            each segment's ID block cut consecutively over its parts
+    """
+    result = []
+    for segment, first_id in zip(segments, first_ids):
+        for ap_type, remote, method, count in segment['parts']:
+            for offset in range(0, count, task_size):
+                result.append((segment['dso'], segment['mga'], ap_type, remote, method,
+                               first_id + offset, min(task_size, count - offset)))
+            first_id += count
+    return result
@@ -0,0 +1,323 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Compiled reference data pack for addresses, names and error codes.
+
+The text files in libs/ (osoitteet.txt, mies.txt, nainen.txt, sukunimet.txt,
+Error_code.txt, Error_string.txt) are compiled into one binary file,
+libs/refdata.pack. Every section is a single bytes blob plus an array of
+uint32 offsets. The pack is memory-mapped read-only, so any number of
+worker processes share the same pages and items are decoded only when
+they are actually sampled.
+
+Addresses are stored sorted by postal code, so every postal code prefix is
+one contiguous index range found by binary search. The 'city_index' section
+holds the contiguous runs of each city as "city,start,end" items. Together
+they let AddressSampler draw addresses for a metering grid area from its
+configured postal regions in O(1) per address.
+
+Build explicitly with "python3 libs/refpack.py". load_pack() rebuilds the
+pack automatically if it is missing, of an older format or older than any
+of its sources.
+
+File layout (little endian):
+    magic b'MASIREF1', uint32 section count
+    per section: 16 byte name, uint32 item count, uint64 offsets position,
+                 uint64 blob position
+    per section: (count + 1) uint32 offsets, blob
+"""
+
+import bisect
+import mmap
+import os
+import random as ra
+import struct
+import sys
+from array import array
+
+LIBS_DIR = os.path.dirname(os.path.abspath(__file__))
+PACK_PATH = os.path.join(LIBS_DIR, 'refdata.pack')
+
+# Section name -> source file in libs/
+SOURCES = {
+    'osoitteet': 'osoitteet.txt',
+    'mies': 'mies.txt',
+    'nainen': 'nainen.txt',
+    'sukunimet': 'sukunimet.txt',
+    'error_code': 'Error_code.txt',
+    'error_string': 'Error_string.txt',
+}
+
+MAGIC = b'MASIREF2'
+_HEADER = struct.Struct('<8sI')
+_SECTION = struct.Struct('<16sIQQ')
+ENCODING = 'utf-8'
+
+if array('I').itemsize != 4:
+    raise ImportError("refpack requires a 4 byte unsigned int array type.")
+
+
+def read_source_lines(path):
+    """Reads non-empty stripped lines of a source file as bytes."""
+    with open(path, 'rb') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def _address_key(line):
+    """Sort key of an osoitteet.txt line: postal code, city, street."""
+    parts = line.split(b',')
+    return (parts[0], parts[-1], line)
+
+
+def city_runs(addresses):
+    """
+    Input: address lines sorted by postal code
+    Output: list of b"city,start,end" items, one per contiguous run of a city
+    """
+    runs = []
+    run_city, run_start = None, 0
+    for i, line in enumerate(addresses):
+        city = line.rsplit(b',', 1)[-1].strip()
+        if city != run_city:
+            if run_city is not None:
+                runs.append(b'%s,%d,%d' % (run_city, run_start, i))
+            run_city, run_start = city, i
+    if run_city is not None:
+        runs.append(b'%s,%d,%d' % (run_city, run_start, len(addresses)))
+    return runs
+
+
+def build_pack(pack_path=PACK_PATH, sources=None):
+    """
+    Compiles the source text files into a pack file.
+    Input: pack path, optional {section: list of bytes} overriding the libs/ files
+    Output: pack path
+    """
+    if sources is None:
+        sources = {name: read_source_lines(os.path.join(LIBS_DIR, filename))
+                   for name, filename in SOURCES.items()}
+    if 'osoitteet' in sources:
+        sources = dict(sources)
+        sources['osoitteet'] = sorted(sources['osoitteet'], key=_address_key)
+        sources['city_index'] = city_runs(sources['osoitteet'])
+
+    names = sorted(sources)
+    position = _HEADER.size + _SECTION.size * len(names)
+    table = []
+    payload = []
+    for name in names:
+        items = sources[name]
+        offsets = array('I', [0])
+        total = 0
+        for item in items:
+            total += len(item)
+            offsets.append(total)
+        if total >= 2 ** 32:
+            raise ValueError(f"Reference section '{name}' is too large for the pack format.")
+        offsets_bytes = offsets.tobytes() if sys.byteorder == 'little' else _swapped(offsets)
+        table.append(_SECTION.pack(name.encode('ascii'), len(items), position, position + len(offsets_bytes)))
+        position += len(offsets_bytes) + total
+        payload.append(offsets_bytes)
+        payload.append(b''.join(items))
+
+    # Write to a temporary file first so concurrently starting workers never map a half written pack
+    tmp_path = f"{pack_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, len(names)))
+        f.writelines(table)
+        f.writelines(payload)
+    os.replace(tmp_path, pack_path)
+    return pack_path
+
+
+def _swapped(offsets):
+    swapped = array('I', offsets)
+    swapped.byteswap()
+    return swapped.tobytes()
+
+
+class PackSection:
+    """
+    Read-only sequence view of one pack section. Supports len(), indexing
+    and therefore random.choice() without materialising the items.
+    """
+
+    def __init__(self, buffer, count, offsets_pos, blob_pos):
+        self._buffer = buffer
+        self._count = count
+        self._offsets = buffer[offsets_pos:offsets_pos + 4 * (count + 1)].cast('I')
+        self._blob_pos = blob_pos
+
+    def __len__(self):
+        return self._count
+
+    def raw(self, index):
+        """Output: item as bytes"""
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('pack section index out of range')
+        start = self._blob_pos + self._offsets[index]
+        return bytes(self._buffer[start:self._blob_pos + self._offsets[index + 1]])
+
+    def __getitem__(self, index):
+        return self.raw(index).decode(ENCODING)
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+
+class RefPack:
+    """Memory-mapped reference data pack."""
+
+    def __init__(self, pack_path=PACK_PATH):
+        self.pack_path = pack_path
+        with open(pack_path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._mmap)
+        magic, count = _HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"'{pack_path}' is not a MaSi reference pack.")
+        if sys.byteorder != 'little':
+            raise ValueError("Reference packs are only supported on little endian hosts.")
+        self.sections = {}
+        for i in range(count):
+            name, items, offsets_pos, blob_pos = _SECTION.unpack_from(self._buffer, _HEADER.size + i * _SECTION.size)
+            self.sections[name.rstrip(b'\0').decode('ascii')] = PackSection(self._buffer, items, offsets_pos, blob_pos)
+
+    def section(self, name):
+        try:
+            return self.sections[name]
+        except KeyError:
+            raise KeyError(f"Section '{name}' not found in reference pack '{self.pack_path}'.")
+
+
+def pack_is_stale(pack_path=PACK_PATH):
+    """True if the pack is missing, of another format or older than any of its source files."""
+    try:
+        pack_mtime = os.stat(pack_path).st_mtime_ns
+        with open(pack_path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return True
+    except FileNotFoundError:
+        return True
+    for filename in SOURCES.values():
+        try:
+            if os.stat(os.path.join(LIBS_DIR, filename)).st_mtime_ns > pack_mtime:
+                return True
+        except FileNotFoundError:
+            continue
+    return False
+
+
+_loaded = {}
+
+def load_pack(pack_path=PACK_PATH):
+    """
+    Output: RefPack, rebuilt first if missing or stale. Cached per process.
+    """
+    if pack_path not in _loaded:
+        if pack_is_stale(pack_path):
+            build_pack(pack_path)
+        _loaded[pack_path] = RefPack(pack_path)
+    return _loaded[pack_path]
+
+
+class AddressSampler:
+    """
+    Draws addresses from the pack, optionally restricted per MGA to postal
+    regions. A region is a postal code prefix ('00', '337') or a city name
+    ('tampere'), see mga_postal_regions in fconfig.py.
+    """
+
+    def __init__(self, pack, mga_regions=None):
+        self.addresses = pack.section('osoitteet')
+        self._city_ranges = {}
+        for item in pack.section('city_index'):
+            city, start, end = item.rsplit(',', 2)
+            self._city_ranges.setdefault(city.lower(), []).append((int(start), int(end)))
+        self._mga_ranges = {}
+        for mga, regions in (mga_regions or {}).items():
+            ranges = []
+            for region in regions:
+                found = self.region_ranges(region)
+                if not found:
+                    print(f"Warning: Postal region '{region}' for MGA {mga} matches no addresses.")
+                ranges.extend(found)
+            if ranges:
+                cumulative = []
+                total = 0
+                for start, end in ranges:
+                    total += end - start
+                    cumulative.append(total)
+                self._mga_ranges[mga] = (ranges, cumulative)
+
+    def _lower_bound(self, key):
+        """First address index whose postal code is >= key (binary search)."""
+        addresses = self.addresses
+        lo, hi = 0, len(addresses)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if addresses.raw(mid)[:len(key)] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def region_ranges(self, region):
+        """
+        Input: postal code prefix or city name
+        Output: list of (start, end) address index ranges
+        """
+        region = str(region).strip()
+        if region.isdigit():
+            key = region.encode('ascii')
+            start = self._lower_bound(key)
+            # The end is the first postal code after the prefix range
+            upper = str(int(region) + 1).zfill(len(region)).encode('ascii')
+            if len(upper) == len(key):
+                end = self._lower_bound(upper)
+            else: # '99..' prefix runs to the end
+                end = len(self.addresses)
+            return [(start, end)] if end > start else []
+        return list(self._city_ranges.get(region.lower(), []))
+
+    def has_regions(self, mga):
+        return mga in self._mga_ranges
+
+    def sample(self, mga=None, rng=ra):
+        """
+        Output: address line 'zip,street,city' from the MGA's postal
+        regions, or from all addresses if the MGA has none configured.
+        """
+        if mga not in self._mga_ranges:
+            return self.addresses[rng.randrange(len(self.addresses))]
+        ranges, cumulative = self._mga_ranges[mga]
+        r = rng.randrange(cumulative[-1])
+        i = bisect.bisect_right(cumulative, r)
+        start, end = ranges[i]
+        return self.addresses[end - (cumulative[i] - r)]
+
+
+_error_strings = None
+
+def error_strings():
+    """
+    Output: {error code: description} from the pack's error sections, cached per process.
+    """
+    global _error_strings
+    if _error_strings is None:
+        pack = load_pack()
+        codes = pack.section('error_code')
+        strings = pack.section('error_string')
+        _error_strings = {codes[i]: (strings[i] if i < len(strings) else None) for i in range(len(codes))}
+    return _error_strings
+
+
+if __name__ == "__main__":
+    path = build_pack()
+    pack = RefPack(path)
+    print(f"Built {path} ({os.path.getsize(path)} bytes)")
+    for section_name, section in sorted(pack.sections.items()):
+        print(f"  {section_name:15} {len(section)} items")
@@ -0,0 +1,274 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Replay of measured meter profiles in kulugen.
+
+A large CSV export or .npy matrix of measured series is converted once into
+a .replay file: a small JSON header followed by a float32 (series x interval)
+matrix, series-major, so the readings of one series are contiguous. The
+file is memory-mapped read-only, so any number of kulugen processes share
+the same pages and only the slices that are replayed are read from disk.
+
+CSV input, one row per interval, first column the interval start in UTC:
+    timestamp,AG01:house_1,AG01:house_2,AG02:solar_1
+    2023-01-01T00:00:00Z,0.52,0.61,0.0
+Column names are <AP type>:<name>; a name without a type is AG01. Values
+are kWh per interval, empty cells are 0. The interval length is taken from
+the first two timestamps.
+
+.npy input (float32/float64, C order, shape series x intervals) needs the
+start time, step and AP types on the command line:
+    python3 libs/replay.py -s 2023-01-01T00:00:00Z -m 60 -t AG01,AG01,AG02 in.npy out.replay
+
+APs are assigned a series of their AP type, a scale factor and a whole-day
+time shift from a hash of the AP ID. Series are replayed cyclically, so a
+one year recording covers any generation period. A run interval longer
+than the recorded one gets the sum of the recorded intervals within it
+(e.g. four PT15M values per PT1H point); a shorter one repeats its
+recorded interval, scaled to its length.
+"""
+
+import ast
+import csv
+import datetime
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from getopt import getopt, GetoptError
+
+MAGIC = b'MASIRPL1'
+_HEADER = struct.Struct('<8sI') # magic, JSON header length
+DEFAULT_AP_TYPE = 'AG01'
+_EPOCH = datetime.datetime(1970, 1, 1)
+_CHUNK_ROWS = 4096
+
+if array('f').itemsize != 4:
+    raise ImportError("replay requires a 4 byte float array type.")
+
+
+def _parse_utc(value):
+    """'YYYY-MM-DDTHH:MM[:SS]Z' -> epoch seconds"""
+    value = value.strip().rstrip('Z').replace(' ', 'T')
+    fmt = "%Y-%m-%dT%H:%M:%S" if value.count(':') == 2 else "%Y-%m-%dT%H:%M"
+    return int((datetime.datetime.strptime(value, fmt) - _EPOCH).total_seconds())
+
+
+def _split_column(name):
+    ap_type, sep, series_name = name.strip().partition(':')
+    return (ap_type, series_name) if sep else (DEFAULT_AP_TYPE, ap_type)
+
+
+def _write_header(f, meta):
+    header = json.dumps(meta).encode('utf-8')
+    # Pad so the float matrix starts 4 byte aligned
+    header += b' ' * (-(_HEADER.size + len(header)) % 4)
+    f.write(_HEADER.pack(MAGIC, len(header)))
+    f.write(header)
+    return _HEADER.size + len(header)
+
+
+def convert_csv(csv_path, out_path):
+    """
+    Converts an interval-per-row CSV export to a .replay file in two passes:
+    the first counts the intervals, the second writes each series' chunk of
+    rows into its contiguous area of the preallocated matrix.
+    Output: out_path
+    """
+    with open(csv_path, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        columns = next(reader)[1:]
+        first = next(reader)
+        second = next(reader, None)
+        intervals = 2 + sum(1 for _ in reader) if second else 1
+    if not columns:
+        raise ValueError(f"'{csv_path}' has no series columns.")
+    start = _parse_utc(first[0])
+    step = _parse_utc(second[0]) - start if second else 3600
+    if step <= 0:
+        raise ValueError(f"'{csv_path}' timestamps must be increasing.")
+
+    types, names = zip(*[_split_column(c) for c in columns])
+    meta = {'start': start, 'step': step, 'intervals': intervals, 'names': names, 'types': types}
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as out, open(csv_path, 'r', newline='', encoding='utf-8') as f:
+        data_pos = _write_header(out, meta)
+        out.truncate(data_pos + 4 * intervals * len(columns))
+        reader = csv.reader(f)
+        next(reader)
+        row_pos = 0
+        while True:
+            rows = [row for _, row in zip(range(_CHUNK_ROWS), reader)]
+            if not rows:
+                break
+            for col in range(len(columns)):
+                chunk = array('f', [float(row[col + 1]) if col + 1 < len(row) and row[col + 1].strip() else 0.0
+                                    for row in rows])
+                if sys.byteorder != 'little':
+                    chunk.byteswap()
+                out.seek(data_pos + 4 * (col * intervals + row_pos))
+                out.write(chunk.tobytes())
+            row_pos += len(rows)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def convert_npy(npy_path, out_path, start, step_minutes, types):
+    """
+    Converts a 2-D float32/float64 .npy matrix (series x intervals) to a .replay file.
+    Output: out_path
+    """
+    with open(npy_path, 'rb') as f:
+        if f.read(6) != b'\x93NUMPY':
+            raise ValueError(f"'{npy_path}' is not a .npy file.")
+        major = f.read(2)[0]
+        header_len = struct.unpack('<H' if major == 1 else '<I', f.read(2 if major == 1 else 4))[0]
+        header = ast.literal_eval(f.read(header_len).decode('latin-1'))
+        if header['fortran_order'] or len(header['shape']) != 2 or header['descr'] not in ('<f4', '<f8'):
+            raise ValueError("Only C order 2-D little endian float32/float64 .npy matrices are supported.")
+        series, intervals = header['shape']
+        if len(types) not in (1, series):
+            raise ValueError(f"Give one AP type or one per series ({series}).")
+        types = list(types) * series if len(types) == 1 else list(types)
+        item = 4 if header['descr'] == '<f4' else 8
+        meta = {'start': _parse_utc(start), 'step': step_minutes * 60, 'intervals': intervals,
+                'names': [f"series_{i}" for i in range(series)], 'types': types}
+        tmp_path = f"{out_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as out:
+            _write_header(out, meta)
+            for _ in range(series):
+                row = array('f' if item == 4 else 'd')
+                row.frombytes(f.read(item * intervals))
+                if sys.byteorder != 'little':
+                    row.byteswap()
+                if item == 8:
+                    row = array('f', row)
+                    if sys.byteorder != 'little':
+                        row.byteswap()
+                out.write(row.tobytes())
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+class ReplayLibrary:
+    """
+    Memory-mapped .replay file and the assignment of its series to APs.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_len = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"'{path}' is not a MaSi replay file.")
+        if sys.byteorder != 'little':
+            raise ValueError("Replay files are only supported on little endian hosts.")
+        meta = json.loads(self._mmap[_HEADER.size:_HEADER.size + header_len].decode('utf-8'))
+        self.start = meta['start']
+        self.step = meta['step']
+        self.intervals = meta['intervals']
+        self.names = meta['names']
+        data_pos = _HEADER.size + header_len
+        self.matrix = memoryview(self._mmap)[data_pos:data_pos + 4 * self.intervals * len(self.names)].cast('f')
+        self.by_type = {}
+        for index, ap_type in enumerate(meta['types']):
+            self.by_type.setdefault(ap_type, []).append(index)
+
+    def __len__(self):
+        return len(self.names)
+
+    def assign(self, ap_id, ap_type=None):
+        """
+        Input: AP ID, kp.csv 'AP type'
+        Output: (series index, scale, shift in intervals), stable for the AP ID,
+        or None if the file has no series of the AP type
+        """
+        candidates = self.by_type.get((ap_type or DEFAULT_AP_TYPE).strip())
+        if not candidates:
+            return None
+        h = zlib.crc32(str(ap_id).encode('utf-8'))
+        index = candidates[h % len(candidates)]
+        scale = 0.8 + ((h >> 8) % 401) / 1000.0 # 0.8 - 1.2
+        per_day = max(1, 86400 // self.step)
+        days = max(1, self.intervals // per_day)
+        shift = ((h >> 20) % days) * per_day
+        return index, scale, shift
+
+    def series(self, assignment, epochs, run_step=None):
+        """
+        Input: assign() result, UTC epoch seconds of the block's time axis
+               points, seconds between them (default from the epochs)
+        Output: list of hourly energies (kWh per hour) for the block
+        When the run step is longer than the recorded step every point sums
+        the run_step // step recorded intervals it covers, so the replayed
+        energy is the measured energy.
+        """
+        index, scale, shift = assignment
+        base = index * self.intervals
+        matrix, intervals, start, step = self.matrix, self.intervals, self.start, self.step
+        if run_step is None:
+            run_step = epochs[1] - epochs[0] if len(epochs) > 1 else step
+        per_point = max(1, run_step // step) # Recorded intervals summed into one point
+        to_hourly = scale * 3600.0 / (per_point * step)
+        first = ((epochs[0] - start) // step + shift) % intervals
+        contiguous = run_step >= step and run_step % step == 0
+        if contiguous and first + len(epochs) * per_point <= intervals:
+            # No wrap around: one contiguous slice of the mapped matrix
+            flat = matrix[base + first:base + first + len(epochs) * per_point].tolist()
+            if per_point == 1:
+                values = flat
+            else:
+                values = [sum(flat[i:i + per_point]) for i in range(0, len(flat), per_point)]
+        else:
+            values = []
+            for epoch in epochs:
+                position = (epoch - start) // step + shift
+                values.append(sum(matrix[base + (position + k) % intervals] for k in range(per_point)))
+        return [value * to_hourly for value in values]
+
+    def block(self, assignment, axis, start, end, rng=None):
+        """Output: hourly energies of time axis points start..end-1"""
+        return self.series(assignment, axis.epochs[start:end], axis.step)
+
+
+def open_replay(path):
+    """
+    Input: .replay file, or a CSV export which is converted next to it
+           (<name>.replay) when the converted file is missing or older
+    Output: ReplayLibrary
+    """
+    if not path.endswith('.replay'):
+        replay_path = os.path.splitext(path)[0] + '.replay'
+        if not os.path.exists(replay_path) or os.path.getmtime(replay_path) < os.path.getmtime(path):
+            convert_csv(path, replay_path)
+        path = replay_path
+    return ReplayLibrary(path)
+
+
+if __name__ == "__main__":
+    usage = "Usage: replay.py [-s <start> -m <step minutes> -t <AP types>] <input.csv|input.npy> <output.replay>"
+    try:
+        opts, args = getopt(sys.argv[1:], "hs:m:t:", ["help", "start=", "step=", "types="])
+    except GetoptError as e:
+        print(e)
+        print(usage)
+        sys.exit(2)
+    options = dict(opts)
+    if '-h' in options or '--help' in options or len(args) != 2:
+        print(usage)
+        sys.exit(0 if args or options else 2)
+    source, target = args
+    if source.endswith('.npy'):
+        convert_npy(source, target, options.get('-s', options.get('--start', '1970-01-01T00:00:00Z')),
+                    int(options.get('-m', options.get('--step', 60))),
+                    options.get('-t', options.get('--types', DEFAULT_AP_TYPE)).split(','))
+    else:
+        convert_csv(source, target)
+    library = ReplayLibrary(target)
+    print(f"Wrote {target}: {len(library)} series x {library.intervals} intervals of {library.step // 60} min")
+    for ap_type, indexes in sorted(library.by_type.items()):
+        print(f"  {ap_type}: {len(indexes)} series")
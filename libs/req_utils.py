@@ -10,7 +10,6 @@ import os
 import re
 import sys
 import requests # For requests.post and requests.exceptions.RequestException
-import shutil # For shutil.move
 from timeit import default_timer as timer # For timing requests
 from datetime import timedelta # For timing requests
 import time # For sleep in thread_loop, if that's also moved or used by send_generic
@@ -24,9 +23,25 @@ except ImportError:
     # For now, print error. Callers will likely fail if these are None.
     DSO, DDQ, url = None, None, None
 
+try:
+    from libs.refpack import error_strings as pack_error_strings
+except ImportError:
+    pack_error_strings = None
+
+try:
+    from libs.correlation import CorrelationStore
+except ImportError:
+    CorrelationStore = None
+
+from libs import workspace, xmllayout
+
 DEBUG = False
 headers = {'content-type': 'text/xml'}
-xml_path = 'xml/' # Assuming XML files are in an 'xml' subdirectory relative to where the main scripts are run.
+xml_path = 'xml/' # XML files are in an 'xml' subdirectory of the run workspace, see workspace_xml_path()
+
+def workspace_xml_path():
+    """Returns the XML directory of the selected run workspace (libs/workspace.py)."""
+    return workspace.path(xml_path)
 
 def dprint(*s):
     """Prints debug messages if DEBUG is True."""
@@ -64,6 +79,18 @@ def find_error(error_code):
     Error codes and strings are read from 'Error_code.txt' and 'Error_string.txt'.
     """
     dprint(f'find_error({error_code})')
+    if pack_error_strings is not None:
+        try:
+            # Compiled reference pack, loaded once per process
+            known = pack_error_strings()
+            if error_code not in known:
+                return f"Unknown error code {error_code} (Not found in reference pack)"
+            if known[error_code] is None:
+                return f"Error code {error_code} found, but no corresponding string in reference pack"
+            return known[error_code]
+        except (OSError, ValueError, KeyError) as e:
+            dprint(f"Reference pack unavailable ({e}), reading error files directly.")
+
     # Construct paths relative to this file's location (libs directory)
     base_dir = os.path.dirname(__file__)
     error_codes_path = os.path.join(base_dir, 'Error_code.txt')
@@ -138,12 +165,28 @@ def gen_url(mode, xml_content):
     return url + org_uri_part
 
 
+def record_sent(input_xml, source_filename, sent_at):
+    """
+    Records a successfully sent message to the correlation store so that putsi
+    can match the asynchronous status message to it. Failures are only reported,
+    they never fail the send itself.
+    """
+    dprint(f'record_sent({source_filename})')
+    if CorrelationStore is None:
+        return
+    try:
+        if CorrelationStore().record_sent(input_xml, source_filename, sent_at) is None:
+            dprint(f"No header Identification found in {source_filename}, not correlated.")
+    except Exception as e:
+        print(f"Warning: Could not record {source_filename} to correlation store: {e}")
+
+
 def send_generic(source_filename, source_type):
     """
     Sends an XML file to a specified endpoint and handles the response.
 
     Args:
-        source_filename (str): The name of the XML file (located in `xml_path`).
+        source_filename (str): The name of the XML file (located in `xml_path` of the workspace).
         source_type (str): The type of the source, typically 'DSO' or 'DDQ',
                            which determines the endpoint configuration.
 
@@ -159,9 +202,10 @@ def send_generic(source_filename, source_type):
     """
     dprint(f'send_generic({source_filename}, {source_type})')
 
-    full_xml_path = os.path.join(xml_path, source_filename)
-    # log_dir should ideally be configurable or passed, but using 'log' as per original scripts
-    log_dir = 'log'
+    # Flat, sharded or segmented xml/, see libs/xmllayout.py
+    xml_dir = workspace_xml_path()
+    # 'log' as per original scripts, inside the run workspace
+    log_dir = workspace.path('log')
 
     # Ensure log directory exists
     if not os.path.exists(log_dir):
@@ -173,13 +217,12 @@ def send_generic(source_filename, source_type):
 
     # Read source XML file
     try:
-        with open(full_xml_path, 'r') as source_xml_file:
-            input_xml = source_xml_file.read()
+        input_xml = xmllayout.read(xml_dir, source_filename)
     except FileNotFoundError:
-        print(f"Error: Source XML file not found: {full_xml_path}")
+        print(f"Error: Source XML file not found: {os.path.join(xml_dir, source_filename)}")
         return 1
     except IOError as e:
-        print(f"Error reading source XML file {full_xml_path}: {e}")
+        print(f"Error reading source XML file {source_filename}: {e}")
         return 1
 
     if DEBUG: start_time = timer()
@@ -194,6 +237,7 @@ def send_generic(source_filename, source_type):
 
     try:
         # Make the POST request
+        sent_at = time.time() # For end-to-end latency tracking, see libs/correlation.py
         k_response = requests.post(req_url, data=input_xml, headers=headers, cert=("certs/cert.pem", "certs/key_nopass.pem"), timeout=30)
 
         if DEBUG:
@@ -204,27 +248,18 @@ def send_generic(source_filename, source_type):
         # Decode response content, replacing errors if any
         response_content = k_response.content.decode("utf-8", errors="replace")
 
-        # Log the response
-        log_file_path = os.path.join(log_dir, 'resp_' + source_filename)
+        # Log the response once, as FAIL_resp_ if it is a failure ("BA01" is the success
+        # indicator for soapreq.py, "Unavailable" a service outage), in the configured layout
+        failed = "BA01" not in response_content or "Unavailable" in response_content
+        log_name = ('FAIL_resp_' if failed else 'resp_') + source_filename
         try:
-            with open(log_file_path, 'w') as db_log:
-                db_log.write(response_content)
+            xmllayout.write_log(log_dir, log_name, response_content)
         except IOError as e:
-            print(f"Warning: Error writing to log file {log_file_path}: {e}")
+            print(f"Warning: Error writing to log file {log_name}: {e}")
             # Continue processing even if log writing fails, but notify user.
 
         # --- Response Content Checking (currently based on soapreq.py logic) ---
-        if "BA01" not in response_content: # "BA01" is a success indicator for soapreq.py
-            fail_log_path = os.path.join(log_dir, 'FAIL_resp_' + source_filename)
-            try:
-                if os.path.exists(log_file_path): # If original log was written
-                    shutil.move(log_file_path, fail_log_path)
-                else: # If original log failed, write a new fail log
-                    with open(fail_log_path, 'w') as db_fail_log:
-                        db_fail_log.write(response_content + "\n\nFailure: BA01 not in response.")
-            except Exception as e_move: # Catch errors during move/write of fail log
-                print(f"Warning: Error handling fail log for {fail_log_path}: {e_move}")
-
+        if "BA01" not in response_content:
             # Try to find a specific error code in the response
             reason_match = re.search(r'(?<=ErrorCode\>)(.*)(?=\<\/urn:ErrorCode)', response_content)
             if reason_match:
@@ -238,40 +273,34 @@ def send_generic(source_filename, source_type):
         elif "Unavailable" in response_content: # Check for service unavailability
             print(f'\nDatahub backend not available for {source_filename}, please try later again!')
             print('Possible reason: blocked by firewall')
-            fail_log_path = os.path.join(log_dir, 'FAIL_resp_' + source_filename)
-            if os.path.exists(log_file_path): shutil.move(log_file_path, fail_log_path) # Also log this as failure
             return 1 # Indicate failure
         else:
             # Request was successful
             Printer(f"*** {source_filename} sent succesfully.")
-            done_xml_path = os.path.join(xml_path, 'DONE_' + source_filename)
+            record_sent(input_xml, source_filename, sent_at)
             try:
-                # Ensure source_xml_file is closed by 'with open' before moving.
-                shutil.move(full_xml_path, done_xml_path)
+                # DONE_ rename, or the sent list of the segment in the segments layout
+                xmllayout.mark_sent(xml_dir, source_filename)
             except Exception as e_move_xml:
-                 print(f"Warning: Error moving original XML {full_xml_path} to {done_xml_path}: {e_move_xml}")
+                 print(f"Warning: Error marking original XML {source_filename} as DONE_: {e_move_xml}")
                  # Decide if this is a failure of send_generic or just a cleanup issue.
                  # For now, consider the send successful if response was OK.
             return 0 # Indicate success
 
     except requests.exceptions.RequestException as e: # Handle network/request-level errors
         print(f"\nERROR: Request failed for {source_filename}: {e}")
-        fail_log_path = os.path.join(log_dir, 'FAIL_resp_' + source_filename)
         try: # Attempt to log the exception
-            with open(fail_log_path, 'w') as db_fail_log:
-                db_fail_log.write(f"RequestException: {e}\nURL: {req_url}")
+            xmllayout.write_log(log_dir, 'FAIL_resp_' + source_filename, f"RequestException: {e}\nURL: {req_url}")
         except IOError as ioe:
-            print(f"Warning: Could not write to fail log {fail_log_path}: {ioe}")
+            print(f"Warning: Could not write to fail log FAIL_resp_{source_filename}: {ioe}")
         return 1 # Indicate failure
     except Exception as e_generic: # Catch any other unexpected errors
         print(f"\nUNEXPECTED ERROR during send_generic for {source_filename}: {e_generic}")
         # Attempt to log the generic error as well
-        fail_log_path = os.path.join(log_dir, 'FAIL_resp_' + source_filename)
         try:
-            with open(fail_log_path, 'w') as db_fail_log:
-                db_fail_log.write(f"Unexpected Exception: {e_generic}\nURL: {req_url}")
+            xmllayout.write_log(log_dir, 'FAIL_resp_' + source_filename, f"Unexpected Exception: {e_generic}\nURL: {req_url}")
         except IOError as ioe:
-            print(f"Warning: Could not write to fail log {fail_log_path}: {ioe}")
+            print(f"Warning: Could not write to fail log FAIL_resp_{source_filename}: {ioe}")
         return 1 # Indicate failure
 
 # Example for future extension if specific response checks are needed:
@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Segment files of the "segments" xml_layout.
+
+Instead of one file per document the generators append documents to a few
+large segment files, xml/<type>-<time>-<pid>-<n>.seg (e.g. kulutus-...),
+and the responses of the senders go to log/resp-<time>-<pid>-<n>.seg.
+Every process writes its own segments, a new one after SEGMENT_SIZE bytes.
+A document is a length-prefixed record:
+
+    MAGIC (4 bytes) | name length (2) | document length (8) | name | document
+
+big-endian, UTF-8. When a writer closes a segment it writes the index
+<segment>.idx (offset, length and name per line); a segment without an
+index (a crashed run) is indexed by walking its record headers, and an
+unfinished last record is ignored. Sending a document appends its name to
+<segment>.done instead of renaming a file, and listings report it as
+DONE_<name>.
+
+    python3 -m libs.segments list xml/          # segments and their counts
+    python3 -m libs.segments cat xml/ <name>    # one document to stdout
+"""
+
+import atexit
+import contextlib
+import glob
+import os
+import struct
+import sys
+import threading
+import time
+
+MAGIC = b'MSG1'
+HEADER = struct.Struct('>4sHQ')
+UNFINISHED = 0xFFFFFFFFFFFFFFFF # Document length of a record still being written
+SEGMENT_SIZE = 256 * 1024 * 1024
+SUFFIX = '.seg'
+
+_writers = {} # (directory, kind) -> SegmentWriter of this process
+_writers_lock = threading.Lock()
+if hasattr(os, 'register_at_fork'): # Forked workers (kpgen -p) open their own segments
+    os.register_at_fork(after_in_child=_writers.clear)
+
+
+class _Document:
+    """Write end of one record, takes str (encoded as UTF-8) or bytes."""
+
+    def __init__(self, f):
+        self.f = f
+        self.length = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.f.write(data)
+        self.length += len(data)
+        return len(data)
+
+
+class SegmentWriter:
+    """
+    Appends the documents of one process and kind to its segment files.
+    """
+
+    def __init__(self, directory, kind):
+        self.directory = directory
+        self.kind = kind
+        self.f = None
+        self.path = None
+        self.index = [] # (offset, length, name) of the open segment
+        self.lock = threading.Lock() # Threaded senders share the log writer
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        sequence = 0
+        while True: # A segment is never reopened, later writers of the process count past it
+            sequence += 1
+            self.path = os.path.join(self.directory, f"{self.kind}-{time.strftime('%Y%m%d%H%M%S')}-"
+                                                     f"{os.getpid()}-{sequence}{SUFFIX}")
+            try:
+                self.f = open(self.path, 'xb')
+                break
+            except FileExistsError:
+                continue
+        self.index = []
+
+    @contextlib.contextmanager
+    def document(self, name):
+        """
+        Yields a file-like writer of a new document. The record is completed
+        when the block ends and discarded if it raises.
+        """
+        with self.lock:
+            if self.f is None:
+                self._open()
+            raw_name = name.encode('utf-8')
+            start = self.f.tell()
+            self.f.write(HEADER.pack(MAGIC, len(raw_name), UNFINISHED) + raw_name)
+            document = _Document(self.f)
+            try:
+                yield document
+            except BaseException:
+                self.f.seek(start)
+                self.f.truncate()
+                raise
+            end = self.f.tell()
+            self.f.seek(start)
+            self.f.write(HEADER.pack(MAGIC, len(raw_name), document.length))
+            self.f.seek(end)
+            self.f.flush() # Readable by the senders at once, no fsync
+            self.index.append((start + HEADER.size + len(raw_name), document.length, name))
+            if end >= SEGMENT_SIZE:
+                self._close_segment()
+
+    def add(self, name, data):
+        with self.document(name) as document:
+            document.write(data)
+
+    def _close_segment(self):
+        if self.f is None:
+            return
+        self.f.close()
+        tmp_path = self.path + '.idx.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(f"{offset}\t{length}\t{name}\n" for offset, length, name in self.index)
+        os.replace(tmp_path, self.path + '.idx')
+        self.f = None
+
+    def close(self):
+        with self.lock:
+            self._close_segment()
+
+
+def writer(directory, kind):
+    """Output: the SegmentWriter of this process for directory and kind"""
+    key = (directory, kind)
+    with _writers_lock:
+        if key not in _writers:
+            _writers[key] = SegmentWriter(directory, kind)
+        return _writers[key]
+
+
+@atexit.register
+def close_all():
+    """Closes the segments of this process, writing their indexes."""
+    with _writers_lock:
+        for segment_writer in _writers.values():
+            segment_writer.close()
+        _writers.clear()
+
+
+def segment_paths(directory, kind=None):
+    """Output: sorted (i.e. oldest first per kind) segment paths of a directory"""
+    pattern = (glob.escape(kind) + '-*' if kind else '*') + SUFFIX
+    return sorted(glob.glob(os.path.join(glob.escape(directory), pattern)))
+
+
+def read_index(path):
+    """Output: list of (offset, length, name) of a segment"""
+    index_path = path + '.idx'
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            return [(int(offset), int(length), name)
+                    for offset, length, name in (line.rstrip('\n').split('\t', 2) for line in f)]
+    index = [] # No index yet (open or crashed writer): walk the record headers
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                break
+            magic, name_length, length = HEADER.unpack(header)
+            if magic != MAGIC or length == UNFINISHED:
+                break
+            name = f.read(name_length).decode('utf-8')
+            offset = f.tell()
+            if offset + length > size:
+                break
+            index.append((offset, length, name))
+            f.seek(length, os.SEEK_CUR)
+    return index
+
+
+def read(path, offset, length):
+    """Output: document text"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length).decode('utf-8')
+
+
+def sent(path):
+    """Output: set of the names sent from a segment"""
+    try:
+        with open(path + '.done', 'r', encoding='utf-8') as f:
+            return {line.rstrip('\n') for line in f}
+    except FileNotFoundError:
+        return set()
+
+
+_done_lock = threading.Lock()
+
+def mark_sent(path, name):
+    """Records a document of a segment as sent."""
+    with _done_lock:
+        with open(path + '.done', 'a', encoding='utf-8') as f:
+            f.write(name + '\n')
+
+
+if __name__ == "__main__":
+    usage = "Usage: python3 -m libs.segments list <directory> | cat <directory> <name>"
+    if len(sys.argv) == 3 and sys.argv[1] == 'list':
+        for path in segment_paths(sys.argv[2]):
+            print(f"{os.path.basename(path)}\t{len(read_index(path))} documents\t"
+                  f"{len(sent(path))} sent\t{os.path.getsize(path) // 1024} kB")
+    elif len(sys.argv) == 4 and sys.argv[1] == 'cat':
+        for path in reversed(segment_paths(sys.argv[2])): # The newest copy of the name
+            for offset, length, name in read_index(path):
+                if name == sys.argv[3]:
+                    sys.stdout.write(read(path, offset, length))
+                    sys.exit(0)
+        print(f"{sys.argv[3]} not found in {sys.argv[2]}")
+        sys.exit(1)
+    else:
+        print(usage)
+        sys.exit(2)
@@ -0,0 +1,254 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Compressed storage of kulugen readings in fingrid.db.
+
+With db_storage = "series" in fconfig.py kulugen does not write one apoint
+or rpoint row per reading. It keeps one apoint_series / rpoint_series row per
+point and UTC month instead. The readings of the chunk are encoded as
+fixed-point integers (Wh), time and value deltas are zigzag varints, and the
+stream is zlib compressed:
+
+    version byte | zlib( count | first minute | minute deltas | first Wh | Wh deltas )
+
+Hourly series have constant time deltas and slowly changing values, so a
+month of a point takes a few hundred bytes instead of ~100 kB of rows.
+Readers use SeriesStore.readings(), which decodes the chunks and yields the
+same columns as the row tables. expand() writes the rows back into
+apoint/rpoint for tools that query the row tables, compact() converts an
+existing row database:
+
+    python3 -m libs.seriesstore compact fingrid.db
+    python3 -m libs.seriesstore expand fingrid.db
+"""
+
+import calendar
+import itertools
+import sqlite3
+import sys
+import time
+import zlib
+
+VERSION = 1
+KINDS = ('apoint', 'rpoint')
+# Stored per chunk besides the readings; the rest of the row table columns are per reading
+ATTRIBUTES = {
+    'apoint': ('METERINGPOINT', 'DSO', 'MGA', 'SUPPLIER', 'AP_TYPE', 'REMOTE_READ', 'METHOD', 'RESOLUTION'),
+    'rpoint': ('DSO', 'R_IN', 'R_OUT', 'RESOLUTION'),
+}
+ID_COLUMN = {'apoint': 'APOINT_ID', 'rpoint': 'RPOINT_ID'}
+EXPAND_BATCH = 100000 # Rows decoded and inserted at a time by expand()
+
+
+def to_epoch(timestamp):
+    """UTC 'YYYY-MM-DD HH:MM:SS' -> epoch seconds"""
+    return calendar.timegm((int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                            int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19])))
+
+
+def to_timestamp(epoch):
+    """epoch seconds -> UTC 'YYYY-MM-DD HH:MM:SS'"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(epoch))
+
+
+def _put_varints(out, numbers):
+    for n in numbers:
+        n = n * 2 if n >= 0 else -n * 2 - 1 # zigzag
+        while n > 0x7F:
+            out.append(n & 0x7F | 0x80)
+            n >>= 7
+        out.append(n)
+
+
+def _get_varints(data, count, pos):
+    numbers = []
+    for _ in range(count):
+        n = shift = 0
+        while True:
+            byte = data[pos]
+            pos += 1
+            n |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        numbers.append(n >> 1 if not n & 1 else -(n >> 1) - 1)
+    return numbers, pos
+
+
+def _deltas(values):
+    return [values[0]] + [b - a for a, b in zip(values, values[1:])]
+
+
+def _running(deltas):
+    values, total = [], 0
+    for d in deltas:
+        total += d
+        values.append(total)
+    return values
+
+
+def encode(readings):
+    """
+    Input: readings [(epoch seconds, kWh)] sorted by time
+    Output: encoded bytes. Values are stored to the Wh, as kulugen rounds them to 3 decimals.
+    """
+    out = bytearray()
+    _put_varints(out, [len(readings)])
+    _put_varints(out, _deltas([epoch // 60 for epoch, _ in readings]))
+    _put_varints(out, _deltas([int(round(kwh * 1000)) for _, kwh in readings]))
+    return bytes([VERSION]) + zlib.compress(bytes(out))
+
+
+def decode(blob):
+    """Output: readings [(epoch seconds, kWh)] of an encode()d chunk"""
+    if not blob:
+        return []
+    if blob[0] != VERSION:
+        raise ValueError(f"Unknown series encoding version {blob[0]}.")
+    data = zlib.decompress(blob[1:])
+    (count,), pos = _get_varints(data, 1, 0)
+    if not count:
+        return []
+    minutes, pos = _get_varints(data, count, pos)
+    watt_hours, _ = _get_varints(data, count, pos)
+    return [(minute * 60, wh / 1000.0) for minute, wh in zip(_running(minutes), _running(watt_hours))]
+
+
+class SeriesStore:
+    """
+    Chunked, compressed apoint/rpoint readings in an open fingrid.db connection.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def ensure_tables(self):
+        for kind in KINDS:
+            attributes = ''.join(f"            {column} TEXT,\n" for column in ATTRIBUTES[kind])
+            self.conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {kind}_series (
+            {ID_COLUMN[kind]} TEXT NOT NULL,
+            MONTH TEXT NOT NULL, /* UTC YYYY-MM of the readings */
+            FIRST_TS TEXT NOT NULL,
+            LAST_TS TEXT NOT NULL,
+            READINGS INTEGER NOT NULL,
+{attributes}            DATA BLOB NOT NULL,
+            PRIMARY KEY({ID_COLUMN[kind]}, MONTH)
+            )""")
+
+    def insert(self, kind, point_id, attributes, readings):
+        """
+        Input: point kind, point ID, {column: value} of ATTRIBUTES[kind],
+               readings [(UTC DB timestamp, kWh)]
+        Merges the readings into the point's monthly chunks. Readings already
+        stored are kept, like INSERT OR IGNORE on the row tables.
+        Output: amount of new readings
+        """
+        id_column = ID_COLUMN[kind]
+        months = {}
+        for timestamp, kwh in readings:
+            months.setdefault(timestamp[:7], []).append((to_epoch(timestamp), kwh))
+
+        columns = (id_column, 'MONTH', 'FIRST_TS', 'LAST_TS', 'READINGS') + ATTRIBUTES[kind] + ('DATA',)
+        sql = (f"INSERT OR REPLACE INTO {kind}_series ({', '.join(columns)}) "
+               f"VALUES ({', '.join('?' * len(columns))})")
+        inserted = 0
+        for month, new in months.items():
+            row = self.conn.execute(f"SELECT DATA FROM {kind}_series WHERE {id_column} = ? AND MONTH = ?",
+                                    (point_id, month)).fetchone()
+            stored = dict(decode(row[0])) if row is not None else {}
+            inserted += sum(1 for epoch, _ in new if epoch not in stored)
+            merged = dict(new)
+            merged.update(stored) # Stored readings win
+            chunk = sorted(merged.items())
+            self.conn.execute(sql, (point_id, month, to_timestamp(chunk[0][0]), to_timestamp(chunk[-1][0]), len(chunk))
+                              + tuple(attributes.get(column) for column in ATTRIBUTES[kind]) + (encode(chunk),))
+        return inserted
+
+    def covered_periods(self, kind, point_ids=None):
+        """Output: {point ID: (first, last) DB timestamp}, optionally only of point_ids"""
+        id_column = ID_COLUMN[kind]
+        where = f" WHERE {id_column} IN ({', '.join('?' * len(point_ids))})" if point_ids is not None else ""
+        rows = self.conn.execute(f"SELECT {id_column}, MIN(FIRST_TS), MAX(LAST_TS) FROM {kind}_series{where} "
+                                 f"GROUP BY {id_column}", list(point_ids or ()))
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    def readings(self, kind, point_id=None, start=None, end=None):
+        """
+        Yields the stored readings as dicts with the row table's columns
+        (ID column, TIMESTAMP, KULUTUS and the attributes), optionally of one
+        point and within [start, end) UTC DB timestamps, in point and time order.
+        """
+        id_column = ID_COLUMN[kind]
+        where, params = [], []
+        if point_id is not None:
+            where.append(f"{id_column} = ?")
+            params.append(point_id)
+        if start is not None:
+            where.append("LAST_TS >= ?")
+            params.append(start)
+        if end is not None:
+            where.append("FIRST_TS < ?")
+            params.append(end)
+        columns = (id_column,) + ATTRIBUTES[kind]
+        query = (f"SELECT {', '.join(columns)}, DATA FROM {kind}_series"
+                 + (" WHERE " + " AND ".join(where) if where else "") + f" ORDER BY {id_column}, MONTH")
+        for row in self.conn.execute(query, params):
+            base = dict(zip(columns, row[:-1]))
+            for epoch, kwh in decode(row[-1]):
+                timestamp = to_timestamp(epoch)
+                if (start is None or timestamp >= start) and (end is None or timestamp < end):
+                    yield dict(base, TIMESTAMP=timestamp, KULUTUS=kwh)
+
+    def compact(self, kind):
+        """Moves the rows of the kind's row table into chunks. Output: amount of readings moved"""
+        id_column = ID_COLUMN[kind]
+        columns = (id_column, 'TIMESTAMP', 'KULUTUS') + ATTRIBUTES[kind]
+        moved = 0
+        point_ids = [row[0] for row in self.conn.execute(f"SELECT DISTINCT {id_column} FROM {kind}")]
+        for point_id in point_ids:
+            rows = self.conn.execute(f"SELECT {', '.join(columns)} FROM {kind} WHERE {id_column} = ? ORDER BY TIMESTAMP",
+                                     (point_id,)).fetchall()
+            attributes = dict(zip(ATTRIBUTES[kind], rows[-1][3:]))
+            moved += self.insert(kind, point_id, attributes, [(row[1], row[2]) for row in rows])
+            self.conn.execute(f"DELETE FROM {kind} WHERE {id_column} = ?", (point_id,))
+        return moved
+
+    def expand(self, kind, session_ids):
+        """
+        Writes the chunks back as rows of the kind's row table, EXPAND_BATCH
+        rows at a time, so memory use does not grow with the database.
+        Input: callable returning n session IDs. Output: amount of rows inserted
+        """
+        id_column = ID_COLUMN[kind]
+        columns = ('SESSION_ID', id_column, 'TIMESTAMP', 'KULUTUS') + ATTRIBUTES[kind]
+        sql = f"INSERT OR IGNORE INTO {kind} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        rows = (tuple(reading[column] for column in columns[1:]) for reading in self.readings(kind))
+        before = self.conn.total_changes
+        while True:
+            batch = list(itertools.islice(rows, EXPAND_BATCH))
+            if not batch:
+                break
+            self.conn.executemany(sql, [(sid,) + row for sid, row in zip(session_ids(len(batch)), batch)])
+        return self.conn.total_changes - before
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ('compact', 'expand'):
+        print("Usage: python3 -m libs.seriesstore compact|expand <fingrid.db>")
+        sys.exit(2)
+    action, db_path = sys.argv[1:]
+    from libs.kirjasto import id_source
+    conn = sqlite3.connect(db_path)
+    store = SeriesStore(conn)
+    store.ensure_tables()
+    for kind in KINDS:
+        if action == 'compact':
+            count = store.compact(kind)
+        else:
+            count = store.expand(kind, id_source(32).bulk)
+        print(f"{kind}: {count} reading(s)")
+    conn.commit()
+    if action == 'compact':
+        conn.execute("VACUUM")
+    conn.close()
@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Precomputed UTC time axis of a kulugen run.
+
+The generation period is given in Finnish wall time (start date, start time,
+days). The axis converts it once to UTC with the Europe/Helsinki rules, so
+DST days have 23 or 25 hours, and keeps every point as epoch seconds in an
+integer array. The formatted strings the DB, XML and filename stages need
+are built once per run from per-day and time-of-day caches; the generation
+loop only indexes them. profile_keys holds the local month and hour of
+week of every point for the load profile tables (libs/loadprofile.py).
+"""
+
+import datetime
+from array import array
+
+import pytz
+
+LOCAL_TZ = pytz.timezone("Europe/Helsinki")
+_EPOCH = datetime.datetime(1970, 1, 1)
+_DAY = 86400
+
+
+def _utc_epoch(aware_dt):
+    return int((aware_dt.astimezone(pytz.utc).replace(tzinfo=None) - _EPOCH).total_seconds())
+
+
+def localize(local_dt, tz=LOCAL_TZ):
+    """
+    Input: naive wall time datetime
+    Output: aware datetime. A wall time skipped by the spring DST change is
+    moved forward, an ambiguous autumn time is taken as the later (standard) one.
+    """
+    try:
+        return tz.localize(local_dt, is_dst=None)
+    except pytz.NonExistentTimeError:
+        return tz.normalize(tz.localize(local_dt, is_dst=False))
+    except pytz.AmbiguousTimeError:
+        return tz.localize(local_dt, is_dst=False)
+
+
+class TimeAxis:
+    """
+    Consecutive UTC points start, start + step, ... with cached strings:
+    db_timestamps 'YYYY-MM-DD HH:MM:SS' (UTC, sortable), iso_timestamps
+    'YYYY-MM-DDTHH:MM:SSZ' and local_days 'DD-MM-YYYY' (Helsinki date of
+    the point, for file names and daily and monthly reads).
+    """
+
+    def __init__(self, start_epoch, count, step_minutes, tz=LOCAL_TZ):
+        if count < 0 or step_minutes <= 0 or _DAY % (step_minutes * 60):
+            raise ValueError("Time axis step must divide a day and the point count must not be negative.")
+        self.step = step_minutes * 60
+        self.tz = tz
+        self.epochs = array('q', range(start_epoch, start_epoch + count * self.step, self.step))
+
+        utc_days = {}
+        times_of_day = {}
+        local_hours = {}
+        db_timestamps = []
+        iso_timestamps = []
+        self.local_days = []
+        self.profile_keys = array('H')
+        for epoch in self.epochs:
+            day, second = divmod(epoch, _DAY)
+            if day not in utc_days:
+                utc_days[day] = (_EPOCH + datetime.timedelta(days=day)).strftime("%Y-%m-%d")
+            if second not in times_of_day:
+                times_of_day[second] = "%02d:%02d:%02d" % (second // 3600, second // 60 % 60, second % 60)
+            date_str, time_str = utc_days[day], times_of_day[second]
+            db_timestamps.append(f"{date_str} {time_str}")
+            iso_timestamps.append(f"{date_str}T{time_str}Z")
+            # The UTC offset only changes at full hours, cache the local values per UTC hour
+            hour = epoch // 3600
+            if hour not in local_hours:
+                local_dt = pytz.utc.localize(_EPOCH + datetime.timedelta(seconds=hour * 3600)).astimezone(tz)
+                local_hours[hour] = (local_dt.strftime("%d-%m-%Y"),
+                                     (local_dt.month - 1) * 168 + local_dt.weekday() * 24 + local_dt.hour)
+            local_day, profile_key = local_hours[hour]
+            self.local_days.append(local_day)
+            self.profile_keys.append(profile_key)
+        self.db_timestamps = db_timestamps
+        self.iso_timestamps = iso_timestamps
+
+    @classmethod
+    def for_local_period(cls, start_date, start_time, num_days, hours_per_day, step_minutes, tz=LOCAL_TZ):
+        """
+        Input: first local date (datetime.date), local start time 'HH:MM',
+               amount of days, hours per day, step in minutes
+        Output: TimeAxis. With 24 hours per day the period ends at the same
+        wall time num_days calendar days later, so DST days get 23/25 hours.
+        Otherwise num_days * hours_per_day elapsed hours are generated.
+        """
+        hour, minute = map(int, start_time.split(':'))
+        local_start = datetime.datetime.combine(start_date, datetime.time(hour, minute))
+        start_epoch = _utc_epoch(localize(local_start, tz))
+        if hours_per_day == 24:
+            end_epoch = _utc_epoch(localize(local_start + datetime.timedelta(days=num_days), tz))
+        else:
+            end_epoch = start_epoch + num_days * hours_per_day * 3600
+        axis = cls(start_epoch, (end_epoch - start_epoch) // (step_minutes * 60), step_minutes, tz)
+        axis.start_date = start_date
+        axis.num_days = num_days
+        return axis
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def iso_end(self, end):
+        """Output: ISO time of the end of point end - 1, i.e. the exclusive period end."""
+        epoch = self.epochs[end - 1] + self.step
+        return (_EPOCH + datetime.timedelta(seconds=epoch)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def db_end(self, end):
+        """Output: DB timestamp of the exclusive period end, for TIMESTAMP < end queries."""
+        return self.iso_end(end).replace('T', ' ').rstrip('Z')
+
+    def day_end(self, index):
+        """Output: first index after index on another local day"""
+        local_days = self.local_days
+        day = local_days[index]
+        index += 1
+        while index < len(local_days) and local_days[index] == day:
+            index += 1
+        return index
+
+    def day_start(self, index):
+        """Output: first index of the local day of index"""
+        local_days = self.local_days
+        day = local_days[index]
+        while index > 0 and local_days[index - 1] == day:
+            index -= 1
+        return index
+
+    def month_end(self, index):
+        """Output: first index after index in another local month"""
+        local_days = self.local_days
+        month = local_days[index][3:]
+        index = self.day_end(index)
+        while index < len(local_days) and local_days[index][3:] == month:
+            index = self.day_end(index)
+        return index
+
+    def month_start(self, index):
+        """Output: first index of the local month of index"""
+        local_days = self.local_days
+        month = local_days[index][3:]
+        index = self.day_start(index)
+        while index > 0 and local_days[index - 1][3:] == month:
+            index = self.day_start(index - 1)
+        return index
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Run workspaces.
+
+By default every tool keeps its run data in the current directory: kp.csv,
+xml/, log/, peeks/, columnar/, fingrid.db and the other databases. With
+--workspace <dir> (or the MASI_WORKSPACE environment variable) kpgen,
+sopimusgen, kulugen, soapreq, datareq and putsi keep it under <dir>
+instead, so several simulations can run on one host at the same time and
+a run is cleaned up by removing its directory:
+
+    python3 kpgen.py --workspace runs/env1 -j ... -m ... -l 100000 ...
+    python3 kulugen.py --workspace runs/env1 -s 01.01.2025 -d 31
+    MASI_WORKSPACE=runs/env1 python3 soapreq.py
+
+Shared resources stay where they are: libs/ (templates, fconfig.py), certs/
+and ap_ranges.json, which keeps the AP ID ranges of all workspaces so that
+parallel runs never generate the same accounting point. rp.csv is read from
+the workspace if it has one, otherwise the shared rp.csv is used.
+
+A workspace gets a MARKER file; clean.sh/clean.bat <dir> remove only
+directories that have it.
+"""
+
+import os
+
+ENV_VAR = 'MASI_WORKSPACE'
+OPTION = '--workspace'
+MARKER = '.masi_workspace' # Lets the clean scripts tell a workspace from any other directory
+
+
+def root():
+    """Output: workspace directory of the run, '' when none is selected"""
+    return os.environ.get(ENV_VAR, '')
+
+
+def _create(directory):
+    """Creates the workspace directory and its MARKER."""
+    os.makedirs(directory, exist_ok=True)
+    marker = os.path.join(directory, MARKER)
+    if not os.path.exists(marker):
+        with open(marker, 'w', encoding='utf-8') as f:
+            f.write("MaSi run workspace, removed as a whole by clean.sh/clean.bat\n")
+
+
+def select(directory):
+    """Selects (and creates) the workspace of this process and its children."""
+    if directory:
+        _create(directory)
+    os.environ[ENV_VAR] = directory or ''
+
+
+def path(*parts):
+    """Output: path of run data inside the workspace"""
+    return os.path.join(root(), *parts)
+
+
+def input_path(name):
+    """Output: the workspace's own copy of an input file if it exists, else the shared one"""
+    own = path(name)
+    return own if root() and os.path.exists(own) else name
+
+
+def from_argv(argv):
+    """
+    Selects the workspace given as '--workspace <dir>' or '--workspace=<dir>'
+    and removes the option, so the tools parse the rest as before.
+    Input: argument list without the program name
+    Output: remaining arguments
+    """
+    rest = []
+    args = iter(argv)
+    for arg in args:
+        if arg == OPTION:
+            directory = next(args, None)
+            if not directory:
+                raise ValueError(f"{OPTION} needs a directory.")
+            select(directory)
+        elif arg.startswith(OPTION + '='):
+            select(arg[len(OPTION) + 1:])
+        else:
+            rest.append(arg)
+    if root(): # Selected by MASI_WORKSPACE
+        _create(root())
+    return rest
@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Layout of the xml/ and log/ documents.
+
+With xml_layout = "flat" (fconfig.py, default) every file is directly in
+xml/ and log/, as before. With "sharded" the generators write a file into
+a subdirectory by document type and two hex levels of the MD5 of its name:
+
+    xml/kulutus/3f/a2/kulutus_642702010012345678_01012025.xml
+    log/kulutus/3f/a2/resp_kulutus_642702010012345678_01012025.xml
+
+so no directory holds more than 256 entries below the type level until
+there are tens of millions of files. A sent file is renamed DONE_ in its
+own shard directory and its response goes to the matching shard of log/.
+With "segments" no per-document files are made at all: documents and
+responses are appended to large segment files, see libs/segments.py.
+
+The generators write with create(), the senders use read(), mark_sent()
+and write_log(), which understand every layout whatever the setting, and
+names() lists flat files, the type's shard tree and the segments. Removing
+xml/ and log/ cleans any layout.
+"""
+
+import contextlib
+import hashlib
+import os
+import shutil
+import threading
+
+from libs import segments
+
+LAYOUTS = ('flat', 'sharded', 'segments')
+DONE_PREFIX = 'DONE_'
+LOG_PREFIXES = ('FAIL_resp_', 'resp_') # Longest first
+LOG_KIND = 'resp' # Segment kind of the responses in log/
+
+_created = set() # Shard directories already created by this process
+_catalogs = {} # (directory, type) -> {name: (segment path, offset, length)}, see _segment_entry()
+_catalogs_lock = threading.Lock()
+
+
+def configured():
+    """Output: xml_layout of fconfig.py, 'flat' if not set"""
+    try: # Optional, older fconfig.py files do not have it
+        from libs.fconfig import xml_layout
+    except ImportError:
+        xml_layout = 'flat'
+    if xml_layout not in LAYOUTS:
+        raise ValueError(f"xml_layout must be one of {', '.join(LAYOUTS)}, not '{xml_layout}'")
+    return xml_layout
+
+
+def base_name(name):
+    """Output: file name without the DONE_ and log prefixes, the key of its shard"""
+    for prefix in LOG_PREFIXES:
+        if name.startswith(prefix):
+            name = name[len(prefix):]
+            break
+    if name.startswith(DONE_PREFIX):
+        name = name[len(DONE_PREFIX):]
+    return name
+
+
+def shard_dir(directory, name):
+    """Output: shard directory of a file name, e.g. xml/kulutus/3f/a2"""
+    name = base_name(name)
+    digest = hashlib.md5(name.encode('utf-8')).hexdigest()
+    return os.path.join(directory, name.split('_', 1)[0], digest[0:2], digest[2:4])
+
+
+def doc_type(name):
+    """Output: document type of a file name, e.g. 'kulutus'"""
+    return base_name(name).split('_', 1)[0]
+
+
+def path_for(directory, name, layout=None):
+    """
+    Output: path where a new file is written in the layout (default the
+    configured one). The shard directory is created on first use. In the
+    segments layout the name in the directory, for messages only.
+    """
+    if (layout or configured()) in ('flat', 'segments'):
+        return os.path.join(directory, name)
+    shard = shard_dir(directory, name)
+    if shard not in _created:
+        os.makedirs(shard, exist_ok=True)
+        _created.add(shard)
+    return os.path.join(shard, name)
+
+
+@contextlib.contextmanager
+def create(directory, name, layout=None):
+    """
+    Yields a text writer of a new document in the layout (default the
+    configured one): a file, or a record of this process's segment.
+    """
+    layout = layout or configured()
+    if layout == 'segments':
+        with segments.writer(directory, doc_type(name)).document(name) as document:
+            yield document
+    else:
+        with open(path_for(directory, name, layout), 'w', encoding='utf-8', errors='xmlcharrefreplace') as f:
+            yield f
+
+
+def write_log(directory, name, content, layout=None):
+    """Writes a response (resp_/FAIL_resp_ name) to log/ in the layout (default the configured one)."""
+    layout = layout or configured()
+    if layout == 'segments':
+        segments.writer(directory, LOG_KIND).add(name, content)
+    else:
+        with open(path_for(directory, name, layout), 'w') as f:
+            f.write(content)
+
+
+def _segment_entry(directory, name):
+    """Output: (segment path, offset, length) of the newest document of the name, None if none"""
+    key = (directory, doc_type(name))
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None or name not in catalog: # Segments written since the last look
+            catalog = {}
+            for path in segments.segment_paths(directory, key[1]):
+                for offset, length, entry_name in segments.read_index(path):
+                    catalog[entry_name] = (path, offset, length)
+            _catalogs[key] = catalog
+        return catalog.get(name)
+
+
+def find(directory, name):
+    """Output: path of an existing file in either file layout, the flat path if there is none"""
+    sharded = os.path.join(shard_dir(directory, name), name)
+    return sharded if os.path.exists(sharded) else os.path.join(directory, name)
+
+
+def exists(directory, name):
+    """True if the document is a file of either file layout or in a segment"""
+    return os.path.exists(find(directory, name)) or _segment_entry(directory, name) is not None
+
+
+def read(directory, name):
+    """Output: document text from any layout. Raises FileNotFoundError."""
+    path = find(directory, name)
+    if not os.path.exists(path):
+        entry = _segment_entry(directory, name)
+        if entry is not None:
+            return segments.read(*entry)
+    with open(path, 'r') as f:
+        return f.read()
+
+
+def mark_sent(directory, name):
+    """Marks a sent document: DONE_ rename of the file, or the .done list of its segment."""
+    path = find(directory, name)
+    if not os.path.exists(path):
+        entry = _segment_entry(directory, name)
+        if entry is not None:
+            segments.mark_sent(entry[0], name)
+            return
+    shutil.move(path, os.path.join(os.path.dirname(path), DONE_PREFIX + name))
+
+
+def entries(directory, prefix):
+    """
+    Yields (name, mtime) of the documents whose name starts with prefix
+    (e.g. 'kulutus_' or 'DONE_sopimus_'): the flat files, the shard tree of
+    the prefix's type and the segments of the type, where sent documents
+    are reported as DONE_<name>.
+    """
+    if not os.path.isdir(directory):
+        return
+    with os.scandir(directory) as dir_entries:
+        for entry in dir_entries:
+            if entry.name.startswith(prefix) and entry.is_file():
+                yield entry.name, entry.stat().st_mtime
+    stack = [os.path.join(directory, doc_type(prefix))]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as dir_entries:
+                for entry in dir_entries:
+                    if entry.is_dir():
+                        stack.append(entry.path)
+                    elif entry.name.startswith(prefix):
+                        yield entry.name, entry.stat().st_mtime
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+    seen = set()
+    for path in reversed(segments.segment_paths(directory, doc_type(prefix))): # Newest copy of a name first
+        done = segments.sent(path)
+        mtime = os.path.getmtime(path)
+        for _, _, name in segments.read_index(path):
+            if name in seen:
+                continue
+            seen.add(name)
+            listed = DONE_PREFIX + name if name in done else name
+            if listed.startswith(prefix):
+                yield listed, mtime
+
+
+def names(directory, prefix):
+    """Output: sorted names of the documents whose name starts with prefix"""
+    return sorted({name for name, _ in entries(directory, prefix)})
+
+
+def close():
+    """Completes the segments of this process (indexes), see libs/segments.py."""
+    segments.close_all()
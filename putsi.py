@@ -7,6 +7,17 @@ import sys
 import xml.etree.ElementTree as ET
 import requests
 
+try:
+    from libs.correlation import CorrelationStore
+except ImportError:
+    CorrelationStore = None
+
+try:
+    from libs import workspace
+except ImportError:
+    print('Error: libs/workspace.py missing from libs directory. putsi.py cannot function.')
+    sys.exit(1)
+
 # Color definitions (optional, for consistency)
 if os.name == 'posix':
     red = '\u001b[31m'
@@ -45,7 +56,10 @@ class QueueProcessor:
 
         self.output_dir = output_dir
 
-        self.stats = {'OK': 0, 'FAIL': 0, 'OTHER': 0, 'processed_total': 0}
+        self.stats = {'OK': 0, 'FAIL': 0, 'OTHER': 0, 'processed_total': 0, 'correlated': 0}
+
+        # Links peeked status messages to messages sent by req_utils.send_generic
+        self.correlation = CorrelationStore() if CorrelationStore else None
 
         # Stores details of the currently peeked message
         self.current_message_details = {'docref': None, 'process': None, 'status': None, 'raw_response': None}
@@ -160,6 +174,7 @@ class QueueProcessor:
         else:
             self.stats['OTHER'] += 1
         self.current_message_details['status'] = parsed_status
+        self._correlate_current_message()
 
         # Filename construction
         # Replace characters that are problematic in filenames
@@ -178,6 +193,21 @@ class QueueProcessor:
 
         return True # Message peeked (and saved if possible)
 
+    def _correlate_current_message(self):
+        """Matches the current message against sent messages by document reference."""
+        if self.correlation is None:
+            return
+        details = self.current_message_details
+        try:
+            matched = self.correlation.record_response(details['raw_response'], details['docref'],
+                                                       details['status'], details['process'])
+        except Exception as e:
+            print(f"{yellow}Warning: Could not correlate message {details['docref']}: {e}{reset}")
+            return
+        if matched:
+            self.stats['correlated'] += 1
+            print(f"Correlated with sent message {matched}")
+
     def dequeue_current_message(self):
         """
         Dequeues the message currently stored in self.current_message_details.
@@ -259,14 +289,28 @@ class QueueProcessor:
         print(f"  {green}OK (BA01) status: {self.stats['OK']}{reset}")
         print(f"  {red}FAIL (BA02) status: {self.stats['FAIL']}{reset}")
         print(f"  {yellow}OTHER status: {self.stats['OTHER']}{reset}")
+        print(f"Correlated to sent messages: {self.stats['correlated']}")
         print(f"{cyan}--------------------------{reset}")
 
 
 if __name__ == "__main__":
     print(f"{cyan}--- Putsi Queue Processor ---{reset}")
     try:
-        processor = QueueProcessor()
-        processor.process_queue_loop()
+        args = workspace.from_argv(sys.argv[1:])
+        if '-h' in args:
+            print('Usage: putsi.py [--workspace <dir>] [-r] [-h]')
+            print('--workspace: Keep peeks/ and correlation.db under <dir> (see libs/workspace.py).')
+            print('-r: Print end-to-end latency report per document type and unanswered messages.')
+            print('-h: This help message.')
+            sys.exit(0)
+        processor = QueueProcessor(output_dir=workspace.path('peeks/'))
+        if '-r' in args:
+            if processor.correlation is None:
+                print(f"{red}Error: libs/correlation.py missing, no report available.{reset}")
+            else:
+                processor.correlation.print_report()
+        else:
+            processor.process_queue_loop()
     except ImportError:
         # Error already printed by _load_config, main block just ensures clean exit
         print(f"{red}{bold}Critical configuration import error. Putsi cannot run.{reset}")
@@ -286,5 +330,3 @@ if __name__ == "__main__":
         sys.exit(1)
     finally:
         print(f"{cyan}--- Putsi processing finished ---{reset}")
-
-```
@@ -13,7 +13,8 @@ except ImportError:
 
 # Import shared utilities from req_utils
 try:
-    from libs.req_utils import send_generic, Printer, DEBUG as RU_DEBUG, dprint as ru_dprint, xml_path
+    from libs.req_utils import send_generic, Printer, DEBUG as RU_DEBUG, dprint as ru_dprint, workspace_xml_path
+    from libs import workspace, xmllayout
 except ImportError:
     print('Error: req_utils.py missing from libs directory. soapreq.py cannot function.')
     exit()
@@ -28,23 +29,15 @@ def dprint(*s): # Local dprint for this file's specific debug messages
         print(("[soapreq_local] ",) + s if isinstance(s, tuple) else ("[soapreq_local] ", s))
 
 
-# xml_dir still uses xml_path, which is now imported from req_utils
+# xml_dir lists the xml directory of the run workspace, as given by req_utils,
+# in the flat or the sharded layout (libs/xmllayout.py)
 def xml_dir(xml_type=None):
     # Using ru_dprint for consistency if we want req_utils to handle all dprints
     # For now, let's assume xml_dir specific debugging can use local dprint
     dprint(f'xml_dir({xml_type})')
-    xml_files = []
-    # Use os.walk directly on the imported xml_path
-    for _,_ , files in os.walk(xml_path):
-        if xml_type == 'apoint':
-            for file in files:
-                if file.startswith('apoint_'):
-                    xml_files.append(file)
-        elif xml_type == 'sopimus':
-            for file in files:
-                if file.startswith('sopimus_'):
-                    xml_files.append(file)
-    return sorted(xml_files)
+    if xml_type not in ('apoint', 'sopimus'):
+        return []
+    return xmllayout.names(workspace_xml_path(), xml_type + '_')
 
 # Printer is imported from req_utils
 # send_generic is imported from req_utils
@@ -152,6 +145,7 @@ def thread_loop(block_size):
         
 if __name__ == "__main__":
     try:
+        workspace.from_argv(sys.argv[1:])
         if thread:
             thread_loop(10)
         else:
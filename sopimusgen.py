@@ -6,7 +6,6 @@ import random as ra # Renamed random to ra for consistency with other scripts
 import csv
 import sys
 import xml.etree.ElementTree as ET
-import calendar # For hetu generation
 
 try:
     from libs.kirjasto import gen_id, gen_timestamp
@@ -14,6 +13,29 @@ except ImportError:
     print('Error: libs.kirjasto.py missing or incomplete. Please ensure it is in the libs directory.')
     sys.exit(1)
 
+try:
+    from libs.hetu import HetuGenerator
+except ImportError:
+    print('Error: libs.hetu.py missing. Please ensure it is in the libs directory.')
+    sys.exit(1)
+
+try:
+    from libs.contracts import ContractRecord
+except ImportError:
+    print('Error: libs.contracts.py missing. Please ensure it is in the libs directory.')
+    sys.exit(1)
+
+try:
+    from libs import workspace, xmllayout
+except ImportError:
+    print('Error: libs.workspace.py or libs.xmllayout.py missing. Please ensure they are in the libs directory.')
+    sys.exit(1)
+
+try:
+    from libs.refpack import load_pack
+except ImportError:
+    load_pack = None # Fall back to reading the name lists directly
+
 # Color definitions (optional, for consistency)
 if os.name == 'posix':
     red = '\u001b[31m'
@@ -26,6 +48,13 @@ else:
     red = green = yellow = cyan = reset = bold = ''
 
 
+class Printer:
+    """Simple utility to print data to stdout on one line, overwriting previous."""
+    def __init__(self, data):
+        sys.stdout.write("\r\x1b[K" + str(data))
+        sys.stdout.flush()
+
+
 class ContractGenerator:
     """
     Generates contract XML files based on data from kp.csv and XML templates.
@@ -33,7 +62,7 @@ class ContractGenerator:
 
     def __init__(self, kp_csv_path="kp.csv",
                  template_path="libs/sopimus_template.xml",
-                 output_dir="xml/"):
+                 output_dir="xml/", record_path="contracts.db"):
         """
         Initializes the ContractGenerator.
 
@@ -41,10 +70,12 @@ class ContractGenerator:
             kp_csv_path (str): Path to the input CSV file containing accounting point data.
             template_path (str): Path to the XML template for contracts.
             output_dir (str): Directory where generated XML files will be saved.
+            record_path (str): SQLite record of already generated contracts.
         """
         self.kp_csv_path = kp_csv_path
         self.xml_template_path = template_path
         self.xml_output_dir = output_dir
+        self.xml_layout = xmllayout.configured() # flat or sharded xml/, see libs/xmllayout.py
 
         self.name_files = {
             'mies': 'libs/mies.txt',      # Finnish male first names
@@ -53,9 +84,17 @@ class ContractGenerator:
         }
         self.loaded_names = {'mies': [], 'nainen': [], 'sukunimet': []}
 
+        # Tracks issued HETUs so a batch never hands the same consumer ID out twice
+        self.hetu_generator = HetuGenerator(start_year=1900, end_year=1999)
+
         self._ensure_output_dir_exists()
         self._load_name_lists()
 
+        # APs with an existing contract are skipped, their HETUs stay reserved
+        self.record = ContractRecord(record_path, output_dir)
+        for hetu in self.record.hetus():
+            self.hetu_generator.mark_issued(hetu)
+
     def _ensure_output_dir_exists(self):
         """Ensures the XML output directory exists."""
         try:
@@ -66,7 +105,16 @@ class ContractGenerator:
             # For now, script will likely fail later if dir cannot be written to.
 
     def _load_name_lists(self):
-        """Loads first and last names from text files."""
+        """Loads first and last names from the reference pack, or from text files as fallback."""
+        if load_pack is not None:
+            try:
+                pack = load_pack()
+                # Memory-mapped sections, names are decoded only when sampled
+                self.loaded_names = {category: pack.section(category) for category in self.name_files}
+                return
+            except (OSError, ValueError, KeyError) as e:
+                print(f"{yellow}Warning: Reference pack unavailable ({e}), reading name lists instead.{reset}")
+
         for category, filepath in self.name_files.items():
             try:
                 with open(filepath, 'r', encoding='latin-1') as f: # Original used latin-1
@@ -78,38 +126,17 @@ class ContractGenerator:
             except IOError as e:
                 print(f"{yellow}Warning: Could not read name list file {filepath}: {e}{reset}")
 
-    def _generate_hetu(self, start_year=1900, end_year=1999):
+    def _generate_hetu(self):
         """
-        Generates a random Finnish social security number (HETU).
-        Original logic from sopimusgen.py.
+        Generates a random Finnish social security number (HETU),
+        unique within this generator.
         """
-        CHECK_KEYS = "0123456789ABCDEFHJKLMNPRSTUVWXY"
-        CENTURIES = {'18': '+', '19': '-', '20': 'A'} # Add more if needed for broader year ranges
-
-        year = ra.randint(start_year, end_year)
-        month = ra.randint(1, 12)
-        day = ra.randint(1, calendar.monthrange(year, month)[1])
-
-        year_str = str(year)
-        century_code = year_str[0:2]
-        century_sep = CENTURIES.get(century_code, 'A') # Default to 'A' if century not in map
-
-        # Individual number part (originally 900-999 for test range, can be 002-899 for real)
-        # For broader unique HETUs, this range should be wider.
-        order_num = ra.randint(2, 899) # More realistic range
-
-        # Format: DDMMYYCIIIT (Day, Month, Year (last two digits), Century Separator, Individual number (3 digits), Checksum char)
-        hetu_base_num_str = f"{day:02d}{month:02d}{year_str[2:4]}{order_num:03d}"
-
         try:
-            check_number_val = int(hetu_base_num_str)
-            checksum_char = CHECK_KEYS[check_number_val % 31]
-        except ValueError: # Should not happen if logic is correct
-            print(f"{red}Error generating HETU checksum, numeric part invalid: {hetu_base_num_str}{reset}")
+            return self.hetu_generator.next()
+        except ValueError as e: # Identity space exhausted
+            print(f"{red}Error generating HETU: {e}{reset}")
             return "ERRORHETU0X" # Placeholder for error
 
-        return f"{day:02d}{month:02d}{year_str[2:4]}{century_sep}{order_num:03d}{checksum_char}"
-
     def _generate_henkilo(self):
         """
         Generates a random Finnish person's name.
@@ -117,17 +144,17 @@ class ContractGenerator:
         """
         try:
             if ra.randint(0, 1): # 50/50 chance for male/female first name
-                if self.loaded_names['mies']:
+                if len(self.loaded_names['mies']):
                     etunimi = ra.choice(self.loaded_names['mies'])
                 else: # Fallback if male names not loaded
                     etunimi = "Matti"
             else:
-                if self.loaded_names['nainen']:
+                if len(self.loaded_names['nainen']):
                     etunimi = ra.choice(self.loaded_names['nainen'])
                 else: # Fallback if female names not loaded
                     etunimi = "Maija"
 
-            if self.loaded_names['sukunimet']:
+            if len(self.loaded_names['sukunimet']):
                 sukunimi = ra.choice(self.loaded_names['sukunimet'])
             else: # Fallback if last names not loaded
                 sukunimi = "Meikäläinen"
@@ -201,8 +228,14 @@ class ContractGenerator:
             find_and_set([(ns_f04, "ConsumerInvolvedCustomerParty"), (ns_f04, "Identifier")], contract_data.get('hetu_val'))
             find_and_set([(ns_f04, "Name")], contract_data.get('henkilo_val')) # Name of the consumer
 
-            output_file_path = os.path.join(self.xml_output_dir, f"sopimus_{contract_data['ap']}.xml")
-            tree.write(output_file_path, encoding='utf-8', xml_declaration=True)
+            output_file_name = f"sopimus_{contract_data['ap']}.xml"
+            output_file_path = xmllayout.path_for(self.xml_output_dir, output_file_name, self.xml_layout)
+            # A file or a segment record, see libs/xmllayout.py
+            with xmllayout.create(self.xml_output_dir, output_file_name, self.xml_layout) as f:
+                f.write("<?xml version='1.0' encoding='utf-8'?>\n")
+                tree.write(f, encoding='unicode')
+            self.record.record(contract_data['ap'], contract_data.get('hetu_val'),
+                               contract_data.get('henkilo_val'), output_file_name)
             print(f"Generated contract XML: {output_file_path}")
             return True
         except IOError as e:
@@ -213,7 +246,8 @@ class ContractGenerator:
 
     def generate_contracts(self):
         """
-        Reads accounting point data from kp.csv and generates contract XML files.
+        Reads accounting point data from kp.csv and generates contract XML files
+        for the APs that do not have a contract yet.
         """
         print(f"{cyan}Starting contract generation from {self.kp_csv_path}...{reset}")
         if not os.path.exists(self.kp_csv_path):
@@ -222,6 +256,8 @@ class ContractGenerator:
 
         generated_count = 0
         failed_count = 0
+        skipped_count = 0
+        existing_ids = self.record.ids()
         try:
             with open(self.kp_csv_path, 'r', newline='', encoding='utf-8') as csvfile:
                 reader = csv.DictReader(csvfile)
@@ -241,6 +277,11 @@ class ContractGenerator:
                             print(f"{yellow}Warning: Skipping row {row_num + 2} in {self.kp_csv_path} due to missing required data (AP, Supplier, or MGA).{reset}")
                             continue
 
+                        if ap_id in existing_ids:
+                            skipped_count += 1
+                            continue
+                        existing_ids.add(ap_id) # Duplicate rows in kp.csv get one contract
+
                         hetu_val = self._generate_hetu()
                         henkilo_val = self._generate_henkilo()
 
@@ -255,6 +296,8 @@ class ContractGenerator:
                         Printer(f"Processing AP: {ap_id}...")
                         if self._produce_single_xml(current_contract_data):
                             generated_count +=1
+                            if generated_count % 1000 == 0:
+                                self.record.commit()
                         else:
                             failed_count += 1
 
@@ -270,18 +313,23 @@ class ContractGenerator:
             print(f"{cyan}Contract generation process finished.{reset}")
             if generated_count > 0: print(f"{green}Successfully generated {generated_count} contract XML files.{reset}")
             if failed_count > 0: print(f"{red}Failed to generate {failed_count} contract XML files.{reset}")
-            if generated_count == 0 and failed_count == 0 : print(f"{yellow}No data processed from {self.kp_csv_path}. File might be empty or all rows had issues.{reset}")
+            if skipped_count > 0: print(f"{cyan}Skipped {skipped_count} APs that already have a contract.{reset}")
+            if generated_count == 0 and failed_count == 0 and skipped_count == 0: print(f"{yellow}No data processed from {self.kp_csv_path}. File might be empty or all rows had issues.{reset}")
 
         except FileNotFoundError: # Should be caught by initial os.path.exists, but as safeguard
              print(f"{red}Error: Input CSV file '{self.kp_csv_path}' disappeared during processing.{reset}")
         except Exception as e: # Catch other potential errors like CSV parsing issues at file level
             print(f"{red}Error reading or parsing {self.kp_csv_path}: {e}{reset}")
+        finally:
+            self.record.commit()
 
 
 if __name__ == "__main__":
     print(f"{cyan}--- Contract Generator (sopimusgen.py) ---{reset}")
     try:
-        generator = ContractGenerator()
+        workspace.from_argv(sys.argv[1:])
+        generator = ContractGenerator(kp_csv_path=workspace.path('kp.csv'), output_dir=workspace.path('xml/'),
+                                      record_path=workspace.path('contracts.db'))
         generator.generate_contracts()
     except FileNotFoundError as e: # e.g., if libs/template or name files are missing and constructor fails
         print(f"{red}{bold}Critical file error during initialization: {e}{reset}")
@@ -294,5 +342,3 @@ if __name__ == "__main__":
         print(f"{red}{bold}An unexpected critical error occurred:\n{e}\n{traceback.format_exc()}{reset}")
     finally:
         print(f"{cyan}--- sopimusgen.py finished ---{reset}")
-
-```
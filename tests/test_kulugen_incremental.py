@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Incremental kulugen runs of E14 reading-metered APs: a later run continues
+a partial read period instead of taking it as covered.
+
+    python3 -m pytest tests
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import kulugen
+from libs import workspace
+
+AP_ID = '642702010000000017'
+KP_CSV = ("Accounting point,Metering Area,Supplier,DSO,MGA,ZIP,Street,City,AP type,Remote readable,Metering method\n"
+          f"{AP_ID},6427020100000000,6427010100003,6427020100000,6427020100000000,00100,testikatu,helsinki,AG01,0,E14\n")
+
+
+class IncrementalE14Test(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        os.chdir(REPO) # XML templates are read from libs/
+        self.tmp = tempfile.TemporaryDirectory()
+        workspace.select(self.tmp.name)
+        with open(workspace.path('kp.csv'), 'w', encoding='utf-8') as f:
+            f.write(KP_CSV)
+        with open(workspace.path('rp.csv'), 'w', encoding='utf-8') as f:
+            f.write("id,dso,in,out,min,max\n") # No exchange points
+
+    def tearDown(self):
+        workspace.select('')
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def run_kulugen(self, start, days, incremental):
+        generator = kulugen.ConsumptionGenerator({'start_date_str': start, 'num_days_str': days,
+                                                  'incremental': incremental})
+        generator.e14_read_period = kulugen.MONTHLY
+        generator.run()
+
+    def test_partial_month_continued(self):
+        self.run_kulugen('01.10.2025', '5', False)
+        self.run_kulugen('01.10.2025', '31', True)
+
+        conn = sqlite3.connect(workspace.path('fingrid.db'))
+        reads = conn.execute("SELECT TIMESTAMP, KULUTUS FROM apoint WHERE APOINT_ID = ? ORDER BY TIMESTAMP",
+                             (AP_ID,)).fetchall()
+        last_ts = conn.execute("SELECT LAST_TS FROM read_coverage WHERE APOINT_ID = ?", (AP_ID,)).fetchone()[0]
+        conn.close()
+        # 1.-5.10. from the first run, the rest of October from the second (local midnights in UTC)
+        self.assertEqual([ts for ts, _ in reads], ['2025-09-30 21:00:00', '2025-10-05 21:00:00'])
+        self.assertEqual(last_ts, '2025-10-31 21:00:00')
+
+        # The register of the second read continues from the first one
+        with open(workspace.path('xml', f'kulutus_{AP_ID}_06102025.xml'), encoding='utf-8') as f:
+            quantity = float(f.read().split('<Quantity>')[1].split('<')[0])
+        expected = kulugen.register_start(AP_ID) + sum(kwh for _, kwh in reads)
+        self.assertAlmostEqual(quantity, expected, places=3)
+
+
+if __name__ == '__main__':
+    unittest.main()